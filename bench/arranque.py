@@ -0,0 +1,116 @@
+# Costo de arranque de las apps Dash: tiempo de importar multi_app (sin la carga de datos), tiempo
+# de la primera visita a cada página (la primera petición de cada app Dash arma sus scripts y valida
+# su layout), memoria del proceso y cantidad de rutas y callbacks registrados.
+#
+# Cada medición corre en un proceso nuevo con un CSV sintético chico (bench/datos/) y la carga en
+# primer plano, así que la diferencia entre versiones viene de Dash y no de los datos. Para comparar
+# con otra versión del código, pasar su checkout en --repos (por ejemplo uno creado con
+# git worktree add /tmp/anterior <commit>). Funciona con una app Dash por vista o con una sola app
+# con páginas.
+#
+# Uso:
+#   python bench/arranque.py --repos . /tmp/anterior --repeticiones 5
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from suite import archivos_sinteticos  # noqa: E402
+
+PAGINAS = ['/edad/', '/espera/', '/modalidad/', '/asegurados/', '/tiempo/', '/simulador/', '/cruzado/']
+
+
+def memoria_mb():
+    with open('/proc/self/status') as f:
+        for linea in f:
+            if linea.startswith('VmRSS:'):
+                return int(linea.split()[1]) / 1024
+    return None
+
+
+# Se ejecuta en el subproceso, con el directorio del checkout como directorio de trabajo
+def medir(repo):
+    sys.path.insert(0, repo)
+    memoria_inicial = memoria_mb()
+    inicio = time.perf_counter()
+    import multi_app
+    import dash
+    importar = time.perf_counter() - inicio - multi_app.estado_carga['tiempos'].get('total', 0)
+    memoria_importar = memoria_mb()
+
+    con_paginas = bool(dash.page_registry)
+    cliente = multi_app.server.test_client()
+    primeras = {}
+    for pagina in PAGINAS:
+        inicio = time.perf_counter()
+        assert cliente.get(pagina).status_code == 200, pagina
+        if con_paginas:
+            assert cliente.get('/_dash-layout').status_code == 200
+            assert cliente.get('/_dash-dependencies').status_code == 200
+            cuerpo = {
+                'output': '.._pages_content.children..._pages_store.data..',
+                'outputs': [{'id': '_pages_content', 'property': 'children'}, {'id': '_pages_store', 'property': 'data'}],
+                'inputs': [{'id': '_pages_location', 'property': 'pathname', 'value': pagina},
+                           {'id': '_pages_location', 'property': 'search', 'value': ''}],
+                'changedPropIds': ['_pages_location.pathname'], 'state': [],
+            }
+            assert cliente.post('/_dash-update-component', json=cuerpo).status_code == 200, pagina
+        else:
+            assert cliente.get(pagina + '_dash-layout').status_code == 200, pagina
+            assert cliente.get(pagina + '_dash-dependencies').status_code == 200, pagina
+        primeras[pagina] = time.perf_counter() - inicio
+
+    apps = [valor for valor in vars(multi_app).values() if isinstance(valor, dash.Dash)]
+    return {
+        'con_paginas': con_paginas,
+        'apps_dash': len(apps),
+        'callbacks': sum(len(app.callback_map) for app in apps),
+        'rutas_flask': len(list(multi_app.server.url_map.iter_rules())),
+        'importar_s': importar,
+        'primera_visita_s': sum(primeras.values()),
+        'memoria_importar_mb': memoria_importar - memoria_inicial,
+        'memoria_final_mb': memoria_mb() - memoria_inicial,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Arranque y memoria de las apps Dash')
+    parser.add_argument('--repos', nargs='+', default=[os.path.dirname(os.path.dirname(os.path.abspath(__file__)))],
+                        help='Checkouts de multi_app.py a comparar')
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--filas', type=int, default=10000)
+    parser.add_argument('--medir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.medir:
+        print(json.dumps(medir(args.medir)))
+        return
+
+    csv, modelo = archivos_sinteticos(args.filas, 0)
+    print(f"{'checkout':<32} {'apps':>5} {'callbacks':>9} {'rutas':>6} {'importar s':>11} "
+          f"{'1ª visita s':>12} {'RSS import MB':>14} {'RSS final MB':>13}")
+    for repo in args.repos:
+        repo = os.path.abspath(repo)
+        corridas = []
+        for _ in range(args.repeticiones):
+            with tempfile.TemporaryDirectory() as snapshot:
+                entorno = {**os.environ, 'DATOS_CSV_LOCAL': csv, 'MODELO_LOCAL': modelo, 'SNAPSHOT_DIR': snapshot,
+                           'CARGA_EN_SEGUNDO_PLANO': '0', 'REFRESCO_SEGUNDOS': '0', 'LOG_LEVEL': 'WARNING'}
+                salida = subprocess.run([sys.executable, os.path.abspath(__file__), '--medir', repo],
+                                        cwd=repo, env=entorno, capture_output=True, text=True)
+            if salida.returncode != 0:
+                sys.exit(f"La medición de {repo} falló:\n{salida.stderr[-2000:]}")
+            corridas.append(json.loads(salida.stdout.strip().splitlines()[-1]))
+        m = {clave: statistics.median(c[clave] for c in corridas) for clave in corridas[0]}
+        print(f"{repo[-32:]:<32} {m['apps_dash']:>5.0f} {m['callbacks']:>9.0f} {m['rutas_flask']:>6.0f} "
+              f"{m['importar_s']:>11.3f} {m['primera_visita_s']:>12.3f} {m['memoria_importar_mb']:>14.1f} "
+              f"{m['memoria_final_mb']:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+# Generador de carga de punta a punta sobre el endpoint _dash-update-component.
+#
+# Levanta gunicorn -c gunicorn.conf.py en un puerto local con datos sintéticos (los mismos CSV y
+# modelo que bench/suite.py, en bench/datos/) o usa un servidor ya levantado (--url). Las peticiones
+# se arman como las arma el navegador: las dependencias salen de /_dash-dependencies y los valores
+# clicables (barras, sectores, meses, especialidades, categorías de los filtros) del layout de cada
+# página, que llega por el callback de enrutamiento de Dash, así que los clics son de categorías
+# que existen. Abrir una página también es una acción (el mismo callback de enrutamiento).
+#
+# Para cada nivel de concurrencia, N usuarios virtuales envían clics durante --duracion segundos
+# (cada uno espera la respuesta y --pausa antes del siguiente) eligiendo la acción según los pesos
+# de ESCENARIOS. Se informa el throughput total y, por acción, peticiones, errores y latencia
+# p50/p95/p99. Con DRILLDOWN_EN_NAVEGADOR=1 los clics de detalle no llegan al servidor y esas
+# acciones se omiten.
+#
+# Uso:
+#   python bench/carga.py --filas 1000000 --concurrencia 1 4 16 32 --workers 2 --hilos 8
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from concurrencia import iniciar, puerto_libre  # noqa: E402
+from suite import archivos_sinteticos  # noqa: E402
+
+PAGINAS = ['/edad/', '/espera/', '/modalidad/', '/asegurados/', '/tiempo/', '/simulador/', '/cruzado/']
+
+
+# Busca en el layout serializado el componente con ese id y devuelve sus props
+def componente(layout, id_componente):
+    if isinstance(layout, list):
+        for hijo in layout:
+            encontrado = componente(hijo, id_componente)
+            if encontrado is not None:
+                return encontrado
+    elif isinstance(layout, dict):
+        props = layout.get('props', {})
+        if props.get('id') == id_componente:
+            return props
+        return componente(props.get('children'), id_componente)
+    return None
+
+
+def valores_figura(layout, id_grafico, eje):
+    valores = componente(layout, id_grafico)['figure']['data'][0][eje]
+    if isinstance(valores, dict): # Arreglo numérico codificado en binario (no debería pasar con categorías)
+        raise ValueError(f"{id_grafico}: el eje {eje} viene codificado")
+    return valores
+
+
+def opciones(layout, id_dropdown):
+    return [o['value'] if isinstance(o, dict) else o for o in componente(layout, id_dropdown)['options']]
+
+
+def clic(campo, valores):
+    return lambda azar: {'points': [{campo: azar.choice(valores)}]}
+
+
+def zoom(desde, hasta):
+    dias = (hasta - desde).days
+    def generar(azar):
+        largo = azar.choice([14, 60, 180, 400, dias])
+        inicio = desde + datetime.timedelta(days=azar.randint(0, max(0, dias - largo)))
+        return {'xaxis.range[0]': inicio.isoformat(), 'xaxis.range[1]': (inicio + datetime.timedelta(days=largo)).isoformat()}
+    return generar
+
+
+# Acciones de cada página: (nombre, peso, input que identifica el callback (o su salida, si varios
+# callbacks comparten el input), función que arma los valores de los inputs que cambian). El resto de los inputs del callback van en None, como en la
+# página recién cargada.
+def escenarios(layouts):
+    tiempo = componente(layouts['/tiempo/'], 'rango-tiempo')
+    desde = datetime.date.fromisoformat(tiempo['min_date_allowed'][:10])
+    hasta = datetime.date.fromisoformat(tiempo['max_date_allowed'][:10])
+    rango = zoom(desde, hasta)
+    especialidades = opciones(layouts['/simulador/'], 'sim-input-especialidad')
+    filtros = {props: opciones(layouts['/cruzado/'], props)
+               for props in ['cruzado-mes', 'cruzado-rango-de-edad', 'cruzado-presencial-remoto', 'cruzado-seguro', 'cruzado-sexo']}
+
+    # El botón del simulador dispara la predicción y el pronóstico con los mismos valores
+    def simulacion(azar):
+        return {'sim-predict-button.n_clicks': azar.randint(1, 20), 'sim-input-edad.value': azar.randint(0, 100),
+                'sim-input-especialidad.value': azar.choice(especialidades)}
+
+    def filtros_cruzados(azar):
+        elegidos = azar.sample(sorted(filtros), azar.randint(1, 3))
+        return {id_filtro: azar.sample(filtros[id_filtro], min(len(filtros[id_filtro]), azar.randint(1, 2)))
+                for id_filtro in elegidos}
+
+    return [
+        ('', 'abrir página', 2, '_pages_location.pathname',
+         lambda azar: {'_pages_location.pathname': azar.choice(PAGINAS), '_pages_location.search': ''}),
+        ('/edad/', 'clic en rango de edad', 3, 'histogram-edad.clickData',
+         lambda azar, c=clic('x', valores_figura(layouts['/edad/'], 'histogram-edad', 'x')): {'histogram-edad.clickData': c(azar)}),
+        ('/espera/', 'clic en rango de espera', 3, 'histogram-espera.clickData',
+         lambda azar, c=clic('x', valores_figura(layouts['/espera/'], 'histogram-espera', 'x')): {'histogram-espera.clickData': c(azar)}),
+        ('/modalidad/', 'clic en modalidad', 2, 'pie-modalidad.clickData',
+         lambda azar, c=clic('label', valores_figura(layouts['/modalidad/'], 'pie-modalidad', 'labels')): {'pie-modalidad.clickData': c(azar)}),
+        ('/asegurados/', 'clic en seguro', 2, 'pie-seguro.clickData',
+         lambda azar, c=clic('label', valores_figura(layouts['/asegurados/'], 'pie-seguro', 'labels')): {'pie-seguro.clickData': c(azar)}),
+        ('/tiempo/', 'clic en mes', 3, 'grafico-lineal.clickData',
+         lambda azar, c=clic('x', valores_figura(layouts['/tiempo/'], 'grafico-lineal', 'x')): {'grafico-lineal.clickData': c(azar)}),
+        ('/tiempo/', 'zoom en la línea', 2, 'grafico-lineal.relayoutData',
+         lambda azar: {'grafico-lineal.relayoutData': rango(azar)}),
+        ('/tiempo/', 'rango de fechas', 1, 'rango-tiempo.end_date',
+         lambda azar: dict(zip(['rango-tiempo.start_date', 'rango-tiempo.end_date'], rango(azar).values()))),
+        ('/simulador/', 'predicción', 4, 'sim-output-prediction.children', simulacion),
+        ('/simulador/', 'pronóstico', 4, 'sim-pronostico.figure', simulacion),
+        ('/cruzado/', 'filtros cruzados', 2, 'cruzado-mes.value',
+         lambda azar: {f'{id_filtro}.value': valor for id_filtro, valor in filtros_cruzados(azar).items()}),
+    ]
+
+
+# Encuentra el callback de servidor que tiene ese input (o esa salida) y devuelve una función que
+# arma el cuerpo de la petición
+def peticion(dependencias, input_cambiado, valores):
+    for dep in dependencias:
+        if dep.get('clientside_function'):
+            continue
+        ids_inputs = [f"{i['id']}.{i['property']}" for i in dep['inputs']]
+        salidas = dep['output'].strip('.').split('...')
+        if input_cambiado in ids_inputs or input_cambiado in salidas:
+            break
+    else:
+        return None
+    def armar(azar):
+        elegidos = valores(azar)
+        return {
+            'output': dep['output'],
+            'outputs': [{'id': s.rsplit('.', 1)[0], 'property': s.rsplit('.', 1)[1]} for s in salidas]
+                       if dep['output'].startswith('..') else {'id': salidas[0].rsplit('.', 1)[0], 'property': salidas[0].rsplit('.', 1)[1]},
+            'inputs': [{**i, 'value': elegidos.get(f"{i['id']}.{i['property']}")} for i in dep['inputs']],
+            'state': [{**s, 'value': elegidos.get(f"{s['id']}.{s['property']}")} for s in dep.get('state', [])],
+            'changedPropIds': [i for i in elegidos if i in ids_inputs],
+        }
+    return armar
+
+
+def layout_pagina(url, dependencias, pagina):
+    armar = peticion(dependencias, '_pages_location.pathname', lambda azar: {'_pages_location.pathname': pagina, '_pages_location.search': ''})
+    respuesta = requests.post(url + '/_dash-update-component', json=armar(None), timeout=120)
+    respuesta.raise_for_status()
+    return respuesta.json()['response']['_pages_content']['children']
+
+
+def acciones(url):
+    dependencias = requests.get(url + '/_dash-dependencies', timeout=120).json()
+    layouts = {pagina: layout_pagina(url, dependencias, pagina) for pagina in PAGINAS}
+    lista = []
+    for app, nombre, peso, input_cambiado, valores in escenarios(layouts):
+        armar = peticion(dependencias, input_cambiado, valores)
+        if armar is None:
+            print(f"Se omite '{nombre}': el callback no corre en el servidor.", file=sys.stderr)
+            continue
+        lista.append((app, nombre, peso, armar))
+    return lista
+
+
+def percentil(latencias, q):
+    return float(np.percentile(latencias, q)) if latencias else float('nan')
+
+
+def nivel(url, lista, usuarios, duracion, pausa, semilla):
+    fin = time.monotonic() + duracion
+    latencias = {nombre: [] for _, nombre, _, _ in lista}
+    errores = {nombre: 0 for _, nombre, _, _ in lista}
+    lock = threading.Lock()
+    pesos = [peso for _, _, peso, _ in lista]
+
+    def usuario(numero):
+        azar = random.Random(semilla * 1000 + numero)
+        sesion = requests.Session()
+        while time.monotonic() < fin:
+            app, nombre, _, armar = azar.choices(lista, weights=pesos)[0]
+            cuerpo = armar(azar)
+            inicio = time.perf_counter()
+            try:
+                respuesta = sesion.post(url + '/_dash-update-component', json=cuerpo, timeout=120)
+                correcto = respuesta.status_code in (200, 204) # 204: PreventUpdate
+            except requests.RequestException:
+                correcto = False
+            transcurrido = (time.perf_counter() - inicio) * 1000
+            with lock:
+                latencias[nombre].append(transcurrido)
+                errores[nombre] += not correcto
+            if pausa:
+                time.sleep(azar.expovariate(1 / pausa))
+
+    hilos = [threading.Thread(target=usuario, args=(i,)) for i in range(usuarios)]
+    inicio = time.monotonic()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return latencias, errores, time.monotonic() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Carga concurrente sobre los callbacks de Dash')
+    parser.add_argument('--concurrencia', type=int, nargs='+', default=[1, 4, 16, 32], help='Usuarios simultáneos por nivel')
+    parser.add_argument('--duracion', type=float, default=20, help='Segundos por nivel')
+    parser.add_argument('--pausa', type=float, default=0, help='Pausa media entre clics de un usuario, en segundos')
+    parser.add_argument('--filas', type=int, default=1000000, help='Filas del CSV sintético')
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1, help='WEB_CONCURRENCY del servidor local')
+    parser.add_argument('--hilos', type=int, default=8, help='GUNICORN_THREADS del servidor local')
+    parser.add_argument('--url', help='Servidor ya levantado (no se inicia uno local)')
+    parser.add_argument('--json', help='Guardar los resultados en este archivo')
+    args = parser.parse_args()
+
+    proceso, snapshot = None, None
+    if args.url:
+        url = args.url.rstrip('/')
+    else:
+        csv, modelo = archivos_sinteticos(args.filas, args.semilla)
+        snapshot = tempfile.TemporaryDirectory()
+        proceso, url = iniciar({'DATOS_CSV_LOCAL': csv, 'MODELO_LOCAL': modelo, 'SNAPSHOT_DIR': snapshot.name,
+                                'WEB_CONCURRENCY': str(args.workers), 'GUNICORN_THREADS': str(args.hilos)}, puerto_libre())
+    resultados = []
+    try:
+        lista = acciones(url)
+        for usuarios in args.concurrencia:
+            latencias, errores, segundos = nivel(url, lista, usuarios, args.duracion, args.pausa, args.semilla)
+            total = sum(len(v) for v in latencias.values())
+            todas = [ms for v in latencias.values() for ms in v]
+            print(f"\n{usuarios} usuarios: {total / segundos:.1f} peticiones/s, {sum(errores.values())} errores, "
+                  f"p50 {percentil(todas, 50):.1f} ms, p95 {percentil(todas, 95):.1f} ms, p99 {percentil(todas, 99):.1f} ms")
+            print(f"  {'acción':<26} {'peticiones':>10} {'errores':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+            por_accion = {}
+            for (app, nombre, _, _) in lista:
+                v = latencias[nombre]
+                por_accion[nombre] = {'app': app, 'peticiones': len(v), 'errores': errores[nombre],
+                                      'p50': percentil(v, 50), 'p95': percentil(v, 95), 'p99': percentil(v, 99)}
+                print(f"  {nombre:<26} {len(v):>10} {errores[nombre]:>8} {por_accion[nombre]['p50']:>9.1f} "
+                      f"{por_accion[nombre]['p95']:>9.1f} {por_accion[nombre]['p99']:>9.1f}")
+            resultados.append({'usuarios': usuarios, 'peticiones_por_segundo': total / segundos,
+                               'errores': sum(errores.values()), 'p50': percentil(todas, 50), 'p95': percentil(todas, 95),
+                               'p99': percentil(todas, 99), 'acciones': por_accion})
+    finally:
+        if proceso is not None:
+            proceso.terminate()
+            proceso.wait()
+            snapshot.cleanup()
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'url': url, 'workers': args.workers, 'hilos': args.hilos, 'filas': args.filas,
+                       'duracion': args.duracion, 'pausa': args.pausa, 'niveles': resultados}, f, indent=2)
+    sys.exit(1 if any(r['errores'] for r in resultados) else 0)
+
+
+if __name__ == '__main__':
+    main()
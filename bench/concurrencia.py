@@ -0,0 +1,142 @@
+# Servicio concurrente con gunicorn: un worker sync frente a un worker gthread con el pool acotado.
+#
+# Para cada configuración levanta gunicorn -c gunicorn.conf.py en un puerto local (un solo worker,
+# para que la diferencia venga de los hilos y no de los procesos) y, mientras varios clientes
+# envían lotes grandes a /api/predicciones, mide la latencia de /healthz y de una figura que ya
+# está en la caché. Verifica que todas las respuestas sean 200 (o 503 con Retry-After cuando la
+# cola del pool está llena) y que los lotes concurrentes devuelvan lo mismo que uno secuencial.
+#
+# Uso:
+#   python bench/concurrencia.py --clientes 8 --registros 20000 --duracion 10
+import argparse
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+import requests
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIGURACIONES = [
+    ('sync', {'GUNICORN_WORKER_CLASS': 'sync', 'GUNICORN_THREADS': '1'}),
+    ('gthread', {'GUNICORN_WORKER_CLASS': 'gthread', 'GUNICORN_THREADS': '8', 'EJECUTOR_HILOS': '2'}),
+    ('gthread cola 0', {'GUNICORN_WORKER_CLASS': 'gthread', 'GUNICORN_THREADS': '8', 'EJECUTOR_HILOS': '1',
+                        'EJECUTOR_COLA_MAX': '0'}),
+]
+
+CLIC_EDAD = {
+    'output': 'pie-chart-edad.figure',
+    'outputs': {'id': 'pie-chart-edad', 'property': 'figure'},
+    'inputs': [{'id': 'histogram-edad', 'property': 'clickData', 'value': {'points': [{'x': 'Adulto'}]}}],
+    'changedPropIds': ['histogram-edad.clickData'],
+}
+
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# Los códigos de especialidades_dic van de 0 a 62 (sin importar multi_app, que cargaría los datos)
+def registros_aleatorios(n, semilla=0):
+    azar = random.Random(semilla)
+    hoy = date.today()
+    return [
+        {'especialidad': azar.randint(0, 62), 'edad': azar.randint(0, 100),
+         'fecha': (hoy + timedelta(days=azar.randint(0, 60))).isoformat()}
+        for _ in range(n)
+    ]
+
+
+def iniciar(entorno, puerto):
+    proceso = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{puerto}', 'multi_app:server'],
+        cwd=RAIZ, env={**os.environ, 'WEB_CONCURRENCY': '1', 'LOG_LEVEL': 'WARNING', **entorno},
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f'http://127.0.0.1:{puerto}'
+    for _ in range(600):
+        try:
+            if requests.get(url + '/readyz', timeout=1).status_code == 200:
+                return proceso, url
+        except requests.ConnectionError:
+            pass
+        if proceso.poll() is not None:
+            sys.exit("gunicorn terminó antes de estar listo.")
+        time.sleep(0.5)
+    proceso.terminate()
+    sys.exit("gunicorn no estuvo listo a tiempo.")
+
+
+def medir(url, registros, esperado, clientes, duracion):
+    fin = time.monotonic() + duracion
+    resultados = {'lotes': 0, 'rechazos': 0, 'distintos': 0, 'errores': 0}
+    lock = threading.Lock()
+
+    def cliente():
+        while time.monotonic() < fin:
+            respuesta = requests.post(url + '/api/predicciones', json=registros, timeout=120)
+            with lock:
+                if respuesta.status_code == 503 and respuesta.headers.get('Retry-After'):
+                    resultados['rechazos'] += 1
+                elif respuesta.status_code != 200:
+                    resultados['errores'] += 1
+                else:
+                    resultados['lotes'] += 1
+                    resultados['distintos'] += respuesta.content != esperado
+
+    hilos = [threading.Thread(target=cliente) for _ in range(clientes)]
+    for hilo in hilos:
+        hilo.start()
+    latencias = {'/healthz': [], 'figura en caché': []}
+    while time.monotonic() < fin:
+        for nombre, peticion in [('/healthz', lambda: requests.get(url + '/healthz', timeout=120)),
+                                 ('figura en caché', lambda: requests.post(url + '/_dash-update-component',
+                                                                           json=CLIC_EDAD, timeout=120))]:
+            inicio = time.perf_counter()
+            respuesta = peticion()
+            latencias[nombre].append((time.perf_counter() - inicio) * 1000)
+            if respuesta.status_code not in (200, 503):
+                resultados['errores'] += 1
+        time.sleep(0.05)
+    for hilo in hilos:
+        hilo.join()
+    return resultados, latencias
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servicio concurrente: sync vs gthread')
+    parser.add_argument('--clientes', type=int, default=8, help='Clientes enviando lotes a la vez')
+    parser.add_argument('--registros', type=int, default=20000, help='Registros por lote')
+    parser.add_argument('--duracion', type=float, default=10, help='Segundos de carga por configuración')
+    args = parser.parse_args()
+
+    registros = registros_aleatorios(args.registros)
+    print(f"{'configuración':>15} {'lotes':>6} {'503':>5} {'distintos':>10} {'errores':>8} "
+          f"{'healthz p50 ms':>15} {'healthz máx ms':>15} {'figura p50 ms':>14}")
+    fallo = False
+    for nombre, entorno in CONFIGURACIONES:
+        proceso, url = iniciar(entorno, puerto_libre())
+        try:
+            requests.post(url + '/_dash-update-component', json=CLIC_EDAD, timeout=120) # Deja la figura en caché
+            esperado = requests.post(url + '/api/predicciones', json=registros, timeout=120).content
+            r, latencias = medir(url, registros, esperado, args.clientes, args.duracion)
+        finally:
+            proceso.terminate()
+            proceso.wait()
+        salud = latencias['/healthz']
+        print(f"{nombre:>15} {r['lotes']:>6} {r['rechazos']:>5} {r['distintos']:>10} {r['errores']:>8} "
+              f"{statistics.median(salud):>15.1f} {max(salud):>15.1f} {statistics.median(latencias['figura en caché']):>14.1f}")
+        fallo |= r['distintos'] > 0 or r['errores'] > 0
+    sys.exit(1 if fallo else 0)
+
+
+if __name__ == '__main__':
+    main()
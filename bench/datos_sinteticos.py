@@ -0,0 +1,116 @@
+# Generador de datos sintéticos para medir sin Google Drive ni Hugging Face.
+#
+# Escribe un CSV de citas con el mismo esquema que la fuente real (DIA_SOLICITACITA, EDAD,
+# DIFERENCIA_DIAS, ESPECIALIDAD, PRESENCIAL_REMOTO, SEGURO, ATENDIDO, SEXO y algunas columnas que
+# los dashboards no usan) ordenado por fecha, y entrena un Random Forest chico con las mismas
+# características que el modelo real (COLUMNAS_MODELO) guardado con joblib. Con DATOS_CSV_LOCAL y
+# MODELO_LOCAL apuntando a estos archivos, multi_app.py no descarga nada.
+#
+# Las especialidades se leen de especialidades_dic en multi_app.py sin importarlo (importarlo
+# iniciaría la carga de datos). El CSV se escribe por bloques, así que 10M de filas no necesitan
+# tenerlas todas en memoria.
+#
+# Uso:
+#   python bench/datos_sinteticos.py --filas 1000000 --csv citas.csv --modelo modelo.pkl
+import argparse
+import ast
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FILAS_POR_BLOQUE = 500000
+INICIO = pd.Timestamp('2023-01-01')
+DIAS = 730
+
+
+def especialidades():
+    with open(os.path.join(RAIZ, 'multi_app.py'), encoding='utf-8') as f:
+        arbol = ast.parse(f.read())
+    for nodo in arbol.body:
+        if isinstance(nodo, ast.Assign) and any(getattr(t, 'id', None) == 'especialidades_dic' for t in nodo.targets):
+            return ast.literal_eval(nodo.value)
+    raise LookupError("No se encontró especialidades_dic en multi_app.py")
+
+
+# Bloque de citas cuyas fechas caen en [dia_inicio, dia_fin); el tiempo de espera depende de la
+# especialidad, la edad y la modalidad para que el modelo tenga algo que aprender
+def bloque(azar, filas, primera, dia_inicio, dia_fin, codigos, nombres, pesos):
+    dias = np.sort(azar.integers(dia_inicio, dia_fin, filas))
+    especialidad = azar.choice(len(codigos), filas, p=pesos)
+    edad = np.clip(azar.gamma(2.5, 16, filas), 0, 105).astype(int)
+    remoto = azar.random(filas) < 0.2
+    base = 5 + (codigos[especialidad] % 12) * 4 + edad * 0.15 - remoto * 6
+    espera = np.clip(azar.gamma(2.0, np.maximum(base, 1) / 2.0), 0, 365).round().astype(int)
+    return pd.DataFrame({
+        'ID_CITA': primera + np.arange(filas),
+        'DIA_SOLICITACITA': (INICIO + pd.to_timedelta(dias, unit='D')).strftime('%Y-%m-%d'),
+        'EDAD': edad,
+        'DIFERENCIA_DIAS': espera,
+        'ESPECIALIDAD': nombres[especialidad],
+        'PRESENCIAL_REMOTO': np.where(remoto, 'REMOTO', 'PRESENCIAL'),
+        'SEGURO': np.where(azar.random(filas) < 0.7, 'SI', 'NO'),
+        'ATENDIDO': np.where(azar.random(filas) < 0.85, 'SI', 'NO'),
+        'SEXO': np.where(azar.random(filas) < 0.55, 'FEMENINO', 'MASCULINO'),
+        'ESTABLECIMIENTO': azar.integers(1, 40, filas),
+    })
+
+
+def catalogo(azar):
+    dic = especialidades()
+    codigos = np.array(sorted(dic))
+    nombres = np.array([dic[c] for c in codigos], dtype=object)
+    pesos = 1 / np.arange(1, len(codigos) + 1) ** 0.8 # Pocas especialidades concentran la mayoría
+    return codigos, nombres, azar.permutation(pesos / pesos.sum())
+
+
+def generar_csv(ruta, filas, semilla=0):
+    azar = np.random.default_rng(semilla)
+    codigos, nombres, pesos = catalogo(azar)
+    bloques = max(1, -(-filas // FILAS_POR_BLOQUE))
+    escritas = 0
+    with open(ruta, 'w', encoding='utf-8', newline='') as f:
+        for i in range(bloques):
+            n = filas // bloques + (i < filas % bloques)
+            datos = bloque(azar, n, escritas, DIAS * i // bloques, DIAS * (i + 1) // bloques, codigos, nombres, pesos)
+            datos.to_csv(f, index=False, header=(i == 0))
+            escritas += n
+
+
+# Se entrena con citas generadas con la misma semilla (las mismas especialidades y pesos que el CSV)
+def entrenar_modelo(ruta_modelo, filas=50000, semilla=0):
+    azar = np.random.default_rng(semilla)
+    codigos, nombres, pesos = catalogo(azar)
+    datos = bloque(azar, filas, 0, 0, DIAS, codigos, nombres, pesos)
+    fecha = pd.to_datetime(datos['DIA_SOLICITACITA'])
+    X = pd.DataFrame({
+        'ESPECIALIDAD_cod': datos['ESPECIALIDAD'].map({nombre: codigo for codigo, nombre in zip(codigos, nombres)}),
+        'EDAD': datos['EDAD'],
+        'día': fecha.dt.day,
+        'semana_del_año': fecha.dt.isocalendar().week.astype(int),
+    })
+    modelo = RandomForestRegressor(n_estimators=30, max_depth=10, random_state=semilla, n_jobs=-1)
+    modelo.fit(X, datos['DIFERENCIA_DIAS'])
+    joblib.dump(modelo, ruta_modelo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CSV de citas sintético y modelo de reemplazo')
+    parser.add_argument('--filas', type=int, default=100000)
+    parser.add_argument('--csv', default='citas_sinteticas.csv')
+    parser.add_argument('--modelo', help='Ruta del .pkl a entrenar (opcional)')
+    parser.add_argument('--semilla', type=int, default=0)
+    args = parser.parse_args()
+
+    generar_csv(args.csv, args.filas, args.semilla)
+    print(f"{args.filas} filas en {args.csv} ({os.path.getsize(args.csv) / 1024**2:.1f} MB)")
+    if args.modelo:
+        entrenar_modelo(args.modelo, semilla=args.semilla)
+        print(f"Modelo en {args.modelo} ({os.path.getsize(args.modelo) / 1024**2:.1f} MB)")
+
+
+if __name__ == '__main__':
+    main()
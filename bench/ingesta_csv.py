@@ -0,0 +1,75 @@
+# Memoria pico y tiempo de la lectura del CSV: completa (read_csv de todo el archivo y
+# preprocesar_datos, como antes) frente a leer_csv por bloques con tipos declarados.
+#
+# La memoria se mide como el pico de RSS del proceso (VmHWM, reiniciado con /proc/self/clear_refs)
+# por encima del RSS previo a cada lectura, así que solo funciona en Linux. También se muestra el
+# pico estimado que reporta leer_csv y el tamaño final del DataFrame.
+#
+# Uso:
+#   python bench/ingesta_csv.py datos.csv --bloques 50000 200000
+import argparse
+import contextlib
+import gc
+import io
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import multi_app  # noqa: E402
+
+multi_app.esperar_carga()
+
+
+def leer_status(campo):
+    with open('/proc/self/status') as f:
+        for linea in f:
+            if linea.startswith(campo + ':'):
+                return int(linea.split()[1]) / 1024  # kB -> MB
+    return 0.0
+
+
+def medir(funcion):
+    gc.collect()
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')  # reinicia VmHWM al RSS actual
+    antes = leer_status('VmRSS')
+    inicio = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        resultado = funcion()
+    segundos = time.perf_counter() - inicio
+    return resultado, segundos, leer_status('VmHWM') - antes
+
+
+def completo(ruta):
+    return multi_app.preprocesar_datos(pd.read_csv(ruta)), None
+
+
+def por_bloques(ruta, filas):
+    multi_app.TAMANO_BLOQUE_CSV = filas
+    with open(ruta, 'rb') as archivo:
+        return multi_app.leer_csv(archivo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memoria pico de la lectura del CSV')
+    parser.add_argument('csv')
+    parser.add_argument('--bloques', type=int, nargs='+', default=[50000, 200000])
+    args = parser.parse_args()
+
+    print(f"{'lectura':>18} {'segundos':>9} {'pico RSS MB':>12} {'pico estimado MB':>17} {'df final MB':>12}")
+    # La lectura completa va al final: el allocator reutiliza la memoria liberada y subestimaría
+    # las mediciones posteriores
+    casos = [(f"bloques de {n}", lambda n=n: por_bloques(args.csv, n)) for n in args.bloques]
+    casos.append(('completa', lambda: completo(args.csv)))
+    for nombre, funcion in casos:
+        (df, pico_estimado), segundos, pico_rss = medir(funcion)
+        estimado = f"{pico_estimado:.1f}" if pico_estimado is not None else '-'
+        print(f"{nombre:>18} {segundos:>9.2f} {pico_rss:>12.1f} {estimado:>17} {multi_app._memoria_mb(df):>12.1f}")
+        del df
+
+
+if __name__ == '__main__':
+    main()
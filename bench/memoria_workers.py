@@ -0,0 +1,123 @@
+# Mide la memoria por worker de Gunicorn a medida que aumenta --workers.
+#
+# Arranca `gunicorn -c gunicorn.conf.py multi_app:server` para cada cantidad de workers, espera a
+# que responda, visita las páginas (cada una con el callback del router de Dash pages, que arma su
+# layout) y lee /proc/<pid>/smaps_rollup (solo Linux)
+# del maestro y de cada worker. RSS cuenta también las páginas compartidas; PSS las reparte entre
+# los procesos que las comparten, así que la suma de PSS es la memoria física real del servicio.
+#
+# Uso:
+#   python bench/memoria_workers.py --workers 1 2 4
+#   python bench/memoria_workers.py --workers 1 2 4 --sin-preload   # comparación sin compartir
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import requests
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGINAS = ['/', '/edad/', '/espera/', '/modalidad/', '/asegurados/', '/tiempo/', '/simulador/', '/cruzado/']
+
+
+def visitar(base, pagina, limite_segundos):
+    assert requests.get(base + pagina, timeout=limite_segundos).status_code == 200, pagina
+    cuerpo = {
+        'output': '.._pages_content.children..._pages_store.data..',
+        'outputs': [{'id': '_pages_content', 'property': 'children'}, {'id': '_pages_store', 'property': 'data'}],
+        'inputs': [{'id': '_pages_location', 'property': 'pathname', 'value': pagina},
+                   {'id': '_pages_location', 'property': 'search', 'value': ''}],
+        'changedPropIds': ['_pages_location.pathname'], 'state': [],
+    }
+    respuesta = requests.post(base + '/_dash-update-component', json=cuerpo, timeout=limite_segundos)
+    assert respuesta.status_code == 200, (pagina, respuesta.status_code)
+
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def memoria_kb(pid):
+    valores = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for linea in f:
+            partes = linea.split()
+            if len(partes) >= 2 and partes[0].endswith(':') and partes[1].isdigit():
+                valores[partes[0][:-1]] = int(partes[1])
+    return valores
+
+
+def hijos(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(p) for p in f.read().split()]
+
+
+def esperar_servidor(url, proceso, limite_segundos):
+    inicio = time.time()
+    while time.time() - inicio < limite_segundos:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"Gunicorn terminó con código {proceso.returncode}")
+        try:
+            requests.get(url, timeout=2)
+            return time.time() - inicio
+        except requests.exceptions.RequestException:
+            time.sleep(0.5)
+    raise TimeoutError(f"El servidor no respondió en {limite_segundos} s")
+
+
+def medir(app, n_workers, preload, limite_segundos):
+    puerto = puerto_libre()
+    entorno = dict(os.environ, GUNICORN_PRELOAD='1' if preload else '0')
+    proceso = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', app,
+         '--workers', str(n_workers), '--bind', f'127.0.0.1:{puerto}'],
+        cwd=RAIZ, env=entorno, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        base = f'http://127.0.0.1:{puerto}'
+        arranque = esperar_servidor(base + '/', proceso, limite_segundos)
+        # Esperar a que todos los workers estén vivos (sin preload cada uno carga los datos)
+        while len(hijos(proceso.pid)) < n_workers:
+            time.sleep(0.5)
+        for _ in range(n_workers * 2):
+            for pagina in PAGINAS:
+                visitar(base, pagina, limite_segundos)
+        time.sleep(1)
+        maestro = memoria_kb(proceso.pid)
+        por_worker = [memoria_kb(pid) for pid in hijos(proceso.pid)]
+    finally:
+        proceso.terminate()
+        proceso.wait(timeout=30)
+    return {
+        'workers': n_workers,
+        'arranque_s': arranque,
+        'maestro_rss_mb': maestro['Rss'] / 1024,
+        'worker_rss_mb': sum(w['Rss'] for w in por_worker) / len(por_worker) / 1024,
+        'worker_pss_mb': sum(w['Pss'] for w in por_worker) / len(por_worker) / 1024,
+        'worker_privada_mb': sum(w['Private_Clean'] + w['Private_Dirty'] for w in por_worker) / len(por_worker) / 1024,
+        'total_pss_mb': (maestro['Pss'] + sum(w['Pss'] for w in por_worker)) / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memoria por worker de Gunicorn según --workers')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--app', default='multi_app:server')
+    parser.add_argument('--sin-preload', action='store_true', help='Cada worker carga sus propios datos')
+    parser.add_argument('--limite', type=float, default=600, help='Segundos máximos de arranque')
+    args = parser.parse_args()
+
+    print(f"{'workers':>7} {'arranque s':>10} {'maestro RSS':>12} {'worker RSS':>11} "
+          f"{'worker PSS':>11} {'worker priv.':>12} {'total PSS':>10}")
+    for n in args.workers:
+        r = medir(args.app, n, not args.sin_preload, args.limite)
+        print(f"{r['workers']:>7} {r['arranque_s']:>10.1f} {r['maestro_rss_mb']:>10.1f}MB {r['worker_rss_mb']:>9.1f}MB "
+              f"{r['worker_pss_mb']:>9.1f}MB {r['worker_privada_mb']:>10.1f}MB {r['total_pss_mb']:>8.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
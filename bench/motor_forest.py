@@ -0,0 +1,93 @@
+# Compara BosqueCompilado (MOTOR_FOREST=compilado) con modelo_forest de scikit-learn.
+#
+# Importa multi_app con el motor por defecto (scikit-learn), compila el bosque a un .npz temporal,
+# lo vuelve a abrir con memory-map y:
+#   - verifica que las predicciones sean idénticas (bit a bit) sobre entradas aleatorias;
+#   - compara tiempo de carga (joblib.load del pickle vs mapeo del .npz) y tamaño en disco;
+#   - compara la latencia de una fila y de lotes.
+#
+# Uso:
+#   python bench/motor_forest.py --filas 50000 --lotes 1 100 10000
+import argparse
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import joblib
+import numpy as np
+
+os.environ['MOTOR_FOREST'] = 'sklearn'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import multi_app  # noqa: E402
+
+multi_app.esperar_carga()
+
+
+def entradas_aleatorias(n, semilla=0):
+    azar = np.random.default_rng(semilla)
+    return multi_app.caracteristicas_modelo(
+        azar.choice(list(multi_app.especialidades_dic), n),
+        azar.integers(0, 121, n),
+        azar.integers(1, 32, n),
+        azar.integers(1, 54, n),
+    )
+
+
+def latencia_ms(funcion, X, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(X)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tiempos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BosqueCompilado vs scikit-learn')
+    parser.add_argument('--filas', type=int, default=50000, help='Filas para la verificación de igualdad')
+    parser.add_argument('--lotes', type=int, nargs='+', default=[1, 100, 10000])
+    parser.add_argument('--repeticiones', type=int, default=20)
+    args = parser.parse_args()
+
+    modelo = multi_app.modelo_forest
+    if modelo is None:
+        sys.exit("El modelo no está cargado; no se puede medir.")
+    pickle = io.BytesIO()
+    joblib.dump(modelo, pickle)
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        ruta = os.path.join(carpeta, 'modelo.npz')
+        multi_app.BosqueCompilado.desde_sklearn(modelo).guardar(ruta)
+
+        inicio = time.perf_counter()
+        joblib.load(io.BytesIO(pickle.getvalue()))
+        carga_pickle = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        compilado = multi_app.BosqueCompilado.cargar(ruta)
+        carga_npz = time.perf_counter() - inicio
+
+        print(f"Tamaño: pickle {len(pickle.getvalue()) / 1024**2:.1f} MB, npz {os.path.getsize(ruta) / 1024**2:.1f} MB")
+        print(f"Carga: joblib.load {carga_pickle * 1000:.1f} ms, npz con memory-map {carga_npz * 1000:.1f} ms")
+
+        X = entradas_aleatorias(args.filas)
+        esperado = modelo.predict(X)
+        obtenido = compilado.predict(X)
+        iguales = np.array_equal(esperado, obtenido)
+        print(f"Predicciones idénticas en {args.filas} filas: {iguales} (diferencia máx. {np.abs(esperado - obtenido).max():.3g})")
+
+        print(f"{'filas':>7} {'sklearn ms':>11} {'compilado ms':>13} {'aceleración':>12}")
+        for n in args.lotes:
+            X = entradas_aleatorias(n, semilla=n)
+            ms_sklearn = latencia_ms(modelo.predict, X, args.repeticiones)
+            ms_compilado = latencia_ms(compilado.predict, X, args.repeticiones)
+            print(f"{n:>7} {ms_sklearn:>11.3f} {ms_compilado:>13.3f} {ms_sklearn / ms_compilado:>11.1f}x")
+        del compilado
+    if not iguales:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# Throughput de /api/predicciones frente a la predicción fila por fila del simulador.
+#
+# Importa multi_app (con los datos y el modelo que cargue normalmente), genera registros aleatorios
+# {especialidad, edad, fecha} y compara:
+#   - por fila: un DataFrame de una fila y una llamada a modelo_forest.predict por registro, como
+#     hacía predecir antes de la tabla precalculada;
+#   - por lote: un POST a /api/predicciones (test client de Flask) consumiendo el NDJSON completo.
+#
+# Uso:
+#   python bench/prediccion_lote.py --registros 100 1000 10000
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import multi_app  # noqa: E402
+
+multi_app.esperar_carga()
+
+
+def registros_aleatorios(n, semilla=0):
+    azar = random.Random(semilla)
+    codigos = list(multi_app.especialidades_dic)
+    hoy = date.today()
+    return [
+        {
+            'especialidad': azar.choice(codigos),
+            'edad': azar.randint(0, 100),
+            'fecha': (hoy + timedelta(days=azar.randint(0, 60))).isoformat(),
+        }
+        for _ in range(n)
+    ]
+
+
+def por_fila(registros):
+    for r in registros:
+        fecha = date.fromisoformat(r['fecha'])
+        X = multi_app.caracteristicas_modelo([r['especialidad']], [r['edad']], fecha.day, fecha.isocalendar()[1])
+        multi_app.modelo_forest.predict(X)
+
+
+def por_lote(cliente, registros):
+    respuesta = cliente.post('/api/predicciones', json=registros)
+    lineas = respuesta.get_data().count(b'\n')
+    assert respuesta.status_code == 200 and lineas == len(registros), respuesta.status_code
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput de predicción por fila vs por lote')
+    parser.add_argument('--registros', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--max-por-fila', type=int, default=2000,
+                        help='El camino por fila se mide sobre como máximo estos registros')
+    args = parser.parse_args()
+
+    if multi_app.modelo_forest is None:
+        sys.exit("El modelo no está cargado; no se puede medir.")
+    cliente = multi_app.server.test_client()
+    print(f"{'registros':>9} {'por fila reg/s':>15} {'por lote reg/s':>15} {'aceleración':>12}")
+    for n in args.registros:
+        registros = registros_aleatorios(n)
+        muestra = registros[:args.max_por_fila]
+        inicio = time.perf_counter()
+        por_fila(muestra)
+        tasa_fila = len(muestra) / (time.perf_counter() - inicio)
+        inicio = time.perf_counter()
+        por_lote(cliente, registros)
+        tasa_lote = n / (time.perf_counter() - inicio)
+        print(f"{n:>9} {tasa_fila:>15,.0f} {tasa_lote:>15,.0f} {tasa_lote / tasa_fila:>11.1f}x")
+
+
+if __name__ == '__main__':
+    main()
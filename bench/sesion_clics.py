@@ -0,0 +1,142 @@
+# Peticiones al servidor de una sesión de clics en los drill-down, con los callbacks en el servidor
+# (por defecto) y con DRILLDOWN_EN_NAVEGADOR=1.
+#
+# Cada modo corre en un subproceso (la opción se lee al importar multi_app). Se simula lo que hace el
+# renderer de Dash: carga _dash-dependencies y el layout de cada página (con el callback del router
+# de páginas, como al navegar) y, para cada clic en el gráfico principal, si la salida tiene un
+# callback clientside la figura se resuelve en el navegador (con node, si está instalado, se
+# ejecuta DRILLDOWN_CLIENTSIDE y se compara con la figura que devuelve el callback del servidor);
+# si no, se hace el POST a _dash-update-component. Los contadores de peticiones de /metrics se
+# leen antes y después de los clics de cada página, así que no cuentan la petición del router.
+#
+# Uso:
+#   python bench/sesion_clics.py --repeticiones 3
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (ruta, gráfico principal, campo del clic, salidas del drill-down, callback del servidor)
+APPS = [
+    ('/edad/', 'histogram-edad', 'x', ['pie-chart-edad'], 'update_pie_chart_edad'),
+    ('/espera/', 'histogram-espera', 'x', ['pie-chart-espera'], 'update_pie_chart_espera'),
+    ('/modalidad/', 'pie-modalidad', 'label', ['bar-especialidad-modalidad'], 'update_bar_modalidad'),
+    ('/asegurados/', 'pie-seguro', 'label', ['bar-espera-seguro'], 'update_bar_seguro'),
+    ('/tiempo/', 'grafico-lineal', 'x', ['grafico-pie-especialidades', 'grafico-pie-atencion'], 'actualizar_graficos'),
+]
+
+
+def buscar(componente, id_buscado):
+    if isinstance(componente, dict):
+        if componente.get('props', {}).get('id') == id_buscado:
+            return componente['props']
+        return buscar(componente.get('props', {}).get('children'), id_buscado)
+    if isinstance(componente, list):
+        for hijo in componente:
+            encontrado = buscar(hijo, id_buscado)
+            if encontrado is not None:
+                return encontrado
+    return None
+
+
+# Contenido de la página como lo devuelve el callback del router de Dash pages
+def layout_pagina(cliente, ruta):
+    cuerpo = {
+        'output': '.._pages_content.children..._pages_store.data..',
+        'outputs': [{'id': '_pages_content', 'property': 'children'}, {'id': '_pages_store', 'property': 'data'}],
+        'inputs': [{'id': '_pages_location', 'property': 'pathname', 'value': ruta},
+                   {'id': '_pages_location', 'property': 'search', 'value': ''}],
+        'changedPropIds': ['_pages_location.pathname'], 'state': [],
+    }
+    respuesta = cliente.post('/_dash-update-component', json=cuerpo)
+    assert respuesta.status_code == 200, (ruta, respuesta.status_code)
+    return respuesta.get_json()['response']['_pages_content']['children']
+
+
+def peticiones_update(cliente):
+    return sum(
+        int(linea.rsplit(' ', 1)[1])
+        for linea in cliente.get('/metrics').get_data(as_text=True).splitlines()
+        if linea.startswith('http_peticiones_total') and '_dash-update-component' in linea
+    )
+
+
+def ejecutar_js(funcion, click, datos):
+    programa = (
+        "global.window = {dash_clientside: {no_update: null, PreventUpdate: {}}};"
+        f"var f = {funcion};"
+        f"process.stdout.write(JSON.stringify(f({json.dumps(click)}, {json.dumps(datos)})));"
+    )
+    salida = subprocess.run(['node', '-e', programa], capture_output=True, text=True, check=True).stdout
+    return json.loads(salida)
+
+
+def sesion(repeticiones):
+    sys.path.insert(0, RAIZ)
+    import multi_app
+    multi_app.esperar_carga()
+    cliente = multi_app.server.test_client()
+    usar_node = shutil.which('node') is not None
+    clics = peticiones = comparadas = diferencias = 0
+    assert cliente.get('/_dash-layout').status_code == 200
+    dependencias = cliente.get('/_dash-dependencies').get_json()
+    for ruta, grafico, campo, salidas, nombre_callback in APPS:
+        layout = layout_pagina(cliente, ruta)
+        callback = next(c for c in dependencias if salidas[0] in c['output'])
+        traza = buscar(layout, grafico)['figure']['data'][0]
+        valores = traza['labels'] if campo == 'label' else traza['x']
+        antes = peticiones_update(cliente) # Sin contar la petición del router que trajo el layout
+        for _ in range(repeticiones):
+            for valor in valores:
+                click = {'points': [{campo: valor}]}
+                clics += 1
+                if callback.get('clientside_function'):
+                    if usar_node:
+                        datos = buscar(layout, callback['state'][0]['id'])['data']
+                        en_navegador = ejecutar_js(multi_app.DRILLDOWN_CLIENTSIDE, click, datos)
+                        en_servidor = json.loads(json.dumps(getattr(multi_app, nombre_callback)(click)))
+                        comparadas += 1
+                        diferencias += en_navegador != en_servidor
+                    continue
+                cuerpo = {
+                    'output': callback['output'],
+                    'outputs': ([{'id': s, 'property': 'figure'} for s in salidas] if len(salidas) > 1
+                                else {'id': salidas[0], 'property': 'figure'}),
+                    'inputs': [{'id': grafico, 'property': 'clickData', 'value': click}],
+                    'changedPropIds': [f'{grafico}.clickData'],
+                }
+                respuesta = cliente.post('/_dash-update-component', json=cuerpo)
+                assert respuesta.status_code in (200, 204), respuesta.status_code
+        peticiones += peticiones_update(cliente) - antes
+    return {'clics': clics, 'peticiones': peticiones, 'comparadas': comparadas, 'diferencias': diferencias}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Peticiones al servidor por sesión de clics')
+    parser.add_argument('--repeticiones', type=int, default=1)
+    parser.add_argument('--modo', choices=['servidor', 'navegador'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.modo:
+        print(json.dumps(sesion(args.repeticiones)))
+        return
+
+    print(f"{'modo':>10} {'clics':>6} {'peticiones':>11} {'figuras comparadas':>19} {'diferencias':>12}")
+    fallo = False
+    for modo in ['servidor', 'navegador']:
+        entorno = {**os.environ, 'DRILLDOWN_EN_NAVEGADOR': '1' if modo == 'navegador' else '0', 'LOG_LEVEL': 'WARNING'}
+        salida = subprocess.run([sys.executable, os.path.abspath(__file__), '--modo', modo,
+                                 '--repeticiones', str(args.repeticiones)],
+                                env=entorno, capture_output=True, text=True, check=True).stdout
+        r = json.loads(salida.strip().splitlines()[-1])
+        print(f"{modo:>10} {r['clics']:>6} {r['peticiones']:>11} {r['comparadas']:>19} {r['diferencias']:>12}")
+        fallo |= r['diferencias'] > 0 or (modo == 'navegador' and r['peticiones'] > 0)
+    sys.exit(1 if fallo else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+# Suite de micro-benchmarks con datos sintéticos (sin Google Drive ni Hugging Face).
+#
+# Para cada tamaño genera (o reutiliza, en bench/datos/) un CSV sintético y un modelo de reemplazo
+# con bench/datos_sinteticos.py y mide, en un subproceso con DATOS_CSV_LOCAL y MODELO_LOCAL
+# apuntando a esos archivos (y un SNAPSHOT_DIR temporal):
+#   - preprocesamiento: leer_csv del CSV completo (lectura por bloques + preprocesamiento);
+#   - estado_datos: construir la TablaCompacta y EstadoDatos (agregados, índice de bitmaps, rollups);
+#   - layout/<app>: cada layout con la caché de figuras vacía, serializado como lo envía Dash;
+#   - drilldown/<callback>: cada callback de detalle sin caché, mediana sobre todas las selecciones;
+#   - predecir: el callback del simulador (búsqueda en la tabla del día), tabla_predicciones y
+#     pronostico (la grilla especialidad x próximos días del simulador para una edad).
+# Cada medida es la mediana de --repeticiones corridas, en segundos.
+#
+# Los resultados se guardan en bench/resultados/<fecha>-<commit>.json y se comparan con el archivo
+# anterior de esa carpeta (o con --comparar): las medidas que empeoran más que --umbral se marcan
+# como regresión y, con --estricto, el script termina con código 1.
+#
+# Uso:
+#   python bench/suite.py --filas 10000 100000 1000000
+import argparse
+import datetime
+import gc
+import glob
+import inspect
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CARPETA_DATOS = os.path.join(RAIZ, 'bench', 'datos')
+CARPETA_RESULTADOS = os.path.join(RAIZ, 'bench', 'resultados')
+
+LAYOUTS = ['layout_edad', 'layout_espera', 'layout_modalidad', 'layout_asegurados', 'layout_tiempo',
+           'layout_simulador', 'layout_cruzado']
+# (callback, clave del punto clicado, agregado cuyas claves son las selecciones posibles)
+DRILLDOWNS = [
+    ('update_pie_chart_edad', 'x', 'especialidades_por_edad'),
+    ('update_pie_chart_espera', 'x', 'especialidades_por_espera'),
+    ('update_bar_modalidad', 'label', 'espera_por_modalidad'),
+    ('update_bar_seguro', 'label', 'espera_por_seguro'),
+    ('actualizar_graficos', 'x', 'especialidades_por_mes'),
+]
+
+
+def medir(funcion, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        gc.collect()
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos)
+
+
+# Se ejecuta en el subproceso, con el entorno ya apuntando a los archivos sintéticos
+def medir_todo(csv, repeticiones):
+    sys.path.insert(0, RAIZ)
+    import multi_app
+    from plotly.io.json import to_json_plotly
+    multi_app.esperar_carga()
+    if not multi_app.carga_lista() or multi_app.estado_carga['errores']:
+        sys.exit(f"La carga falló: {multi_app.estado_carga['errores']}")
+    resultados = {'carga_total': multi_app.estado_carga['tiempos'].get('total')}
+
+    def preprocesar():
+        with open(csv, 'rb') as archivo:
+            multi_app.leer_csv(archivo)
+    resultados['preprocesamiento'] = medir(preprocesar, repeticiones)
+    estado = multi_app.estado_datos
+    # estado.tabla solo tiene los meses residentes: EstadoDatos se mide sobre todas las filas
+    with open(csv, 'rb') as archivo:
+        completo, _ = multi_app.leer_csv(archivo)
+    resultados['estado_datos'] = medir(lambda: multi_app.EstadoDatos(multi_app.TablaCompacta.desde_df(completo), estado.citas_por_mes, estado.version), repeticiones)
+    del completo
+
+    for nombre in LAYOUTS:
+        layout = getattr(multi_app, nombre)
+        def construir():
+            multi_app.cache_figuras.invalidar(estado.version)
+            to_json_plotly(layout())
+        resultados[f'layout/{nombre}'] = medir(construir, repeticiones)
+
+    for nombre, campo, agregado in DRILLDOWNS:
+        calcular = inspect.unwrap(getattr(multi_app, nombre)) # Sin Dash, instrumentación ni caché
+        por_seleccion = [
+            medir(lambda valor=valor: to_json_plotly(calcular({'points': [{campo: valor}]})), repeticiones)
+            for valor in estado.agregados[agregado]
+        ]
+        resultados[f'drilldown/{nombre}'] = statistics.median(por_seleccion) if por_seleccion else None
+
+    azar = random.Random(0)
+    entradas = [(azar.randint(0, 100), azar.choice(list(multi_app.especialidades_dic))) for _ in range(200)]
+    def predecir():
+        for edad, codigo in entradas:
+            multi_app.predecir(1, edad, codigo)
+    resultados['predecir'] = medir(predecir, repeticiones) / len(entradas)
+    resultados['tabla_predicciones'] = medir(lambda: multi_app.tabla_predicciones._construir(datetime.date.today()), repeticiones)
+    resultados['pronostico'] = medir(lambda: multi_app.tabla_predicciones._construir_pronostico(datetime.date.today(), 30), repeticiones)
+    return resultados
+
+
+def archivos_sinteticos(filas, semilla):
+    sys.path.insert(0, os.path.join(RAIZ, 'bench'))
+    import datos_sinteticos
+    os.makedirs(CARPETA_DATOS, exist_ok=True)
+    csv = os.path.join(CARPETA_DATOS, f'citas_{filas}_{semilla}.csv')
+    modelo = os.path.join(CARPETA_DATOS, f'modelo_{semilla}.pkl')
+    if not os.path.exists(csv):
+        print(f"Generando {csv}...", file=sys.stderr)
+        datos_sinteticos.generar_csv(csv, filas, semilla)
+    if not os.path.exists(modelo):
+        print(f"Entrenando {modelo}...", file=sys.stderr)
+        datos_sinteticos.entrenar_modelo(modelo, semilla=semilla)
+    return csv, modelo
+
+
+def commit_actual():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True, text=True, check=True).stdout.strip()
+        cambios = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=RAIZ,
+                                 capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'sin-git'
+    return commit + ('-modificado' if cambios else '')
+
+
+def comparar(actual, anterior, umbral):
+    print(f"\nComparación con {anterior['commit']} ({anterior['fecha']}):")
+    print(f"{'filas':>8} {'medida':<42} {'antes ms':>10} {'ahora ms':>10} {'cambio':>8}")
+    regresiones = 0
+    for filas, medidas in actual['mediciones'].items():
+        previas = anterior['mediciones'].get(filas, {})
+        for medida, segundos in medidas.items():
+            antes = previas.get(medida)
+            if not antes or segundos is None:
+                continue
+            razon = segundos / antes
+            marca = ' REGRESIÓN' if razon > umbral else ''
+            regresiones += razon > umbral
+            print(f"{filas:>8} {medida:<42} {antes * 1000:>10.3f} {segundos * 1000:>10.3f} {razon:>7.2f}x{marca}")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks con datos sintéticos')
+    parser.add_argument('--filas', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--comparar', help='Archivo de resultados con el que comparar (por defecto el anterior)')
+    parser.add_argument('--umbral', type=float, default=1.25, help='Razón ahora/antes a partir de la cual hay regresión')
+    parser.add_argument('--estricto', action='store_true', help='Terminar con código 1 si hay regresiones')
+    parser.add_argument('--medir', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--csv', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.medir:
+        print(json.dumps(medir_todo(args.csv, args.repeticiones)))
+        return
+
+    mediciones = {}
+    for filas in args.filas:
+        csv, modelo = archivos_sinteticos(filas, args.semilla)
+        with tempfile.TemporaryDirectory() as snapshot:
+            entorno = {**os.environ, 'DATOS_CSV_LOCAL': csv, 'MODELO_LOCAL': modelo, 'SNAPSHOT_DIR': snapshot,
+                       'CARGA_EN_SEGUNDO_PLANO': '0', 'REFRESCO_SEGUNDOS': '0', 'LOG_LEVEL': 'WARNING'}
+            salida = subprocess.run([sys.executable, os.path.abspath(__file__), '--medir', '--csv', csv,
+                                     '--repeticiones', str(args.repeticiones)],
+                                    env=entorno, capture_output=True, text=True)
+        if salida.returncode != 0:
+            sys.exit(f"La medición con {filas} filas falló:\n{salida.stderr[-2000:]}")
+        mediciones[str(filas)] = json.loads(salida.stdout.strip().splitlines()[-1])
+        print(f"\n{filas} filas")
+        for medida, segundos in mediciones[str(filas)].items():
+            print(f"  {medida:<42} {'-' if segundos is None else f'{segundos * 1000:.3f} ms':>14}")
+
+    resultado = {
+        'commit': commit_actual(),
+        'fecha': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+        'repeticiones': args.repeticiones,
+        'mediciones': mediciones,
+    }
+    anteriores = sorted(glob.glob(os.path.join(CARPETA_RESULTADOS, '*.json')))
+    os.makedirs(CARPETA_RESULTADOS, exist_ok=True)
+    ruta = os.path.join(CARPETA_RESULTADOS, f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{resultado['commit']}.json")
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, indent=2)
+    print(f"\nResultados guardados en {os.path.relpath(ruta, RAIZ)}")
+
+    referencia = args.comparar or (anteriores[-1] if anteriores else None)
+    if referencia:
+        with open(referencia, encoding='utf-8') as f:
+            regresiones = comparar(resultado, json.load(f), args.umbral)
+        if regresiones and args.estricto:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
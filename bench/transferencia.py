@@ -0,0 +1,102 @@
+# Bytes transferidos por carga de página, simulando un navegador con el test client de Flask.
+#
+# Para cada página ('/' y cada página Dash) se pide el HTML, los scripts y estilos que referencia, el
+# _dash-layout, las _dash-dependencies y el contenido de la página por el callback de enrutamiento
+# (y el logo en '/'), como hace el navegador:
+#   - primera visita: sin caché, con Accept-Encoding 'br, gzip' (o 'identity' con --sin-compresion);
+#   - segunda visita: lo que tiene Cache-Control max-age vigente no se pide; lo demás se revalida
+#     con If-None-Match / If-Modified-Since y un 304 no trae cuerpo. El POST del callback de
+#     enrutamiento se repite siempre.
+# Al final se recorren todas las páginas con una sola caché, como un usuario que navega por todas.
+# Se cuentan los bytes del cuerpo de las respuestas (sin cabeceras). Para comparar antes/después,
+# correrlo sobre cada commit (por ejemplo con git worktree).
+#
+# Uso:
+#   python bench/transferencia.py [--sin-compresion]
+import argparse
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import multi_app  # noqa: E402
+
+multi_app.esperar_carga()
+
+PAGINAS = ['/', '/edad/', '/espera/', '/modalidad/', '/asegurados/', '/tiempo/', '/simulador/', '/cruzado/']
+
+
+def recursos(cliente, pagina):
+    html = cliente.get(pagina, headers={'Accept-Encoding': 'identity'}).get_data(as_text=True)
+    urls = [pagina] + re.findall(r'<script[^>]+src="([^"]+)"', html) + re.findall(r'<link[^>]+href="([^"]+\.css[^"]*)"', html)
+    if pagina == '/':
+        urls += re.findall(r'<img[^>]+src="([^"]+)"', html)
+    else:
+        urls += ['/_dash-layout', '/_dash-dependencies']
+    return [url for url in urls if url.startswith('/')]
+
+
+def contenido_pagina(cliente, pagina, cabeceras):
+    cuerpo = {
+        'output': '.._pages_content.children..._pages_store.data..',
+        'outputs': [{'id': '_pages_content', 'property': 'children'}, {'id': '_pages_store', 'property': 'data'}],
+        'inputs': [{'id': '_pages_location', 'property': 'pathname', 'value': pagina},
+                   {'id': '_pages_location', 'property': 'search', 'value': ''}],
+        'changedPropIds': ['_pages_location.pathname'],
+        'state': [],
+    }
+    respuesta = cliente.post('/_dash-update-component', json=cuerpo, headers=cabeceras)
+    assert respuesta.status_code == 200, (pagina, respuesta.status_code)
+    return len(respuesta.get_data())
+
+
+def vigente(respuesta):
+    control = respuesta.cache_control
+    return not control.no_cache and not control.no_store and (control.max_age or 0) > 0
+
+
+def visita(cliente, pagina, urls, cabeceras, cache):
+    total = contenido_pagina(cliente, pagina, cabeceras) if pagina != '/' else 0
+    for url in urls:
+        anterior = cache.get(url)
+        if anterior is not None and vigente(anterior):
+            continue
+        condicionales = {}
+        if anterior is not None and anterior.headers.get('ETag'):
+            condicionales['If-None-Match'] = anterior.headers['ETag']
+        if anterior is not None and anterior.headers.get('Last-Modified'):
+            condicionales['If-Modified-Since'] = anterior.headers['Last-Modified']
+        respuesta = cliente.get(url, headers={**cabeceras, **condicionales})
+        assert respuesta.status_code in (200, 304), (url, respuesta.status_code)
+        total += len(respuesta.get_data())
+        if respuesta.status_code == 200:
+            cache[url] = respuesta
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bytes transferidos por carga de página')
+    parser.add_argument('--sin-compresion', action='store_true', help="Accept-Encoding: identity")
+    args = parser.parse_args()
+
+    cabeceras = {'Accept-Encoding': 'identity' if args.sin_compresion else 'br, gzip'}
+    cliente = multi_app.server.test_client()
+    print(f"{'página':>13} {'recursos':>9} {'1ª visita KB':>13} {'2ª visita KB':>13}")
+    totales = [0, 0]
+    for pagina in PAGINAS:
+        urls = recursos(cliente, pagina)
+        cache = {}
+        primera = visita(cliente, pagina, urls, cabeceras, cache)
+        segunda = visita(cliente, pagina, urls, cabeceras, cache)
+        totales[0] += primera
+        totales[1] += segunda
+        print(f"{pagina:>13} {len(urls):>9} {primera / 1024:>13.1f} {segunda / 1024:>13.1f}")
+    print(f"{'total':>13} {'':>9} {totales[0] / 1024:>13.1f} {totales[1] / 1024:>13.1f}")
+    # Recorrido de todas las páginas en una sola sesión: los recursos compartidos se bajan una vez
+    cache = {}
+    recorrido = sum(visita(cliente, pagina, recursos(cliente, pagina), cabeceras, cache) for pagina in PAGINAS)
+    print(f"{'recorrido':>13} {'':>9} {recorrido / 1024:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+# Configuración de Gunicorn para multi_app.py
+#
+# Con preload_app=True el proceso maestro importa multi_app.py una sola vez (descarga/snapshot,
+# preprocesamiento, agregados y modelo_forest) y después hace fork de los workers. Los buffers de
+# numpy del df y de los árboles del modelo quedan en páginas compartidas copy-on-write: mientras
+# nadie los escriba, todos los workers leen la misma memoria física.
+import gc
+import multiprocessing
+import os
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count(), 4)))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+
+# Workers con hilos: un callback lento ya no bloquea a los demás usuarios del mismo worker. Los
+# cálculos pesados de cada worker pasan por un pool acotado (EJECUTOR_HILOS en multi_app.py), así
+# que los hilos de gunicorn pueden ser más que los núcleos: los que sobran atienden las peticiones
+# livianas mientras tanto. GUNICORN_WORKER_CLASS=sync vuelve al modelo de un hilo por worker.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+
+# Con preload la carga tiene que terminar en el maestro antes del fork (si no, cada worker repetiría
+# la carga en su propio hilo y se perdería la memoria compartida). Sin preload cada worker arranca
+# al instante y carga en segundo plano mientras /readyz responde 503.
+os.environ.setdefault('CARGA_EN_SEGUNDO_PLANO', '0' if preload_app else '1')
+
+
+def when_ready(server):
+    # El recolector de basura escribe en la cabecera de cada objeto que recorre, lo que rompe el
+    # copy-on-write. gc.freeze() mueve todo lo creado durante la carga a una generación permanente
+    # que el GC de los workers ya no visita.
+    if preload_app:
+        gc.collect()
+        gc.freeze()
+        server.log.info("Datos precargados en el maestro; %d objetos congelados para los workers.",
+                        gc.get_freeze_count())
@@ -1,16 +1,38 @@
 import pandas as pd
-from flask import Flask, render_template_string, send_from_directory
+import numpy as np
+from flask import Flask, abort, render_template_string, jsonify, request, Response, stream_with_context, g, has_request_context
+from flask_compress import Compress # Compresión brotli/gzip de las respuestas
+from werkzeug.exceptions import RequestEntityTooLarge
 import dash
 from dash import dcc, html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 import plotly.express as px
+from plotly.io.json import to_json_plotly
 import joblib  # Para cargar el modelo guardado con joblib
 import requests # Para descargar el modelo desde la URL
 import io # Para manejar el contenido binario del modelo en memoria
+import tempfile # Para descargar el CSV a disco por bloques
 from datetime import datetime # Para obtener la fecha actual (día y semana_del_año)
 import os # Para trabajar con rutas de archivos, especialmente para la carpeta 'static'
-
-print("--- Iniciando carga y preprocesamiento de datos y modelo (multi_app.py) ---")
+import hashlib # Para identificar la versión de los datos fuente en el snapshot
+import hmac
+import json
+import time
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+import struct # Para ubicar los arreglos dentro del .npz del modelo compilado
+import zipfile
+import functools
+from collections import OrderedDict
+import bisect
+import logging
+
+# Nivel de log configurable: con LOG_LEVEL=DEBUG se ven las trazas detalladas de cada callback
+# (clickData, tablas intermedias); por defecto solo los mensajes de carga, advertencias y errores.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s %(levelname)s [%(threadName)s] %(message)s')
+logger = logging.getLogger('multi_app')
 
 # URLs de los recursos
 HF_DATA_URL = "https://drive.google.com/uc?export=download&id=1PWTw-akWr59Gu7MoHra5WXMKwllxK9bp"
@@ -46,34 +68,280 @@ especialidades_dic = {
     60: 'URODINAMIA', 15: 'ENDOCRINOLOGIA TUBERCULOSIS'
 }
 
+# Tablas de rangos para 'Rango de Edad' y 'RANGO_DIAS': (límite inferior incluido, etiqueta).
+# Las usan tanto el preprocesamiento como los category_orders de los layouts.
+RANGOS_EDAD = [
+    (float('-inf'), "Niño"), (13, "Adolescente"), (19, "Joven"), (30, "Adulto"),
+    (61, "Adulto mayor") # Cambiado a 61+ para adulto mayor
+]
+RANGOS_DIAS = [
+    (float('-inf'), "0-9"), (10, "10-19"), (20, "20-29"), (30, "30-39"), (40, "40-49"),
+    (50, "50-59"), (60, "60-69"), (70, "70-79"), (80, "80-89"), (90, "90+")
+]
+
+def etiquetas_rangos(rangos):
+    return [etiqueta for _, etiqueta in rangos]
+
+# Clasificación vectorizada: searchsorted sobre los límites produce directamente los códigos
+# de una categoría ordenada (los NaN quedan como NaN).
+def clasificar_en_rangos(valores, rangos):
+    valores = pd.to_numeric(pd.Series(valores), errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    limites = np.array([limite for limite, _ in rangos[1:]], dtype=float)
+    codigos = np.searchsorted(limites, valores, side='right')
+    codigos[np.isnan(valores)] = -1
+    return pd.Categorical.from_codes(codigos, categories=etiquetas_rangos(rangos), ordered=True)
+
+
+# --- Estado de la Carga (fases y tiempos) ---
+# La descarga, el preprocesamiento y la carga del modelo corren en segundo plano (ver cargar_todo),
+# así el servidor responde desde el primer momento. /healthz y /readyz exponen este estado.
+estado_carga = {
+    'fase': 'pendiente', # pendiente -> cargando -> lista (o error)
+    'en_curso': [],
+    'tiempos': {}, # segundos por fase
+    'errores': {},
+    'memoria': {}, # MB del df: pico estimado durante la lectura del CSV, tamaño final y meses residentes
+}
+_lock_carga = threading.Lock()
+_carga_lista = threading.Event()
+
+@contextlib.contextmanager
+def medir_fase(nombre):
+    inicio = time.perf_counter()
+    with _lock_carga:
+        estado_carga['en_curso'].append(nombre)
+    try:
+        yield
+    finally:
+        with _lock_carga:
+            estado_carga['en_curso'].remove(nombre)
+            estado_carga['tiempos'][nombre] = round(time.perf_counter() - inicio, 4)
+
+def registrar_error_carga(fase, error):
+    with _lock_carga:
+        estado_carga['errores'][fase] = str(error)
+
+def carga_lista():
+    return _carga_lista.is_set()
+
+def esperar_carga(timeout=None):
+    return _carga_lista.wait(timeout)
+
+
+# --- Métricas (formato de texto de Prometheus en /metrics) ---
+# Histogramas de latencia y tamaño de respuesta por callback de Dash y por ruta de Flask, con
+# contadores de llamadas y errores. Todo vive en memoria del proceso (con varios workers, cada uno
+# expone sus propias métricas).
+LIMITES_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LIMITES_BYTES = (1_000, 5_000, 10_000, 50_000, 100_000, 500_000, 1_000_000, 5_000_000)
+
+class Histograma:
+    def __init__(self, limites):
+        self.limites = limites
+        self.cubetas = [0] * (len(limites) + 1) # La última es +Inf
+        self.suma = 0.0
+        self.cuenta = 0
+
+    def observar(self, valor):
+        self.cubetas[bisect.bisect_left(self.limites, valor)] += 1
+        self.suma += valor
+        self.cuenta += 1
+
+    def lineas(self, nombre, etiquetas):
+        acumulado = 0
+        for limite, cuenta in zip((*self.limites, '+Inf'), self.cubetas):
+            acumulado += cuenta
+            yield f'{nombre}_bucket{{{etiquetas},le="{limite}"}} {acumulado}'
+        yield f'{nombre}_sum{{{etiquetas}}} {self.suma}'
+        yield f'{nombre}_count{{{etiquetas}}} {self.cuenta}'
+
+def _etiquetas(**valores):
+    partes = []
+    for clave, valor in valores.items():
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"')
+        partes.append(f'{clave}="{valor}"')
+    return ','.join(partes)
+
+class Metricas:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.callbacks = {} # nombre -> {'latencia', 'bytes', 'errores'}
+        self.rutas = {} # (ruta, método) -> {'latencia', 'bytes', 'estados': {código: cuenta}}
+
+    def _callback(self, nombre):
+        if nombre not in self.callbacks:
+            self.callbacks[nombre] = {'latencia': Histograma(LIMITES_LATENCIA), 'bytes': Histograma(LIMITES_BYTES), 'errores': 0}
+        return self.callbacks[nombre]
+
+    def observar_callback(self, nombre, segundos, error=False):
+        with self._lock:
+            metrica = self._callback(nombre)
+            metrica['latencia'].observar(segundos)
+            if error:
+                metrica['errores'] += 1
+
+    def observar_bytes_callback(self, nombre, cantidad):
+        with self._lock:
+            self._callback(nombre)['bytes'].observar(cantidad)
+
+    def observar_ruta(self, ruta, metodo, estado, segundos, cantidad_bytes):
+        with self._lock:
+            clave = (ruta, metodo)
+            if clave not in self.rutas:
+                self.rutas[clave] = {'latencia': Histograma(LIMITES_LATENCIA), 'bytes': Histograma(LIMITES_BYTES), 'estados': {}}
+            metrica = self.rutas[clave]
+            metrica['latencia'].observar(segundos)
+            if cantidad_bytes is not None: # Las respuestas en streaming no tienen tamaño conocido
+                metrica['bytes'].observar(cantidad_bytes)
+            metrica['estados'][estado] = metrica['estados'].get(estado, 0) + 1
+
+    def exportar(self):
+        lineas = []
+        with self._lock:
+            lineas += ['# HELP dash_callback_duracion_segundos Tiempo de ejecución de cada callback de Dash.',
+                       '# TYPE dash_callback_duracion_segundos histogram']
+            for nombre, metrica in sorted(self.callbacks.items()):
+                lineas += metrica['latencia'].lineas('dash_callback_duracion_segundos', _etiquetas(callback=nombre))
+            lineas += ['# HELP dash_callback_respuesta_bytes Tamaño de la respuesta JSON de cada callback.',
+                       '# TYPE dash_callback_respuesta_bytes histogram']
+            for nombre, metrica in sorted(self.callbacks.items()):
+                lineas += metrica['bytes'].lineas('dash_callback_respuesta_bytes', _etiquetas(callback=nombre))
+            lineas += ['# HELP dash_callback_errores_total Excepciones lanzadas por cada callback.',
+                       '# TYPE dash_callback_errores_total counter']
+            for nombre, metrica in sorted(self.callbacks.items()):
+                lineas.append(f"dash_callback_errores_total{{{_etiquetas(callback=nombre)}}} {metrica['errores']}")
+
+            lineas += ['# HELP http_peticiones_total Peticiones atendidas por ruta, método y código de estado.',
+                       '# TYPE http_peticiones_total counter']
+            for (ruta, metodo), metrica in sorted(self.rutas.items()):
+                for estado, cuenta in sorted(metrica['estados'].items()):
+                    lineas.append(f"http_peticiones_total{{{_etiquetas(ruta=ruta, metodo=metodo, estado=estado)}}} {cuenta}")
+            lineas += ['# HELP http_duracion_segundos Latencia de las peticiones por ruta.',
+                       '# TYPE http_duracion_segundos histogram']
+            for (ruta, metodo), metrica in sorted(self.rutas.items()):
+                lineas += metrica['latencia'].lineas('http_duracion_segundos', _etiquetas(ruta=ruta, metodo=metodo))
+            lineas += ['# HELP http_respuesta_bytes Tamaño del cuerpo de las respuestas por ruta.',
+                       '# TYPE http_respuesta_bytes histogram']
+            for (ruta, metodo), metrica in sorted(self.rutas.items()):
+                lineas += metrica['bytes'].lineas('http_respuesta_bytes', _etiquetas(ruta=ruta, metodo=metodo))
+        return lineas
+
+metricas = Metricas()
+
+# Envuelve un callback de Dash: registra su latencia y si lanzó una excepción. El nombre queda en
+# flask.g para que after_request le atribuya el tamaño de la respuesta.
+def instrumentar_callback(funcion):
+    nombre = funcion.__name__
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        if has_request_context():
+            g.callback_actual = nombre
+        inicio = time.perf_counter()
+        error = False
+        try:
+            return funcion(*args, **kwargs)
+        except dash.exceptions.PreventUpdate:
+            raise
+        except Exception:
+            error = True
+            raise
+        finally:
+            metricas.observar_callback(nombre, time.perf_counter() - inicio, error)
+    return envoltura
+
+# --- Ejecutor Acotado para Cálculos Pesados ---
+# Con workers gthread (gunicorn.conf.py) cada worker atiende varias peticiones a la vez. Lo que usa
+# CPU (armar una figura que no está en la caché, modelo_forest.predict) pasa por un pool de
+# EJECUTOR_HILOS hilos por proceso: como mucho esa cantidad de cálculos corre a la vez y los demás
+# hilos de gunicorn quedan libres para las peticiones livianas (figuras en caché, /healthz,
+# estáticos). Si además hay EJECUTOR_COLA_MAX cálculos esperando, la petición se rechaza con 503.
+# numpy, pandas y los árboles de scikit-learn liberan el GIL en la mayor parte del trabajo.
+# Los datos compartidos son de solo lectura: estado_datos y modelo_forest se reemplazan enteros y
+# cada cálculo trabaja con la referencia que tomó; las cachés y las métricas tienen su propio lock.
+EJECUTOR_HILOS = int(os.environ.get('EJECUTOR_HILOS', str(min(os.cpu_count() or 1, 4))))
+EJECUTOR_COLA_MAX = int(os.environ.get('EJECUTOR_COLA_MAX', '32'))
+
+class Sobrecarga(Exception):
+    pass
+
+class EjecutorAcotado:
+    def __init__(self, hilos, cola_max):
+        self.hilos = hilos
+        self._cupos = threading.BoundedSemaphore(max(hilos, 1) + cola_max)
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.en_curso = 0 # Cálculos corriendo o esperando un hilo
+        self.rechazos = 0
+
+    def _obtener_pool(self):
+        # Los hilos no sobreviven al fork de gunicorn: cada proceso crea su propio pool
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ThreadPoolExecutor(max_workers=self.hilos, thread_name_prefix='calculo')
+                self._pid = os.getpid()
+            return self._pool
+
+    def ejecutar(self, funcion, *args):
+        # Fuera de una petición (la carga, el refresco o un cálculo que ya corre en el pool) o con
+        # 0 hilos se ejecuta directo
+        if self.hilos <= 0 or not has_request_context():
+            return funcion(*args)
+        if not self._cupos.acquire(blocking=False):
+            with self._lock:
+                self.rechazos += 1
+            raise Sobrecarga(f"Hay {self.en_curso} cálculos en curso o en espera.")
+        with self._lock:
+            self.en_curso += 1
+        try:
+            return self._obtener_pool().submit(funcion, *args).result()
+        finally:
+            with self._lock:
+                self.en_curso -= 1
+            self._cupos.release()
+
+ejecutor_calculo = EjecutorAcotado(EJECUTOR_HILOS, EJECUTOR_COLA_MAX)
 
-# --- Carga y Preprocesamiento de Datos del DataFrame ---
-df = pd.DataFrame() # Inicializa un DataFrame vacío para manejar posibles errores
-citas_por_mes = pd.DataFrame(columns=['MES', 'CANTIDAD_CITAS']) # Inicializa vacío
-
-try:
-    print(f"Intentando descargar datos desde: {HF_DATA_URL}")
-    response_data = requests.get(HF_DATA_URL)
-    response_data.raise_for_status() # Lanza una excepción para errores HTTP
-
-    # Usar io.BytesIO para leer el contenido binario directamente
-    df = pd.read_csv(io.BytesIO(response_data.content))
-    print("DataFrame descargado y cargado con éxito.")
-    print(f"Dimensiones iniciales del DataFrame: {df.shape}")
-    print(f"Columnas del DataFrame: {df.columns.tolist()}")
 
-    print(f"Memoria inicial del DataFrame: {df.memory_usage(deep=True).sum() / (1024**2):.2f} MB")
+# --- Carga y Preprocesamiento de Datos del DataFrame ---
+# Versión del preprocesamiento: incrementarla cuando cambie preprocesar_datos(), las tablas de
+# rangos o el formato del snapshot, para que los snapshots guardados con la versión anterior se
+# reconstruyan.
+VERSION_PREPROCESO = 4
+
+# Carpeta local donde se guarda el snapshot (Parquet) del df ya preprocesado
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshot'))
+# Si el snapshot se verificó contra la fuente hace menos de estos segundos, se usa sin volver a
+# descargar el CSV (útil para reinicios y nuevos workers). 0 = verificar siempre.
+SNAPSHOT_MAX_EDAD_SEGUNDOS = int(os.environ.get('SNAPSHOT_MAX_EDAD_SEGUNDOS', '0'))
+
+# Origen local opcional del CSV (ruta a un archivo). Si está definido no se descarga nada.
+DATOS_CSV_LOCAL = os.environ.get('DATOS_CSV_LOCAL')
+# Filas por bloque al leer el CSV: la memoria pico depende de este tamaño y no del archivo completo
+TAMANO_BLOQUE_CSV = int(os.environ.get('TAMANO_BLOQUE_CSV', '200000'))
+
+# Columnas del CSV que usan los dashboards, con su tipo declarado. Las demás no se leen.
+# DIA_SOLICITACITA se lee como texto y se convierte a fecha en cada bloque.
+TIPOS_CSV = {
+    'DIA_SOLICITACITA': 'object',
+    'EDAD': 'float64',
+    'DIFERENCIA_DIAS': 'float64',
+    'ESPECIALIDAD': 'category',
+    'PRESENCIAL_REMOTO': 'category',
+    'SEGURO': 'category',
+    'ATENDIDO': 'category',
+    'SEXO': 'category',
+}
+COLUMNAS_NUMERICAS = ['EDAD', 'DIFERENCIA_DIAS']
+COLUMNAS_CATEGORICAS = ['ESPECIALIDAD', 'PRESENCIAL_REMOTO', 'SEGURO', 'ATENDIDO', 'SEXO',
+                        'MES', 'Rango de Edad', 'RANGO_DIAS']
 
-    # Conversión de tipos y manejo de errores
-    for col in ['EDAD', 'DIFERENCIA_DIAS']:
+# Conversiones que se pueden hacer bloque por bloque (el resultado ya es compacto)
+def preprocesar_bloque(df, avisar=True):
+    # Conversión de tipos y manejo de errores: convertir a numérico, forzando NaNs para errores
+    for col in COLUMNAS_NUMERICAS:
         if col in df.columns:
-            # Convertir a numérico, forzando NaNs para errores, luego a entero si es posible
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-            # Intentar downcast a integer si no hay NaNs después de la conversión
-            if df[col].notna().all():
-                df[col] = df[col].astype('Int64') # Int64 soporta NaNs
-            else:
-                df[col] = df[col].astype(float) # Mantener como float si hay NaNs
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(float)
 
     # Procesar DIA_SOLICITACITA y MES
     if 'DIA_SOLICITACITA' in df.columns:
@@ -81,107 +349,2269 @@ try:
         # Eliminar filas con DIA_SOLICITACITA inválido si es crucial
         df = df.dropna(subset=['DIA_SOLICITACITA'])
         df['MES'] = df['DIA_SOLICITACITA'].dt.to_period('M').astype(str)
-        print(f"Valores únicos en 'MES' después de procesar: {df['MES'].unique().tolist()}")
-        print(f"Conteo de valores en 'MES':\n{df['MES'].value_counts(dropna=False)}")
     else:
-        print("Advertencia: La columna 'DIA_SOLICITACITA' no se encontró en el DataFrame. No se podrá generar 'MES'.")
+        if avisar:
+            logger.warning("Advertencia: La columna 'DIA_SOLICITACITA' no se encontró en el DataFrame. No se podrá generar 'MES'.")
         df['MES'] = 'UNKNOWN' # Define un valor por defecto si la columna no existe
 
     # Clasificación de EDAD
     if 'EDAD' in df.columns:
-        def clasificar_edad(edad):
-            if pd.isna(edad): return None
-            if edad < 13: return "Niño"
-            elif edad < 19: return "Adolescente"
-            elif edad < 30: return "Joven"
-            elif edad < 61: return "Adulto"
-            else: return "Adulto mayor" # Cambiado a 61+ para adulto mayor
-        df['Rango de Edad'] = df['EDAD'].apply(clasificar_edad)
+        df['Rango de Edad'] = clasificar_en_rangos(df['EDAD'], RANGOS_EDAD)
     else:
-        print("Advertencia: La columna 'EDAD' no se encontró en el DataFrame. No se podrá generar 'Rango de Edad'.")
+        if avisar:
+            logger.warning("Advertencia: La columna 'EDAD' no se encontró en el DataFrame. No se podrá generar 'Rango de Edad'.")
         df['Rango de Edad'] = None
 
     # Clasificación de DIAS_DIFERENCIA
     if 'DIFERENCIA_DIAS' in df.columns:
-        def clasificar_dias_visualizacion(dias):
-            if pd.isna(dias): return None
-            if dias < 10: return "0-9"
-            elif dias < 20: return "10-19"
-            elif dias < 30: return "20-29"
-            elif dias < 40: return "30-39"
-            elif dias < 50: return "40-49"
-            elif dias < 60: return "50-59"
-            elif dias < 70: return "60-69"
-            elif dias < 80: return "70-79"
-            elif dias < 90: return "80-89"
-            else: return "90+"
-        df['RANGO_DIAS'] = df['DIFERENCIA_DIAS'].apply(clasificar_dias_visualizacion)
+        df['RANGO_DIAS'] = clasificar_en_rangos(df['DIFERENCIA_DIAS'], RANGOS_DIAS)
     else:
-        print("Advertencia: La columna 'DIFERENCIA_DIAS' no se encontró en el DataFrame. No se podrá generar 'RANGO_DIAS'.")
+        if avisar:
+            logger.warning("Advertencia: La columna 'DIFERENCIA_DIAS' no se encontró en el DataFrame. No se podrá generar 'RANGO_DIAS'.")
         df['RANGO_DIAS'] = None
 
     # Convertir a tipo 'category'
-    categorical_cols = ['ESPECIALIDAD', 'PRESENCIAL_REMOTO', 'SEGURO', 'ATENDIDO', 'SEXO',
-                        'MES', 'Rango de Edad', 'RANGO_DIAS']
-    for col in categorical_cols:
+    for col in COLUMNAS_CATEGORICAS:
         if col in df.columns:
-            df[col] = df[col].astype('category')
+            if not isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype('category')
+        elif avisar:
+            logger.warning("Advertencia: La columna '%s' no se encontró en el DataFrame y no se pudo convertir a categoría.", col)
+    return df
+
+# Une los bloques ya preprocesados. Las categorías de cada bloque son distintas, así que las
+# columnas categóricas se combinan con union_categoricals (categorías ordenadas como astype('category')).
+def unir_bloques(bloques):
+    columnas = {}
+    for col in bloques[0].columns:
+        partes = [bloque[col] for bloque in bloques]
+        if isinstance(partes[0].dtype, pd.CategoricalDtype) and not partes[0].cat.ordered:
+            columnas[col] = pd.Series(pd.api.types.union_categoricals(partes, sort_categories=True), name=col)
         else:
-            print(f"Advertencia: La columna '{col}' no se encontró en el DataFrame y no se pudo convertir a categoría.")
-    
-    # Calcular citas_por_mes aquí para que siempre esté disponible
+            columnas[col] = pd.concat(partes, ignore_index=True)
+    return pd.DataFrame(columnas)
+
+# Pasos que necesitan ver la columna completa
+def finalizar_preproceso(df):
+    for col in COLUMNAS_NUMERICAS:
+        # Intentar downcast a integer si no hay NaNs después de la conversión
+        if col in df.columns and df[col].notna().all():
+            df[col] = df[col].astype('Int64') # Int64 soporta NaNs
+    if 'DIA_SOLICITACITA' in df.columns:
+        logger.debug("Valores únicos en 'MES' después de procesar: %s", df['MES'].unique().tolist())
+        logger.debug("Conteo de valores en 'MES':\n%s", df['MES'].value_counts(dropna=False))
+    return df
+
+def preprocesar_datos(df):
+    return finalizar_preproceso(preprocesar_bloque(df))
+
+def _memoria_mb(df):
+    return df.memory_usage(deep=True).sum() / (1024**2)
+
+# Lee y preprocesa el CSV por bloques de TAMANO_BLOQUE_CSV filas. Nunca existe el DataFrame crudo
+# completo (texto sin convertir): en memoria solo conviven los bloques ya compactos y el bloque
+# que se está leyendo. Devuelve (df, memoria_pico_mb) con una estimación del pico durante la lectura.
+# filtro (opcional) recibe cada bloque ya preprocesado y devuelve una máscara de las filas a
+# conservar; las filas descartadas quedan contadas en df.attrs['filas_descartadas'].
+def leer_csv_por_bloques(archivo, tipos=TIPOS_CSV, filtro=None, nombres=None):
+    # Con nombres el archivo no trae encabezado (se lee desde la mitad del CSV)
+    lector = pd.read_csv(archivo, header=None if nombres else 'infer', names=nombres,
+                         usecols=lambda col: col in tipos, dtype=tipos, chunksize=TAMANO_BLOQUE_CSV)
+    bloques = []
+    memoria_bloques = pico = 0.0
+    descartadas = 0
+    for bloque in lector:
+        pico = max(pico, memoria_bloques + _memoria_mb(bloque))
+        bloque = preprocesar_bloque(bloque, avisar=not bloques)
+        if filtro is not None:
+            conservar = filtro(bloque)
+            descartadas += int((~conservar).sum())
+            bloque = bloque[conservar]
+        memoria_bloques += _memoria_mb(bloque)
+        bloques.append(bloque)
+    if not bloques:
+        df = pd.DataFrame(columns=COLUMNAS_DF)
+        df.attrs['filas_descartadas'] = 0
+        return df, 0.0
+    df = unir_bloques(bloques)
+    # Durante la unión conviven los bloques y el DataFrame final
+    pico = max(pico, memoria_bloques + _memoria_mb(df))
+    df = finalizar_preproceso(df)
+    df.attrs['filas_descartadas'] = descartadas
+    return df, pico
+
+def leer_csv(archivo, filtro=None, nombres=None):
+    inicio = archivo.tell()
+    try:
+        return leer_csv_por_bloques(archivo, filtro=filtro, nombres=nombres)
+    except ValueError as e:
+        # Algún valor no numérico en EDAD/DIFERENCIA_DIAS: se leen como texto y se convierten
+        # en cada bloque con errors='coerce'
+        logger.warning("Advertencia: El CSV no cumple los tipos declarados (%s). Reintentando con conversión tolerante.", e)
+        archivo.seek(inicio)
+        return leer_csv_por_bloques(archivo, {**TIPOS_CSV, **{col: 'object' for col in COLUMNAS_NUMERICAS}}, filtro, nombres)
+
+def calcular_citas_por_mes(df):
     if 'MES' in df.columns and not df['MES'].empty:
-        citas_por_mes = df.groupby('MES').size().reset_index(name='CANTIDAD_CITAS')
+        citas_por_mes = df.groupby('MES', observed=True).size().reset_index(name='CANTIDAD_CITAS')
         # Asegurarse de que el orden sea cronológico para la línea de tiempo
-        citas_por_mes['MES_DT'] = pd.to_datetime(citas_por_mes['MES'])
+        citas_por_mes['MES_DT'] = pd.to_datetime(citas_por_mes['MES'].astype(str))
         citas_por_mes = citas_por_mes.sort_values('MES_DT').drop(columns='MES_DT')
-        print(f"citas_por_mes calculado:\n{citas_por_mes.head()}")
+        logger.debug("citas_por_mes calculado:\n%s", citas_por_mes.head())
+        return citas_por_mes
+    logger.warning("Advertencia: No se pudo calcular citas_por_mes. La columna 'MES' puede faltar o estar vacía.")
+    return pd.DataFrame(columns=['MES', 'CANTIDAD_CITAS']) # Asegurarse de que esté vacío pero con columnas
+
+# --- Snapshot del DataFrame Preprocesado ---
+# El df preprocesado se guarda en Parquet (las categorías se conservan) partido por MES: un archivo
+# por mes en SNAPSHOT_DIR/particiones, nombrado por el hash de su contenido, así que los meses que
+# no cambian entre dos versiones de los datos comparten el mismo archivo y no se reescriben. El
+# listado particiones-<clave>.json dice qué archivo corresponde a cada mes en la versión <clave>
+# (hash del CSV fuente y VERSION_PREPROCESO); citas_por_mes se guarda aparte con la misma clave.
+# El manifiesto guarda la clave vigente y las cabeceras ETag/Last-Modified de la fuente para hacer
+# descargas condicionales.
+# En memoria solo quedan las filas de los últimos MESES_RESIDENTES meses (0 = todos); las de los
+# meses anteriores se leen de su partición cuando un filtro cruzado las necesita (ver
+# IndiceParticionado) y se mantienen hasta PARTICIONES_EN_CACHE meses leídos por proceso. Junto a
+# cada partición se guarda su ResumenIndice (<archivo>.resumen.npz), que queda en memoria.
+MESES_RESIDENTES = int(os.environ.get('MESES_RESIDENTES', '12'))
+PARTICIONES_EN_CACHE = int(os.environ.get('PARTICIONES_EN_CACHE', '6'))
+
+def _ruta_snapshot(nombre, clave):
+    return os.path.join(SNAPSHOT_DIR, f"{nombre}-{clave}.parquet")
+
+def _ruta_listado(clave):
+    return os.path.join(SNAPSHOT_DIR, f"particiones-{clave}.json")
+
+def _carpeta_particiones():
+    return os.path.join(SNAPSHOT_DIR, 'particiones')
+
+def _archivo_resumen(archivo):
+    return archivo[:-len('.parquet')] + '.resumen.npz'
+
+def _ruta_manifiesto():
+    return os.path.join(SNAPSHOT_DIR, 'manifiesto.json')
+
+def _escribir_atomico(ruta, escribir):
+    # Escribe en un temporal y lo renombra, para que otro worker nunca lea un archivo a medias
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    escribir(temporal)
+    os.replace(temporal, ruta)
+
+def _escribir_json(ruta, contenido):
+    def escribir(temporal):
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump(contenido, f)
+    _escribir_atomico(ruta, escribir)
+
+def leer_manifiesto():
+    try:
+        with open(_ruta_manifiesto(), encoding='utf-8') as f:
+            manifiesto = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifiesto.get('version_preproceso') != VERSION_PREPROCESO:
+        return None # Snapshot de otra versión del preprocesamiento: hay que reconstruir
+    return manifiesto
+
+def escribir_manifiesto(clave, cabeceras_fuente, bytes_fuente=None):
+    manifiesto = {
+        'clave': clave,
+        'bytes_fuente': bytes_fuente, # Tamaño del CSV fuente: permite leer solo lo agregado al final
+        'version_preproceso': VERSION_PREPROCESO,
+        'fuente': DATOS_CSV_LOCAL or HF_DATA_URL,
+        'etag': cabeceras_fuente.get('ETag'),
+        'last_modified': cabeceras_fuente.get('Last-Modified'),
+        'verificado': time.time(),
+    }
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        _escribir_json(_ruta_manifiesto(), manifiesto)
+    except OSError as e:
+        logger.warning("Advertencia: No se pudo escribir el manifiesto del snapshot: %s", e)
+
+# Particiones por mes de una versión de los datos: mes -> {'archivo', 'filas'}
+class AlmacenParticiones:
+    def __init__(self, clave, archivos):
+        self.clave = clave
+        self.archivos = archivos
+        self.meses = sorted(archivos) # 'AAAA-MM' ordena cronológicamente
+
+    def filas(self):
+        return sum(particion['filas'] for particion in self.archivos.values())
+
+    def residentes(self):
+        return self.meses[-MESES_RESIDENTES:] if MESES_RESIDENTES > 0 else list(self.meses)
+
+    def frias(self):
+        residentes = set(self.residentes())
+        return [mes for mes in self.meses if mes not in residentes]
+
+    def leer(self, mes):
+        return pd.read_parquet(os.path.join(_carpeta_particiones(), self.archivos[mes]['archivo']))
+
+    def leer_resumen(self, mes):
+        return ResumenIndice.cargar(os.path.join(_carpeta_particiones(), _archivo_resumen(self.archivos[mes]['archivo'])))
+
+    @classmethod
+    def cargar(cls, clave):
+        with open(_ruta_listado(clave), encoding='utf-8') as f:
+            return cls(clave, json.load(f)['meses'])
+
+# Escribe la partición de un mes con el hash de su contenido en el nombre, y su resumen al lado (si
+# ya existen no se tocan)
+def _escribir_particion(mes, datos):
+    carpeta = _carpeta_particiones()
+    temporal = os.path.join(carpeta, f"{mes}.{os.getpid()}.tmp")
+    datos.to_parquet(temporal, index=False)
+    with open(temporal, 'rb') as f:
+        digest = _copiar_con_hash(iter(lambda: f.read(TAMANO_BLOQUE_DESCARGA), b''))
+    nombre = f"{mes}-{digest[:12]}.parquet"
+    resumen = os.path.join(carpeta, _archivo_resumen(nombre))
+    if not os.path.exists(resumen):
+        ResumenIndice.desde_datos(TablaCompacta.desde_df(datos)).guardar(resumen)
+    if os.path.exists(os.path.join(carpeta, nombre)):
+        os.remove(temporal)
     else:
-        print("Advertencia: No se pudo calcular citas_por_mes. La columna 'MES' puede faltar o estar vacía.")
-        citas_por_mes = pd.DataFrame(columns=['MES', 'CANTIDAD_CITAS']) # Asegurarse de que esté vacío pero con columnas
-
-    print(f"Memoria después de la optimización: {df.memory_usage(deep=True).sum() / (1024**2):.2f} MB")
-    
-except requests.exceptions.RequestException as e:
-    print(f"ERROR: No se pudo descargar el DataFrame de datos desde {HF_DATA_URL}: {e}")
-    # Definir un DataFrame vacío con las columnas esperadas para evitar errores en las apps
-    df = pd.DataFrame(columns=['DIA_SOLICITACITA', 'MES', 'EDAD', 'Rango de Edad', 'DIFERENCIA_DIAS', 'RANGO_DIAS', 'ESPECIALIDAD', 'PRESENCIAL_REMOTO', 'SEGURO', 'ATENDIDO', 'SEXO'])
-    citas_por_mes = pd.DataFrame(columns=['MES', 'CANTIDAD_CITAS'])
-except Exception as e:
-    print(f"ERROR FATAL al cargar o preprocesar el DataFrame: {e}")
-    df = pd.DataFrame(columns=['DIA_SOLICITACITA', 'MES', 'EDAD', 'Rango de Edad', 'DIFERENCIA_DIAS', 'RANGO_DIAS', 'ESPECIALIDAD', 'PRESENCIAL_REMOTO', 'SEGURO', 'ATENDIDO', 'SEXO'])
-    citas_por_mes = pd.DataFrame(columns=['MES', 'CANTIDAD_CITAS'])
+        os.replace(temporal, os.path.join(carpeta, nombre))
+    return {'archivo': nombre, 'filas': len(datos)}
+
+# Une DataFrames ya preprocesados (partes de un snapshot, o el df vigente y las filas nuevas de un
+# refresco). Int64 y float no se concatenan como float64: se unen como float y finalizar_preproceso
+# vuelve a Int64 si no hay NaN, igual que en una carga completa.
+def unir_preprocesados(partes):
+    partes = [parte.assign(**{col: parte[col].astype(float) for col in COLUMNAS_NUMERICAS if col in parte.columns})
+              for parte in partes]
+    return finalizar_preproceso(unir_bloques(partes))
+
+# Devuelve (df, citas_por_mes, particiones) con todas las particiones de la versión clave: los
+# agregados y los rollups se calculan una vez con todas las filas y después EstadoDatos conserva
+# solo los meses residentes.
+def cargar_snapshot(clave):
+    try:
+        with medir_fase('lectura_snapshot'):
+            particiones = AlmacenParticiones.cargar(clave)
+            citas_por_mes = pd.read_parquet(_ruta_snapshot('citas_por_mes', clave))
+            partes = [particiones.leer(mes) for mes in particiones.meses]
+            df = unir_preprocesados(partes) if partes else pd.DataFrame(columns=COLUMNAS_DF)
+    except Exception as e: # Archivo inexistente, corrupto o pyarrow no disponible
+        logger.info("Snapshot '%s' no disponible: %s", clave, e)
+        return None
+    logger.info("Snapshot '%s' cargado desde %s: %s en %d particiones", clave, SNAPSHOT_DIR, df.shape, len(partes))
+    return df, citas_por_mes, particiones
+
+# Guarda las particiones de los meses presentes en df (cada mes de df tiene que estar completo);
+# los meses de anteriores que no están en df conservan su archivo. Devuelve las particiones de la
+# nueva versión, o None si no se pudo guardar.
+def guardar_snapshot(clave, df, citas_por_mes, anteriores=None):
+    try:
+        os.makedirs(_carpeta_particiones(), exist_ok=True)
+        archivos = dict(anteriores.archivos) if anteriores is not None else {}
+        if not df.empty:
+            for mes, datos in df.groupby('MES', observed=True, sort=False):
+                archivos[str(mes)] = _escribir_particion(str(mes), datos)
+        _escribir_atomico(_ruta_snapshot('citas_por_mes', clave), lambda ruta: citas_por_mes.to_parquet(ruta, index=False))
+        _escribir_json(_ruta_listado(clave), {'meses': archivos})
+    except Exception as e:
+        logger.warning("Advertencia: No se pudo guardar el snapshot '%s': %s", clave, e)
+        return None
+    # Borrar las versiones anteriores para no acumular archivos. Otros workers siguen leyendo los
+    # meses fríos de la versión que cargaron hasta su próximo refresco, así que además de la nueva se
+    # conservan la que esta reemplaza y las VERSIONES_CONSERVADAS más recientes.
+    versiones = [AlmacenParticiones(clave, archivos)] + ([anteriores] if anteriores is not None else [])
+    versiones += _versiones_recientes({version.clave for version in versiones})
+    claves = {version.clave for version in versiones}
+    listados = {os.path.basename(_ruta_listado(c)) for c in claves}
+    citas = {os.path.basename(_ruta_snapshot('citas_por_mes', c)) for c in claves}
+    conservar = {particion['archivo'] for version in versiones for particion in version.archivos.values()}
+    conservar |= {_archivo_resumen(archivo) for archivo in conservar}
+    for nombre in os.listdir(SNAPSHOT_DIR):
+        if (nombre.endswith('.parquet') and nombre not in citas) or \
+           (nombre.startswith('particiones-') and nombre.endswith('.json') and nombre not in listados):
+            _borrar(os.path.join(SNAPSHOT_DIR, nombre))
+    for nombre in os.listdir(_carpeta_particiones()):
+        if nombre.endswith(('.parquet', '.resumen.npz')) and nombre not in conservar:
+            _borrar(os.path.join(_carpeta_particiones(), nombre))
+    logger.info("Snapshot '%s' guardado en %s (%d particiones)", clave, SNAPSHOT_DIR, len(archivos))
+    return versiones[0]
+
+# Las VERSIONES_CONSERVADAS versiones más recientes guardadas en SNAPSHOT_DIR (por la fecha de su
+# listado), sin contar las de excluir. Con 2, un archivo se borra recién cuando otras dos versiones
+# lo reemplazaron: un worker que se salteó un ciclo de refresco todavía encuentra sus meses fríos.
+VERSIONES_CONSERVADAS = 2
+
+def _versiones_recientes(excluir):
+    listados = []
+    for nombre in os.listdir(SNAPSHOT_DIR):
+        if nombre.startswith('particiones-') and nombre.endswith('.json'):
+            clave = nombre[len('particiones-'):-len('.json')]
+            try:
+                listados.append((os.stat(_ruta_listado(clave)).st_mtime_ns, clave))
+            except OSError:
+                pass # Otro worker lo borró mientras tanto
+    versiones = []
+    for _, clave in sorted(listados, reverse=True):
+        if len(versiones) >= VERSIONES_CONSERVADAS:
+            break
+        if clave in excluir:
+            continue
+        try:
+            versiones.append(AlmacenParticiones.cargar(clave))
+        except (OSError, ValueError):
+            pass
+    return versiones
+
+def _borrar(ruta):
+    try:
+        os.remove(ruta)
+    except OSError:
+        pass
+
+TAMANO_BLOQUE_DESCARGA = 1 << 20 # 1 MB
+
+def _copiar_con_hash(bloques, destino=None):
+    sha = hashlib.sha256()
+    for bloque in bloques:
+        sha.update(bloque)
+        if destino is not None:
+            destino.write(bloque)
+    return sha.hexdigest()
+
+# Descarga el CSV en streaming a un archivo temporal (el cuerpo nunca está completo en memoria)
+# calculando el hash al mismo tiempo. Devuelve (respuesta, archivo, hash); con 304 no hay archivo.
+def descargar_csv(cabeceras):
+    respuesta = requests.get(HF_DATA_URL, headers=cabeceras, stream=True)
+    try:
+        respuesta.raise_for_status() # Lanza una excepción para errores HTTP
+        if respuesta.status_code == 304:
+            return respuesta, None, None
+        archivo = tempfile.TemporaryFile()
+        digest = _copiar_con_hash(respuesta.iter_content(TAMANO_BLOQUE_DESCARGA), archivo)
+        archivo.seek(0)
+    finally:
+        respuesta.close()
+    return respuesta, archivo, digest
+
+def cabeceras_condicionales(manifiesto):
+    cabeceras = {}
+    if manifiesto:
+        if manifiesto.get('etag'):
+            cabeceras['If-None-Match'] = manifiesto['etag']
+        if manifiesto.get('last_modified'):
+            cabeceras['If-Modified-Since'] = manifiesto['last_modified']
+    return cabeceras
+
+# Abre el CSV fuente: el archivo local (DATOS_CSV_LOCAL) o la descarga en streaming. Devuelve
+# (archivo, hash, cabeceras de la respuesta); archivo es None si la fuente respondió 304.
+def abrir_fuente(cabeceras=None, fase='descarga_datos'):
+    if DATOS_CSV_LOCAL:
+        logger.info("Leyendo datos desde el archivo local: %s", DATOS_CSV_LOCAL)
+        archivo = open(DATOS_CSV_LOCAL, 'rb')
+        digest = _copiar_con_hash(iter(lambda: archivo.read(TAMANO_BLOQUE_DESCARGA), b''))
+        archivo.seek(0)
+        return archivo, digest, {}
+    logger.info("Intentando descargar datos desde: %s", HF_DATA_URL)
+    with medir_fase(fase):
+        respuesta, archivo, digest = descargar_csv(cabeceras or {})
+    return archivo, digest, respuesta.headers
+
+def clave_datos(digest):
+    return f"{digest[:16]}-v{VERSION_PREPROCESO}"
+
+# Devuelve (df, citas_por_mes, particiones, clave). La clave identifica la versión de los datos
+# cargados; particiones es None si el snapshot no se pudo guardar (todo queda en memoria).
+def cargar_datos():
+    manifiesto = leer_manifiesto()
+    if manifiesto and SNAPSHOT_MAX_EDAD_SEGUNDOS > 0 and time.time() - manifiesto['verificado'] < SNAPSHOT_MAX_EDAD_SEGUNDOS:
+        snapshot = cargar_snapshot(manifiesto['clave'])
+        if snapshot is not None:
+            logger.info("Snapshot reciente: se omite la descarga de la fuente.")
+            return (*snapshot, manifiesto['clave'])
+
+    # Descarga condicional: si la fuente responde 304 el snapshot vigente sigue siendo válido
+    try:
+        archivo, digest, cabeceras_fuente = abrir_fuente(cabeceras_condicionales(manifiesto))
+    except requests.exceptions.RequestException as e:
+        # Sin acceso a la fuente: usar el último snapshot de esta versión si existe
+        snapshot = cargar_snapshot(manifiesto['clave']) if manifiesto else None
+        if snapshot is None:
+            raise
+        logger.warning("Advertencia: No se pudo descargar la fuente (%s). Usando el último snapshot.", e)
+        return (*snapshot, manifiesto['clave'])
+
+    if archivo is None:
+        snapshot = cargar_snapshot(manifiesto['clave']) if manifiesto else None
+        if snapshot is not None:
+            logger.info("La fuente no cambió (304). Usando el snapshot.")
+            escribir_manifiesto(manifiesto['clave'], cabeceras_fuente, manifiesto.get('bytes_fuente'))
+            return (*snapshot, manifiesto['clave'])
+        # El snapshot desapareció: repetir la descarga sin cabeceras condicionales
+        archivo, digest, cabeceras_fuente = abrir_fuente()
+
+    with archivo:
+        clave = clave_datos(digest)
+        bytes_fuente = os.fstat(archivo.fileno()).st_size
+        snapshot = cargar_snapshot(clave)
+        if snapshot is not None:
+            escribir_manifiesto(clave, cabeceras_fuente, bytes_fuente)
+            return (*snapshot, clave)
+
+        # Lectura por bloques con tipos declarados; incluye la conversión de cada bloque
+        with medir_fase('parseo_csv'):
+            df, memoria_pico = leer_csv(archivo)
+    logger.info("DataFrame descargado y cargado con éxito.")
+    logger.info("Dimensiones iniciales del DataFrame: %s", df.shape)
+    logger.debug("Columnas del DataFrame: %s", df.columns.tolist())
+
+    with medir_fase('preprocesamiento'):
+        citas_por_mes = calcular_citas_por_mes(df)
+    memoria_final = _memoria_mb(df)
+    logger.info("Memoria pico durante la lectura por bloques (estimada): %.2f MB", memoria_pico)
+    logger.info("Memoria después de la optimización: %.2f MB", memoria_final)
+    with _lock_carga:
+        estado_carga['memoria'] = {'pico_lectura_mb': round(float(memoria_pico), 2), 'final_mb': round(float(memoria_final), 2)}
+
+    particiones = guardar_snapshot(clave, df, citas_por_mes)
+    if particiones is not None:
+        escribir_manifiesto(clave, cabeceras_fuente, bytes_fuente)
+    return df, citas_por_mes, particiones, clave
+
+# --- Tabla Compacta de Columnas ---
+# Las citas que quedan en memoria no se guardan en un DataFrame sino como un arreglo numpy por
+# columna:
+#   - las categóricas son códigos int8/int16 (-1 = sin valor) sobre un diccionario de categorías.
+#     Las tablas que salen de otra (tomar, unir) comparten el mismo diccionario. El de ESPECIALIDAD
+#     empieza con los nombres de especialidades_dic en el orden de su código, así que el código de
+#     una especialidad conocida es el mismo ESPECIALIDAD_cod que usa el modelo;
+#   - DIA_SOLICITACITA son días desde 1970-01-01 en int32;
+#   - EDAD y DIFERENCIA_DIAS son float32 (NaN = sin valor; son días y años enteros, exactos en float32).
+# Los agregados, los rollups y el índice de bitmaps se calculan con np.bincount sobre los códigos.
+# El DataFrame solo existe al leer el CSV o las particiones y al reescribir meses del snapshot
+# (a_dataframe).
+def _tipo_codigos(categorias):
+    if categorias < 2**7:
+        return np.int8
+    return np.int16 if categorias < 2**15 else np.int32
+
+# Posición = código del modelo (los códigos de especialidades_dic van de 0 a 62 sin huecos). Los
+# nombres que no están en especialidades_dic van después, en orden alfabético.
+ESPECIALIDADES_MODELO = tuple(especialidades_dic[codigo] for codigo in sorted(especialidades_dic))
+
+def _diccionario_especialidades(nombres):
+    conocidas = set(ESPECIALIDADES_MODELO)
+    return ESPECIALIDADES_MODELO + tuple(sorted({nombre for nombre in nombres if nombre not in conocidas}))
+
+# Traduce códigos sobre el diccionario de a códigos sobre el diccionario a (que lo contiene)
+def _recodificar(codigos, de, a):
+    posicion = {categoria: i for i, categoria in enumerate(a)}
+    # El último elemento traduce el código -1 (sin valor) a -1
+    return np.array([posicion[c] for c in de] + [-1], dtype=np.int32)[codigos]
+
+class TablaCompacta:
+    def __init__(self, filas, codigos, diccionarios, ordenadas, dia, numericos):
+        self.filas = filas
+        self.codigos = codigos # columna -> código de categoría por fila
+        self.diccionarios = diccionarios # columna -> tupla de categorías (str)
+        self.ordenadas = ordenadas # Columnas con categorías en el orden de los rangos, no alfabético
+        self.dia = dia # Días desde 1970-01-01 (int32), None sin DIA_SOLICITACITA
+        self.numericos = numericos # columna -> float32
+
+    @classmethod
+    def desde_df(cls, df):
+        codigos, diccionarios, ordenadas = {}, {}, set()
+        for columna in COLUMNAS_CATEGORICAS:
+            if columna in df.columns and isinstance(df[columna].dtype, pd.CategoricalDtype):
+                categorias = tuple(str(c) for c in df[columna].cat.categories)
+                codigos_df = df[columna].cat.codes.to_numpy()
+                if columna == 'ESPECIALIDAD':
+                    diccionarios[columna] = _diccionario_especialidades(categorias)
+                    codigos_df = _recodificar(codigos_df, categorias, diccionarios[columna])
+                else:
+                    diccionarios[columna] = categorias
+                codigos[columna] = codigos_df.astype(_tipo_codigos(len(diccionarios[columna])), copy=False)
+                if df[columna].cat.ordered:
+                    ordenadas.add(columna)
+        dia = None
+        if 'DIA_SOLICITACITA' in df.columns and pd.api.types.is_datetime64_any_dtype(df['DIA_SOLICITACITA']):
+            dia = df['DIA_SOLICITACITA'].to_numpy(dtype='datetime64[D]').astype(np.int32)
+        numericos = {columna: df[columna].to_numpy(dtype=np.float32, na_value=np.nan)
+                     for columna in COLUMNAS_NUMERICAS if columna in df.columns}
+        return cls(len(df), codigos, diccionarios, frozenset(ordenadas), dia, numericos)
+
+    # Las filas de la máscara (booleana), con los mismos diccionarios
+    def tomar(self, mascara):
+        return TablaCompacta(int(np.count_nonzero(mascara)),
+                             {columna: codigos[mascara] for columna, codigos in self.codigos.items()},
+                             self.diccionarios, self.ordenadas,
+                             self.dia[mascara] if self.dia is not None else None,
+                             {columna: valores[mascara] for columna, valores in self.numericos.items()})
+
+    # Máscara de las filas cuyo valor de columna está en valores
+    def mascara(self, columna, valores):
+        valores = {str(valor) for valor in valores}
+        posiciones = [i for i, categoria in enumerate(self.diccionarios[columna]) if categoria in valores]
+        return np.isin(self.codigos[columna], posiciones)
+
+    # Categorías de columna en el orden en que se listan en los agregados: el del diccionario
+    # (alfabético, o el de los rangos) salvo en ESPECIALIDAD, cuyo diccionario sigue los códigos del
+    # modelo y se lista en orden alfabético
+    def categorias(self, columna):
+        diccionario = self.diccionarios[columna]
+        return tuple(sorted(diccionario)) if columna == 'ESPECIALIDAD' else diccionario
+
+    # Códigos de columna sobre categorias(columna)
+    def codigos_listados(self, columna):
+        categorias = self.categorias(columna)
+        if categorias is self.diccionarios[columna]:
+            return self.codigos[columna]
+        return _recodificar(self.codigos[columna], self.diccionarios[columna], categorias)
+
+    # Concatenación de tablas con las mismas columnas. Si los diccionarios de una columna difieren,
+    # los códigos se traducen a la unión: en orden alfabético, como union_categoricals en
+    # unir_bloques, salvo en las columnas de rangos, donde las categorías son las mismas en todas
+    # las tablas, y en ESPECIALIDAD, que sigue con los códigos del modelo. Las tablas sin filas
+    # también aportan sus categorías.
+    @classmethod
+    def unir(cls, tablas):
+        primera = tablas[0]
+        codigos, diccionarios = {}, {}
+        for columna in primera.codigos:
+            if all(tabla.diccionarios[columna] == primera.diccionarios[columna] for tabla in tablas):
+                diccionarios[columna] = primera.diccionarios[columna]
+                partes = [tabla.codigos[columna] for tabla in tablas]
+            else:
+                todas = [c for tabla in tablas for c in tabla.diccionarios[columna]]
+                if columna in primera.ordenadas:
+                    diccionarios[columna] = tuple(dict.fromkeys(todas))
+                elif columna == 'ESPECIALIDAD':
+                    diccionarios[columna] = _diccionario_especialidades(todas)
+                else:
+                    diccionarios[columna] = tuple(sorted(set(todas)))
+                partes = [_recodificar(tabla.codigos[columna], tabla.diccionarios[columna], diccionarios[columna])
+                          for tabla in tablas]
+            codigos[columna] = np.concatenate(partes).astype(_tipo_codigos(len(diccionarios[columna])), copy=False)
+        return cls(sum(tabla.filas for tabla in tablas), codigos, diccionarios, primera.ordenadas,
+                   np.concatenate([tabla.dia for tabla in tablas]) if primera.dia is not None else None,
+                   {columna: np.concatenate([tabla.numericos[columna] for tabla in tablas]) for columna in primera.numericos})
+
+    # DataFrame para escribir particiones; EDAD y DIFERENCIA_DIAS quedan como float (unir_preprocesados
+    # las vuelve Int64 si no hay NaN)
+    def a_dataframe(self):
+        columnas = {}
+        if self.dia is not None:
+            columnas['DIA_SOLICITACITA'] = self.dia.astype('datetime64[D]').astype('datetime64[us]')
+        for columna, codigos in self.codigos.items():
+            columnas[columna] = pd.Categorical.from_codes(codigos, categories=list(self.diccionarios[columna]),
+                                                          ordered=columna in self.ordenadas)
+        for columna, valores in self.numericos.items():
+            columnas[columna] = valores.astype(np.float64)
+        return pd.DataFrame({columna: columnas[columna] for columna in COLUMNAS_DF if columna in columnas})
+
+    def memoria_mb(self):
+        arreglos = [*self.codigos.values(), *self.numericos.values()] + ([self.dia] if self.dia is not None else [])
+        return sum(arreglo.nbytes for arreglo in arreglos) / (1024**2)
+
+# --- Agregados Precalculados para los Callbacks de Detalle ---
+# Se calculan una sola vez sobre la TablaCompacta de todas las citas (np.bincount sobre los
+# códigos). Cada clic en los gráficos se resuelve con una búsqueda en estos diccionarios (clave =
+# valor seleccionado como string) en lugar de filtrar, copiar y reagrupar las citas.
+
+# Matriz categorías de columna x categorías de sub_columna con la cantidad de filas (o la suma de
+# pesos) de cada par; las filas sin alguna de las dos, o fuera de validos, no cuentan
+def _tabla_cruzada(datos, columna, sub_columna, validos=None, pesos=None):
+    a = datos.codigos_listados(columna).astype(np.int64)
+    b = datos.codigos_listados(sub_columna).astype(np.int64)
+    ka, kb = len(datos.categorias(columna)), len(datos.categorias(sub_columna))
+    elegidas = (a >= 0) & (b >= 0)
+    if validos is not None:
+        elegidas &= validos
+    plano = a[elegidas] * kb + b[elegidas]
+    return np.bincount(plano, weights=pesos[elegidas] if pesos is not None else None, minlength=ka * kb).reshape(ka, kb)
+
+def _conteos_por_valor(datos, columna, sub_columna):
+    if columna not in datos.codigos or sub_columna not in datos.codigos:
+        return {}
+    conteos = _tabla_cruzada(datos, columna, sub_columna)
+    sub_categorias = pd.Index(datos.categorias(sub_columna), dtype=object, name=sub_columna)
+    resultado = {}
+    for valor, fila in zip(datos.categorias(columna), conteos):
+        if fila.any():
+            serie = pd.Series(fila, index=sub_categorias)
+            resultado[valor] = serie[serie > 0].sort_values(ascending=False, kind='stable')
+    return resultado
+
+def _espera_por_valor(datos, columna, sub_columna):
+    # Suma y conteo (no la media) para que los agregados se puedan combinar entre sí
+    if columna not in datos.codigos or sub_columna not in datos.codigos or 'DIFERENCIA_DIAS' not in datos.numericos:
+        return {}
+    espera = datos.numericos['DIFERENCIA_DIAS']
+    con_espera = ~np.isnan(espera)
+    filas = _tabla_cruzada(datos, columna, sub_columna)
+    suma = _tabla_cruzada(datos, columna, sub_columna, con_espera, espera)
+    cantidad = _tabla_cruzada(datos, columna, sub_columna, con_espera)
+    sub_categorias = pd.Index(datos.categorias(sub_columna), dtype=object, name=sub_columna)
+    return {
+        valor: pd.DataFrame({'sum': suma[i], 'count': cantidad[i]}, index=sub_categorias)[filas[i] > 0]
+        for i, valor in enumerate(datos.categorias(columna)) if filas[i].any()
+    }
+
+# Conteo por categoría para las figuras iniciales de los layouts: así el JSON que recibe el
+# navegador crece con el número de categorías y no con el número de citas.
+def contar_categorias(datos, columna):
+    if columna not in datos.codigos:
+        return pd.DataFrame(columns=[columna, 'CANTIDAD'])
+    codigos = datos.codigos_listados(columna)
+    conteos = np.bincount(codigos[codigos >= 0], minlength=len(datos.categorias(columna)))
+    con_filas = conteos > 0 # Las categorías sin filas no aparecían en el histograma
+    return pd.DataFrame({columna: np.array(datos.categorias(columna), dtype=object)[con_filas],
+                         'CANTIDAD': conteos[con_filas]})
+
+def construir_agregados(datos):
+    return {
+        'conteos_categorias': {
+            columna: contar_categorias(datos, columna)
+            for columna in ['Rango de Edad', 'RANGO_DIAS', 'PRESENCIAL_REMOTO', 'SEGURO']
+        },
+        'especialidades_por_edad': _conteos_por_valor(datos, 'Rango de Edad', 'ESPECIALIDAD'),
+        'especialidades_por_espera': _conteos_por_valor(datos, 'RANGO_DIAS', 'ESPECIALIDAD'),
+        'especialidades_por_mes': _conteos_por_valor(datos, 'MES', 'ESPECIALIDAD'),
+        'atendido_por_mes': _conteos_por_valor(datos, 'MES', 'ATENDIDO'),
+        'espera_por_modalidad': _espera_por_valor(datos, 'PRESENCIAL_REMOTO', 'ESPECIALIDAD'),
+        'espera_por_seguro': _espera_por_valor(datos, 'SEGURO', 'SEXO'),
+        'histograma_espera': HistogramaEspera.desde_datos(datos),
+    }
+
+# --- Combinación de Agregados (refresco incremental) ---
+# Todos los agregados son conteos o sumas, así que los de las filas nuevas se suman a los vigentes
+# sin volver a recorrer el df completo. El orden resultante es el mismo que daría
+# construir_agregados sobre todos los datos (categorías en orden alfabético y luego por cantidad).
+def _combinar_conteos(vigentes, nuevos):
+    combinados = dict(vigentes)
+    for valor, conteos in nuevos.items():
+        if valor in combinados:
+            conteos = combinados[valor].add(conteos, fill_value=0).astype('int64')
+            conteos.index = conteos.index.astype(object)
+            conteos = conteos.sort_index().sort_values(ascending=False, kind='stable')
+        combinados[valor] = conteos
+    return combinados
+
+def _combinar_espera(vigentes, nuevos):
+    combinados = dict(vigentes)
+    for valor, espera in nuevos.items():
+        if valor in combinados:
+            espera = combinados[valor].add(espera, fill_value=0)
+            espera.index = espera.index.astype(object)
+            espera = espera.sort_index()
+        combinados[valor] = espera
+    return combinados
+
+def _combinar_conteos_categorias(vigentes, nuevos, columna, categorias):
+    total = pd.concat([vigentes, nuevos]).groupby(columna, sort=False)['CANTIDAD'].sum()
+    orden = [categoria for categoria in categorias if categoria in total.index]
+    return total.reindex(orden).rename_axis(columna).reset_index(name='CANTIDAD')
+
+# datos es la TablaCompacta completa ya combinada (solo se usan sus diccionarios); nuevas es la
+# TablaCompacta de las filas añadidas
+def combinar_agregados(agregados, nuevas, datos):
+    agregados_nuevas = construir_agregados(nuevas)
+    combinados = {
+        'conteos_categorias': {
+            columna: _combinar_conteos_categorias(conteos, agregados_nuevas['conteos_categorias'][columna],
+                                                  columna, datos.categorias(columna))
+            for columna, conteos in agregados['conteos_categorias'].items()
+        },
+    }
+    for nombre, combinar in [('especialidades_por_edad', _combinar_conteos), ('especialidades_por_espera', _combinar_conteos),
+                             ('especialidades_por_mes', _combinar_conteos), ('atendido_por_mes', _combinar_conteos),
+                             ('espera_por_modalidad', _combinar_espera), ('espera_por_seguro', _combinar_espera)]:
+        combinados[nombre] = combinar(agregados[nombre], agregados_nuevas[nombre])
+    combinados['histograma_espera'] = agregados['histograma_espera'].combinar(agregados_nuevas['histograma_espera'])
+    return combinados
+
+def combinar_citas_por_mes(vigentes, nuevas):
+    total = pd.concat([vigentes, calcular_citas_por_mes(nuevas)])
+    total['MES'] = total['MES'].astype(str)
+    total = total.groupby('MES', sort=True)['CANTIDAD_CITAS'].sum().reset_index()
+    total['MES'] = total['MES'].astype('category')
+    return total
+
+# Top 5 especialidades y el resto agrupado en 'Otras', a partir de conteos ya ordenados
+def agrupar_top_especialidades(conteos, n=5):
+    grouped = conteos.iloc[:n].rename_axis('ESPECIALIDAD').reset_index(name='CUENTA')
+    grouped['ESPECIALIDAD'] = grouped['ESPECIALIDAD'].astype(object)
+    resto = int(conteos.iloc[n:].sum())
+    if resto > 0:
+        grouped.loc[len(grouped)] = ['Otras', resto]
+    return grouped.sort_values(by='CUENTA', ascending=False, kind='stable').reset_index(drop=True)
+
+# Media de días de espera por sub-grupo, ordenada de mayor a menor
+def media_espera(espera, columna):
+    mean_wait = (espera['sum'] / espera['count']).rename_axis(columna).reset_index(name='DIFERENCIA_DIAS')
+    mean_wait[columna] = mean_wait[columna].astype(object)
+    return mean_wait.sort_values(by='DIFERENCIA_DIAS', ascending=False)
+
+# --- Histogramas de Días de Espera para Percentiles ---
+# Histograma conjunto de DIFERENCIA_DIAS (en días enteros) por ESPECIALIDAD, modalidad, seguro y
+# sexo: conteos[esp, modalidad, seguro, sexo, valor]. Cada eje tiene una posición extra al final
+# para las filas sin categoría. Los histogramas se suman entre sí, así que los percentiles de
+# cualquier combinación de filtros (o de dos cargas de datos) salen de sumar cortes del arreglo y
+# son exactos, sin volver a ordenar las citas. El costo depende de las categorías y de la
+# cantidad de valores distintos de espera, no de la cantidad de citas.
+COLUMNAS_CUANTILES = ['ESPECIALIDAD', 'PRESENCIAL_REMOTO', 'SEGURO', 'SEXO']
+PERCENTILES_ESPERA = [('Mediana', 0.5), ('P90', 0.9), ('P99', 0.99)]
+
+class HistogramaEspera:
+    def __init__(self, categorias, valores, conteos):
+        self.categorias = categorias # columna -> lista de categorías (str)
+        self.valores = valores # días de espera distintos, ordenados
+        self.conteos = conteos
+
+    @classmethod
+    def desde_datos(cls, datos):
+        categorias = {}
+        codigos = []
+        for columna in COLUMNAS_CUANTILES:
+            if columna in datos.codigos:
+                categorias[columna] = list(datos.categorias(columna))
+                c = datos.codigos_listados(columna).astype(np.int64)
+                codigos.append(np.where(c < 0, len(categorias[columna]), c))
+            else:
+                categorias[columna] = []
+                codigos.append(np.zeros(datos.filas, dtype=np.int64))
+        espera = datos.numericos.get('DIFERENCIA_DIAS')
+        if espera is None:
+            espera = np.full(datos.filas, np.nan, dtype=np.float32)
+        validos = ~np.isnan(espera)
+        valores, posicion = np.unique(np.rint(espera[validos]).astype(np.int64), return_inverse=True)
+        forma = tuple(len(categorias[columna]) + 1 for columna in COLUMNAS_CUANTILES) + (len(valores),)
+        plano = np.ravel_multi_index(tuple(c[validos] for c in codigos) + (posicion,), forma) if valores.size else np.array([], dtype=np.int64)
+        conteos = np.bincount(plano, minlength=int(np.prod(forma))).reshape(forma)
+        return cls(categorias, valores, conteos)
+
+    # Suma de dos histogramas (por ejemplo, el vigente y el de las filas nuevas de un refresco)
+    def combinar(self, otro):
+        categorias = {columna: sorted(set(self.categorias[columna]) | set(otro.categorias[columna]))
+                      for columna in COLUMNAS_CUANTILES}
+        valores = np.union1d(self.valores, otro.valores)
+        forma = tuple(len(categorias[columna]) + 1 for columna in COLUMNAS_CUANTILES) + (len(valores),)
+        conteos = np.zeros(forma, dtype=np.int64)
+        for histograma in (self, otro):
+            posiciones = [
+                np.array([categorias[columna].index(c) for c in histograma.categorias[columna]] + [len(categorias[columna])], dtype=np.int64)
+                for columna in COLUMNAS_CUANTILES
+            ]
+            posiciones.append(np.searchsorted(valores, histograma.valores))
+            conteos[np.ix_(*posiciones)] += histograma.conteos
+        return HistogramaEspera(categorias, valores, conteos)
+
+    # Histograma por categoría de columna dentro de filtros ({columna: [valores]}): (categorías, conteos)
+    def _por_categoria(self, filtros, columna):
+        conteos = self.conteos
+        for eje, nombre in enumerate(COLUMNAS_CUANTILES):
+            if nombre == columna:
+                conteos = conteos.take(np.arange(len(self.categorias[nombre])), axis=eje)
+            elif filtros.get(nombre):
+                posiciones = [self.categorias[nombre].index(str(v)) for v in filtros[nombre] if str(v) in self.categorias[nombre]]
+                conteos = conteos.take(posiciones, axis=eje).sum(axis=eje, keepdims=True)
+            else:
+                conteos = conteos.sum(axis=eje, keepdims=True)
+        eje = COLUMNAS_CUANTILES.index(columna)
+        return self.categorias[columna], conteos.reshape(conteos.shape[eje], len(self.valores))
+
+    # Cantidad y percentiles (interpolación lineal, como np.percentile) por categoría de columna;
+    # solo las categorías con datos
+    def percentiles(self, filtros, columna, percentiles=PERCENTILES_ESPERA):
+        categorias, conteos = self._por_categoria(filtros, columna)
+        acumulado = np.cumsum(conteos, axis=1)
+        cantidad = acumulado[:, -1] if len(self.valores) else np.zeros(len(categorias), dtype=np.int64)
+        con_datos = cantidad > 0
+        acumulado, cantidad = acumulado[con_datos], cantidad[con_datos]
+        tabla = pd.DataFrame({'count': cantidad}, index=pd.Index(np.array(categorias, dtype=object)[con_datos], name=columna))
+        for nombre, q in percentiles:
+            tabla[nombre] = percentil_histograma(self.valores, acumulado, cantidad, q)
+        return tabla
+
+# Percentil q (interpolación lineal, como np.percentile) de cada fila de histogramas sobre valores,
+# a partir de sus conteos acumulados; cantidad (> 0) es el total de cada fila
+def percentil_histograma(valores, acumulado, cantidad, q):
+    posicion = q * (cantidad - 1)
+    abajo = np.floor(posicion).astype(np.int64)
+    # Valor del k-ésimo elemento ordenado: primer valor cuyo acumulado supera k
+    valor_abajo = valores[(acumulado > abajo[:, None]).argmax(axis=1)]
+    valor_arriba = valores[(acumulado > (abajo + 1).clip(max=cantidad - 1)[:, None]).argmax(axis=1)]
+    return valor_abajo + (posicion - abajo) * (valor_arriba - valor_abajo)
+
+# Suma de dos histogramas (valores, conteos[..., valor]) con ejes de valores distintos
+def sumar_histogramas(a, b):
+    valores = np.union1d(a[0], b[0])
+    conteos = np.zeros(a[1].shape[:-1] + (len(valores),), dtype=np.int64)
+    for valores_parte, conteos_parte in (a, b):
+        conteos[..., np.searchsorted(valores, valores_parte)] += conteos_parte
+    return valores, conteos
+
+# Media (de los agregados) y percentiles (del histograma) por sub-grupo en formato largo para un
+# gráfico de barras agrupadas, ordenado por media de mayor a menor
+def espera_con_percentiles(espera, histograma, columna, filtros):
+    mean_wait = media_espera(espera, columna)
+    tabla = histograma.percentiles(filtros, columna)
+    tabla = tabla.reindex(mean_wait[columna])
+    largo = [mean_wait.assign(ESTADISTICA='Media')]
+    for nombre, _ in PERCENTILES_ESPERA:
+        largo.append(pd.DataFrame({columna: mean_wait[columna].to_numpy(), 'DIFERENCIA_DIAS': tabla[nombre].to_numpy(),
+                                   'ESTADISTICA': nombre}))
+    return pd.concat(largo, ignore_index=True)
+
+# --- Índice de Bitmaps para Filtros Cruzados ---
+# Para cada categoría de las columnas categóricas se guarda un bitmap (np.packbits, 1 bit por fila)
+# de las filas que la tienen. Un filtro combinado es el OR de los bitmaps de los valores elegidos
+# de cada columna y el AND entre columnas: operaciones sobre arreglos de filas/8 bytes en lugar de
+# comparar columnas completas. Los conteos salen de contar bits; las estadísticas de espera salen
+# del histograma de días de espera (enteros) de las filas filtradas, que se suma entre índices.
+COLUMNAS_INDICE = ['MES', 'Rango de Edad', 'RANGO_DIAS', 'PRESENCIAL_REMOTO', 'SEGURO', 'ATENDIDO', 'SEXO', 'ESPECIALIDAD']
+
+_BITS_POR_BYTE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def contar_bits(bitmap):
+    return int(_BITS_POR_BYTE[bitmap].sum(dtype=np.int64))
+
+# Cantidad, media, mediana y p90 de un histograma de días de espera
+def estadisticas_espera(valores, conteos):
+    cantidad = int(conteos.sum())
+    if cantidad == 0:
+        return {'filas': 0, 'media': None, 'mediana': None, 'p90': None}
+    acumulado = np.cumsum(conteos)[None, :]
+    total = np.array([cantidad])
+    return {
+        'filas': cantidad,
+        'media': float(valores @ conteos / cantidad),
+        'mediana': float(percentil_histograma(valores, acumulado, total, 0.5)[0]),
+        'p90': float(percentil_histograma(valores, acumulado, total, 0.9)[0]),
+    }
+
+# Suma y cantidad de días de espera por categoría a partir de sus histogramas (categoría x valor)
+def espera_por_categoria(categorias, valores, conteos, columna):
+    tabla = pd.DataFrame({'sum': (conteos @ valores).astype(np.float64), 'count': conteos.sum(axis=1)},
+                         index=pd.Index(categorias, name=columna))
+    return tabla[tabla['count'] > 0]
+
+# Días de espera distintos (enteros, ordenados) y la posición de cada fila entre ellos (-1 = NaN)
+def posiciones_espera(datos):
+    espera = datos.numericos.get('DIFERENCIA_DIAS')
+    if espera is None:
+        espera = np.full(datos.filas, np.nan, dtype=np.float32)
+    validos = ~np.isnan(espera)
+    valores, posicion = np.unique(np.rint(espera[validos]).astype(np.int64), return_inverse=True)
+    posiciones = np.full(datos.filas, -1, dtype=np.int32)
+    posiciones[validos] = posicion
+    return valores, posiciones
+
+# Se arma sobre una TablaCompacta y usa sus códigos sin copiarlos
+class IndiceBitmaps:
+    def __init__(self, datos):
+        self.filas = datos.filas
+        self.bitmaps = {} # columna -> {categoría (str): bitmap}
+        self.codigos = {} # columna -> códigos de categoría por fila (-1 = NaN)
+        for columna in COLUMNAS_INDICE:
+            if columna not in datos.codigos:
+                continue
+            codigos = datos.codigos[columna]
+            self.codigos[columna] = codigos
+            self.bitmaps[columna] = {
+                categoria: np.packbits(codigos == i)
+                for i, categoria in enumerate(datos.diccionarios[columna])
+            }
+        self.valores, self.posicion = posiciones_espera(datos)
+        self.todas = np.packbits(np.ones(self.filas, dtype=bool))
+
+    def categorias(self, columna):
+        return list(self.bitmaps.get(columna, {}))
+
+    # filtros: {columna: [valores]}; una columna sin valores (o ausente) no filtra
+    def filtrar(self, filtros):
+        resultado = self.todas
+        for columna, valores in filtros.items():
+            if not valores:
+                continue
+            bitmaps = self.bitmaps.get(columna, {})
+            seleccion = np.zeros_like(self.todas)
+            for valor in valores:
+                bitmap = bitmaps.get(str(valor))
+                if bitmap is not None:
+                    seleccion |= bitmap
+            resultado = resultado & seleccion
+        return resultado
+
+    def contar(self, filtros):
+        return contar_bits(self.filtrar(filtros))
+
+    # Cantidad de filas por categoría de columna dentro del filtro (sin filas en cero)
+    def desglose(self, filtros, columna, bitmap=None):
+        bitmap = self.filtrar(filtros) if bitmap is None else bitmap
+        conteos = pd.Series({categoria: contar_bits(bitmap & bitmap_categoria)
+                             for categoria, bitmap_categoria in self.bitmaps.get(columna, {}).items()}, dtype='int64')
+        return conteos[conteos > 0]
+
+    def mascara(self, filtros):
+        return np.unpackbits(self.filtrar(filtros), count=self.filas).astype(bool)
+
+    # Resultado parcial de IndiceParticionado.resumen para las filas de este índice, con un solo
+    # filtrado: {'filas', 'valores', 'espera' (histograma), 'desglose', 'espera_por' (suma y cantidad)}
+    def parcial(self, filtros, desgloses=(), esperas=()):
+        bitmap = self.filtrar(filtros)
+        mascara = np.unpackbits(bitmap, count=self.filas).astype(bool)
+        posicion = self.posicion[mascara]
+        con_espera = posicion >= 0
+        espera_por = {}
+        for columna in esperas:
+            categorias = self.categorias(columna)
+            codigos = self.codigos[columna][mascara][con_espera].astype(np.int64)
+            validos = codigos >= 0
+            forma = (len(categorias), len(self.valores))
+            plano = np.ravel_multi_index((codigos[validos], posicion[con_espera][validos]), forma)
+            conteos = np.bincount(plano, minlength=forma[0] * forma[1]).reshape(forma)
+            espera_por[columna] = espera_por_categoria(categorias, self.valores, conteos, columna)
+        return {
+            'filas': contar_bits(bitmap),
+            'valores': self.valores,
+            'espera': np.bincount(posicion[con_espera], minlength=len(self.valores)),
+            'desglose': {columna: self.desglose(filtros, columna, bitmap) for columna in desgloses},
+            'espera_por': espera_por,
+        }
+
+# Filas, histograma de días de espera y, por columna del índice, filas e histograma de espera por
+# categoría de un conjunto de citas, sin las citas. Alcanza para una consulta que no cruza dos
+# columnas dentro de esas filas: sin filtros, o con filtro, desgloses y esperas sobre una misma
+# columna (un filtro que abarca todas las filas, como MES en un mes frío, no cuenta, y una columna
+# con una sola categoría se desglosa sola). Para el resto parcial() devuelve None y hace falta el
+# índice de bitmaps.
+class ResumenIndice:
+    def __init__(self, filas, valores, espera, columnas):
+        self.filas = filas
+        self.valores = valores
+        self.espera = espera # histograma de todas las filas
+        self.columnas = columnas # columna -> (categorías, filas e histogramas [categoría, valor] por categoría)
+
+    @classmethod
+    def desde_datos(cls, datos):
+        valores, posiciones = posiciones_espera(datos)
+        con_espera = posiciones >= 0
+        columnas = {}
+        for columna in COLUMNAS_INDICE:
+            if columna not in datos.codigos:
+                continue
+            categorias = list(datos.diccionarios[columna])
+            codigos = datos.codigos[columna].astype(np.int64)
+            validos = con_espera & (codigos >= 0)
+            forma = (len(categorias), len(valores))
+            plano = np.ravel_multi_index((codigos[validos], posiciones[validos]), forma)
+            columnas[columna] = (categorias, np.bincount(codigos[codigos >= 0], minlength=len(categorias)),
+                                 np.bincount(plano, minlength=forma[0] * forma[1]).reshape(forma).astype(np.int32))
+        return cls(datos.filas, valores, np.bincount(posiciones[con_espera], minlength=len(valores)), columnas)
+
+    def guardar(self, ruta):
+        arreglos = {'filas': np.array(self.filas), 'valores': self.valores, 'espera': self.espera}
+        for columna, (categorias, filas, histogramas) in self.columnas.items():
+            arreglos[f'{columna}.categorias'] = np.array(categorias, dtype=str)
+            arreglos[f'{columna}.filas'] = filas
+            arreglos[f'{columna}.histogramas'] = histogramas
+        def escribir(temporal):
+            with open(temporal, 'wb') as f:
+                np.savez(f, **arreglos)
+        _escribir_atomico(ruta, escribir)
+
+    @classmethod
+    def cargar(cls, ruta):
+        with np.load(ruta) as arreglos:
+            columnas = {
+                columna: (arreglos[f'{columna}.categorias'].tolist(), arreglos[f'{columna}.filas'], arreglos[f'{columna}.histogramas'])
+                for columna in COLUMNAS_INDICE if f'{columna}.categorias' in arreglos
+            }
+            return cls(int(arreglos['filas']), arreglos['valores'], arreglos['espera'], columnas)
+
+    # Filas e histogramas por categoría de columna dentro del filtro sobre filtrada (elegidas); None
+    # si hace falta cruzar dos columnas
+    def _por_categoria(self, columna, filtrada, elegidas, filas, espera):
+        categorias, filas_columna, histogramas = self.columnas[columna]
+        if filtrada is None:
+            return filas_columna, histogramas
+        if columna == filtrada:
+            return filas_columna * elegidas, histogramas * elegidas[:, None]
+        unica = np.flatnonzero(filas_columna == self.filas)
+        if unica.size == 0:
+            return None
+        filas_columna = np.zeros_like(filas_columna)
+        filas_columna[unica[0]] = filas
+        histogramas = np.zeros_like(histogramas)
+        histogramas[unica[0]] = espera
+        return filas_columna, histogramas
+
+    # Mismo resultado que IndiceBitmaps.parcial, o None si el resumen no alcanza
+    def parcial(self, filtros, desgloses=(), esperas=()):
+        filtrada = elegidas = None
+        for columna, valores in filtros.items():
+            if not valores:
+                continue
+            if columna not in self.columnas or filtrada is not None:
+                return None
+            categorias, filas_columna, _ = self.columnas[columna]
+            seleccion = {str(valor) for valor in valores}
+            marcadas = np.array([categoria in seleccion for categoria in categorias], dtype=bool)
+            if filas_columna[marcadas].sum() < self.filas:
+                filtrada, elegidas = columna, marcadas
+        if filtrada is None:
+            filas, espera = self.filas, self.espera
+        else:
+            filas = int(self.columnas[filtrada][1][elegidas].sum())
+            espera = self.columnas[filtrada][2][elegidas].sum(axis=0)
+        por_categoria = {}
+        for columna in {*desgloses, *esperas}:
+            por_categoria[columna] = self._por_categoria(columna, filtrada, elegidas, filas, espera)
+            if por_categoria[columna] is None:
+                return None
+        desglose = {}
+        for columna in desgloses:
+            conteos = pd.Series(por_categoria[columna][0], index=self.columnas[columna][0], dtype='int64')
+            desglose[columna] = conteos[conteos > 0]
+        return {
+            'filas': filas,
+            'valores': self.valores,
+            'espera': espera,
+            'desglose': desglose,
+            'espera_por': {columna: espera_por_categoria(self.columnas[columna][0], self.valores, por_categoria[columna][1], columna)
+                           for columna in esperas},
+        }
+
+# Índice de bitmaps de las filas residentes más un índice por cada mes frío (ver
+# AlmacenParticiones) que se lee de su partición cuando una consulta lo necesita. Un filtro con MES
+# solo toca los meses elegidos; sin MES recorre todos. Cada mes (y las filas residentes) tiene un
+# ResumenIndice en memoria que responde las consultas que no cruzan columnas dentro del mes; un mes
+# frío se lee de disco solo para las demás. resumen() calcula todo lo que pide una consulta en una
+# sola pasada, así que cada mes frío se lee a lo sumo una vez por consulta y en memoria hay un solo
+# mes frío a la vez además de la caché. Los resultados de cada parte se suman: son conteos, sumas o
+# (para los percentiles) histogramas de días de espera.
+class IndiceParticionado:
+    def __init__(self, residentes, particiones=None):
+        self.residente = IndiceBitmaps(residentes)
+        self.particiones = particiones
+        self.frias = particiones.frias() if particiones is not None else []
+        self.columnas = list(self.residente.bitmaps)
+        self.lecturas = 0 # Particiones leídas del disco por este proceso
+        self._cache = OrderedDict() # mes -> IndiceBitmaps, del menos al más usado
+        self._resumen_residente = ResumenIndice.desde_datos(residentes)
+        self._resumenes = {} # mes frío -> ResumenIndice, sin límite (son chicos)
+        self._lock = threading.Lock()
+
+    def en_cache(self):
+        with self._lock:
+            return len(self._cache)
+
+    def _indice_frio(self, mes, cachear):
+        with self._lock:
+            indice = self._cache.get(mes)
+            if indice is not None:
+                self._cache.move_to_end(mes)
+                return indice
+        indice = IndiceBitmaps(TablaCompacta.desde_df(self._leer_particion(mes)))
+        with self._lock:
+            self.lecturas += 1
+            if cachear:
+                self._cache[mes] = indice
+                while len(self._cache) > max(PARTICIONES_EN_CACHE, 0):
+                    self._cache.popitem(last=False)
+        return indice
+
+    def _leer_particion(self, mes):
+        try:
+            return self.particiones.leer(mes)
+        except FileNotFoundError:
+            # Otros workers guardaron versiones más nuevas y ya borraron el archivo: el mes se lee de
+            # la versión vigente según el manifiesto hasta que este worker refresque
+            manifiesto = leer_manifiesto()
+            if manifiesto is None or manifiesto['clave'] == self.particiones.clave:
+                raise
+            vigentes = AlmacenParticiones.cargar(manifiesto['clave'])
+            if mes not in vigentes.archivos:
+                raise
+            logger.warning("Advertencia: La partición de %s de la versión '%s' ya no existe; se lee la de la versión '%s'.",
+                           mes, self.particiones.clave, vigentes.clave)
+            return vigentes.leer(mes)
+
+    def _resumen_frio(self, mes):
+        with self._lock:
+            resumen = self._resumenes.get(mes)
+        if resumen is not None:
+            return resumen
+        try:
+            resumen = self.particiones.leer_resumen(mes)
+        except (OSError, ValueError, KeyError) as e:
+            # Sin resumen guardado (o ya borrado por otro worker): se arma leyendo la partición
+            logger.info("Resumen de la partición de %s no disponible (%s); se lee la partición.", mes, e)
+            resumen = ResumenIndice.desde_datos(TablaCompacta.desde_df(self._leer_particion(mes)))
+            with self._lock:
+                self.lecturas += 1
+        with self._lock:
+            self._resumenes[mes] = resumen
+        return resumen
+
+    # Resultados parciales del resumen residente (o del índice residente) y de cada mes frío del filtro
+    def _parciales(self, filtros, desgloses, esperas):
+        parcial = self._resumen_residente.parcial(filtros, desgloses, esperas)
+        yield parcial if parcial is not None else self.residente.parcial(filtros, desgloses, esperas)
+        elegidos = {str(mes) for mes in filtros.get('MES') or []}
+        pendientes = []
+        for mes in self.frias:
+            if elegidos and mes not in elegidos:
+                continue
+            parcial = self._resumen_frio(mes).parcial(filtros, desgloses, esperas)
+            if parcial is None:
+                pendientes.append(mes)
+            else:
+                yield parcial
+        # Una consulta que lee más meses fríos de los que caben en la caché no la desplaza
+        cachear = len(pendientes) <= PARTICIONES_EN_CACHE
+        for mes in pendientes:
+            yield self._indice_frio(mes, cachear).parcial(filtros, desgloses, esperas)
+
+    def categorias(self, columna):
+        categorias = self.residente.categorias(columna)
+        # MES suma los meses fríos; ESPECIALIDAD está en el orden de los códigos del modelo y los
+        # resúmenes la listan en orden alfabético
+        if columna == 'MES':
+            categorias = sorted(set(categorias) | set(self.frias))
+        elif columna == 'ESPECIALIDAD':
+            categorias = sorted(categorias)
+        return categorias
+
+    def _orden(self, columna, valores):
+        # Categorías de los meses fríos que no están en las filas residentes van al final
+        orden = self.categorias(columna)
+        conocidas = set(orden)
+        return orden + [valor for valor in valores if valor not in conocidas]
+
+    # {'filas': int, 'espera': estadísticas, 'desglose': {columna: conteos por categoría},
+    #  'espera_por': {columna: suma, cantidad y media de espera por categoría}}, como IndiceBitmaps
+    def resumen(self, filtros, desgloses=(), esperas=()):
+        filas = 0
+        histograma = (np.array([], dtype=np.int64), np.array([], dtype=np.int64))
+        conteos = {columna: pd.Series(dtype='int64') for columna in desgloses}
+        tablas = {columna: None for columna in esperas}
+        for parcial in self._parciales(filtros, desgloses, esperas):
+            filas += parcial['filas']
+            histograma = sumar_histogramas(histograma, (parcial['valores'], parcial['espera']))
+            for columna in desgloses:
+                conteos[columna] = conteos[columna].add(parcial['desglose'][columna], fill_value=0)
+            for columna in esperas:
+                tabla = parcial['espera_por'][columna]
+                tablas[columna] = tabla if tablas[columna] is None else tablas[columna].add(tabla, fill_value=0)
+        for columna, serie in conteos.items():
+            serie = serie.reindex(self._orden(columna, serie.index)).dropna().astype('int64')
+            conteos[columna] = serie[serie > 0]
+        for columna, tabla in tablas.items():
+            tabla = tabla.reindex(self._orden(columna, tabla.index)).dropna()
+            tabla['count'] = tabla['count'].astype('int64')
+            tabla = tabla[tabla['count'] > 0].rename_axis(columna)
+            tabla['mean'] = tabla['sum'] / tabla['count']
+            tablas[columna] = tabla
+        return {'filas': filas, 'espera': estadisticas_espera(*histograma), 'desglose': conteos, 'espera_por': tablas}
+
+# --- Rollups de Tiempo por Día, Semana y Mes ---
+# Cantidad de citas por día (total, por ATENDIDO y por ESPECIALIDAD) en arreglos densos desde el
+# primer hasta el último día de los datos, sumados también por semana (de lunes a domingo) y por
+# mes. La línea de tiempo toma de aquí la serie de la resolución que corresponde al zoom (solo los
+# periodos visibles) y el detalle de cualquier rango de fechas sale de las sumas acumuladas
+# diarias: la resta de dos filas, sin recorrer las citas.
+RESOLUCIONES_TIEMPO = {'D': 'Día', 'W': 'Semana', 'M': 'Mes'}
+COLUMNAS_ROLLUP = ['ATENDIDO', 'ESPECIALIDAD']
+
+# Resolución de la línea de tiempo según los días visibles
+def resolucion_para(dias):
+    if dias <= 92:
+        return 'D'
+    if dias <= 730:
+        return 'W'
+    return 'M'
+
+def _dia(fecha):
+    return np.datetime64(pd.Timestamp(fecha).date(), 'D')
+
+class RollupsTiempo:
+    # diario: {'total': conteos por día, columna: conteos por día y categoría} desde primer_dia
+    def __init__(self, categorias, primer_dia, diario):
+        self.categorias = categorias
+        self.primer_dia = primer_dia
+        self.diario = diario
+        n = len(diario['total'])
+        self.fechas = primer_dia + np.arange(n) if primer_dia is not None else np.array([], dtype='datetime64[D]')
+        # Fila i = suma de los días anteriores al día i
+        self.acumulado = {
+            nombre: np.concatenate([np.zeros((1,) + tabla.shape[1:], dtype=np.int64), np.cumsum(tabla, axis=0)])
+            for nombre, tabla in self.diario.items()
+        }
+        # 1970-01-01 fue jueves: (días desde esa fecha + 3) % 7 es el día de la semana con lunes = 0
+        inicios = {
+            'D': self.fechas,
+            'W': self.fechas - (self.fechas.astype(np.int64) + 3) % 7,
+            'M': self.fechas.astype('datetime64[M]').astype('datetime64[D]'),
+        }
+        self.periodos = {}
+        for resolucion, inicio in inicios.items():
+            limites = np.flatnonzero(np.r_[True, inicio[1:] != inicio[:-1]]) if inicio.size else np.array([], dtype=np.int64)
+            ultimos = np.r_[limites[1:] - 1, len(inicio) - 1] if inicio.size else limites
+            self.periodos[resolucion] = {
+                'inicio': inicio[limites],
+                'fin': self.fechas[ultimos], # Último día con datos del periodo
+                'total': np.add.reduceat(self.diario['total'], limites) if inicio.size else self.diario['total'],
+            }
+
+    @classmethod
+    def desde_datos(cls, datos):
+        columnas = [columna for columna in COLUMNAS_ROLLUP if columna in datos.codigos]
+        categorias = {columna: list(datos.categorias(columna)) for columna in columnas}
+        if datos.dia is None or datos.filas == 0:
+            diario = {'total': np.zeros(0, dtype=np.int64)}
+            diario.update({columna: np.zeros((0, len(categorias[columna])), dtype=np.int64) for columna in columnas})
+            return cls(categorias, None, diario)
+        primero = int(datos.dia.min())
+        n = int(datos.dia.max()) - primero + 1
+        posicion = datos.dia.astype(np.int64) - primero
+        diario = {'total': np.bincount(posicion, minlength=n)}
+        for columna in columnas:
+            k = len(categorias[columna])
+            codigos = datos.codigos_listados(columna).astype(np.int64)
+            validos = codigos >= 0
+            diario[columna] = np.bincount(posicion[validos] * k + codigos[validos], minlength=n * k).reshape(n, k)
+        return cls(categorias, np.datetime64(primero, 'D'), diario)
+
+    # Suma de dos rollups (el vigente y el de las filas nuevas de un refresco): el resultado cubre
+    # desde el primer hasta el último día de ambos, con la unión ordenada de las categorías
+    def combinar(self, otro):
+        if otro.primer_dia is None:
+            return self
+        if self.primer_dia is None:
+            return otro
+        categorias = {columna: sorted(set(self.categorias.get(columna, [])) | set(otro.categorias.get(columna, [])))
+                      for columna in COLUMNAS_ROLLUP if columna in self.categorias or columna in otro.categorias}
+        primer_dia = min(self.primer_dia, otro.primer_dia)
+        n = int((max(self.fechas[-1], otro.fechas[-1]) - primer_dia).astype(np.int64)) + 1
+        diario = {'total': np.zeros(n, dtype=np.int64)}
+        diario.update({columna: np.zeros((n, len(lista)), dtype=np.int64) for columna, lista in categorias.items()})
+        for rollup in (self, otro):
+            i = int((rollup.primer_dia - primer_dia).astype(np.int64))
+            j = i + len(rollup.fechas)
+            diario['total'][i:j] += rollup.diario['total']
+            for columna, lista in rollup.categorias.items():
+                posiciones = [categorias[columna].index(c) for c in lista]
+                diario[columna][i:j, posiciones] += rollup.diario[columna]
+        return RollupsTiempo(categorias, primer_dia, diario)
+
+    def limites(self):
+        if self.primer_dia is None:
+            return None, None
+        return str(self.fechas[0]), str(self.fechas[-1])
+
+    # Periodos de la resolución que se superponen con [desde, hasta], más uno a cada lado para que
+    # la línea llegue a los bordes del gráfico
+    def serie(self, resolucion, desde=None, hasta=None):
+        periodos = self.periodos[resolucion]
+        i = 0 if desde is None else max(int(np.searchsorted(periodos['fin'], _dia(desde), side='left')) - 1, 0)
+        j = len(periodos['inicio']) if hasta is None else int(np.searchsorted(periodos['inicio'], _dia(hasta), side='right')) + 1
+        inicio = periodos['inicio'][i:j]
+        return pd.DataFrame({
+            'INICIO': inicio.astype(str),
+            'FIN': periodos['fin'][i:j].astype(str),
+            'ETIQUETA': etiquetas_periodo(resolucion, inicio),
+            'CANTIDAD_CITAS': periodos['total'][i:j],
+        })
+
+    # Cantidad de citas entre desde y hasta (ambos incluidos): {'total': int, columna: Series con
+    # los conteos de mayor a menor, sin ceros}
+    def rango(self, desde, hasta):
+        if self.primer_dia is None:
+            i = j = 0
+        else:
+            i = min(max(int((_dia(desde) - self.primer_dia).astype(np.int64)), 0), len(self.fechas))
+            j = min(max(int((_dia(hasta) - self.primer_dia).astype(np.int64)) + 1, i), len(self.fechas))
+        resultado = {'total': int(self.acumulado['total'][j] - self.acumulado['total'][i])}
+        for columna, categorias in self.categorias.items():
+            conteos = pd.Series(self.acumulado[columna][j] - self.acumulado[columna][i], index=pd.Index(categorias, dtype=object))
+            conteos = conteos[conteos > 0]
+            resultado[columna] = conteos.sort_values(ascending=False, kind='stable')
+        return resultado
+
+def etiquetas_periodo(resolucion, inicios):
+    if resolucion == 'M':
+        return [str(inicio)[:7] for inicio in inicios]
+    if resolucion == 'W':
+        return [f"la semana del {inicio}" for inicio in inicios]
+    return [str(inicio) for inicio in inicios]
+
+# --- Estado de los Datos ---
+# Todo lo que se deriva de las citas vive en un único objeto que se reemplaza de una sola vez; cada
+# callback toma la referencia a estado_datos una vez y trabaja con esa versión completa.
+COLUMNAS_DF = ['DIA_SOLICITACITA', 'MES', 'EDAD', 'Rango de Edad', 'DIFERENCIA_DIAS', 'RANGO_DIAS',
+               'ESPECIALIDAD', 'PRESENCIAL_REMOTO', 'SEGURO', 'ATENDIDO', 'SEXO']
+
+# tabla es la TablaCompacta con todas las citas. Los agregados y los rollups cubren todos los
+# meses; con particiones, self.tabla y el índice de bitmaps en memoria solo tienen los meses
+# residentes (el resto se lee de disco cuando hace falta).
+class EstadoDatos:
+    def __init__(self, tabla, citas_por_mes, version, agregados=None, rollups=None, particiones=None):
+        self.citas_por_mes = citas_por_mes
+        self.version = version # Clave (hash de la fuente + versión del preprocesamiento) o None
+        self.agregados = agregados if agregados is not None else construir_agregados(tabla)
+        self.rollups = rollups if rollups is not None else RollupsTiempo.desde_datos(tabla)
+        self.particiones = particiones
+        if particiones is not None:
+            self.filas = particiones.filas()
+            if particiones.frias():
+                tabla = tabla.tomar(tabla.mascara('MES', particiones.residentes()))
+        else:
+            self.filas = tabla.filas
+        self.tabla = tabla
+        self.indice = IndiceParticionado(tabla, particiones)
+
+    @classmethod
+    def vacio(cls):
+        # Tabla vacía con las columnas esperadas para evitar errores en las apps
+        return cls(TablaCompacta.desde_df(pd.DataFrame(columns=COLUMNAS_DF)), pd.DataFrame(columns=['MES', 'CANTIDAD_CITAS']), None)
+
+def cargar_estado_datos():
+    try:
+        df, citas_por_mes, particiones, version = cargar_datos()
+    except requests.exceptions.RequestException as e:
+        logger.error("ERROR: No se pudo descargar el DataFrame de datos desde %s: %s", HF_DATA_URL, e)
+        registrar_error_carga('datos', e)
+        return EstadoDatos.vacio()
+    except Exception as e:
+        logger.exception("ERROR FATAL al cargar o preprocesar el DataFrame: %s", e)
+        registrar_error_carga('datos', e)
+        return EstadoDatos.vacio()
+    with medir_fase('agregados'):
+        tabla = TablaCompacta.desde_df(df)
+        del df
+        estado = EstadoDatos(tabla, citas_por_mes, version, particiones=particiones)
+    del tabla
+    with _lock_carga:
+        estado_carga['memoria']['residente_mb'] = round(float(estado.tabla.memoria_mb()), 2)
+    logger.info("Agregados precalculados: %s", [(nombre, len(tabla)) for nombre, tabla in estado.agregados.items() if isinstance(tabla, dict)])
+    return estado
+
+estado_datos = EstadoDatos.vacio()
+
+
+# --- Motor de Inferencia Compilado para el Random Forest ---
+# Con MOTOR_FOREST=compilado el bosque de scikit-learn se convierte una vez en arreglos planos
+# (característica, umbral, hijos y valor de cada nodo, todos los árboles concatenados) guardados en
+# un .npz sin comprimir dentro de SNAPSHOT_DIR. En los siguientes arranques el .npz se abre con
+# memory-map en lugar de descargar y deserializar el pickle, y la predicción recorre todos los
+# árboles a la vez con NumPy, sin la validación de entrada ni el despacho por árbol de scikit-learn.
+MOTOR_FOREST = os.environ.get('MOTOR_FOREST', 'sklearn') # 'sklearn' o 'compilado'
+# Columnas de entrada del modelo, en el orden con el que fue entrenado
+COLUMNAS_MODELO = ['ESPECIALIDAD_cod', 'EDAD', 'día', 'semana_del_año']
+
+class BosqueCompilado:
+    def __init__(self, arreglos):
+        self.caracteristica = arreglos['caracteristica']
+        self.umbral = arreglos['umbral']
+        self.hijos = arreglos['hijos'].reshape(-1) # [izquierdo, derecho] de cada nodo, intercalados
+        self.faltante_izquierda = arreglos['faltante_izquierda']
+        self.valor = arreglos['valor']
+        self.raices = arreglos['raices']
+        self.columnas = [str(c) for c in arreglos['columnas']]
+        self._hay_faltantes = bool(self.faltante_izquierda.any())
+
+    @classmethod
+    def desde_sklearn(cls, modelo):
+        if not hasattr(modelo, 'estimators_') or getattr(modelo, 'n_outputs_', 1) != 1 or hasattr(modelo, 'classes_'):
+            raise ValueError("Solo se pueden compilar bosques de regresión con una salida.")
+        arboles = [estimador.tree_ for estimador in modelo.estimators_]
+        desplazamientos = np.cumsum([0] + [arbol.node_count for arbol in arboles])
+        partes = {nombre: [] for nombre in ['caracteristica', 'umbral', 'hijos', 'faltante_izquierda', 'valor']}
+        for desplazamiento, arbol in zip(desplazamientos, arboles):
+            nodos = np.arange(arbol.node_count) + desplazamiento
+            hoja = arbol.children_left == -1
+            # En las hojas ambos hijos apuntan a la propia hoja: así se reconoce el final del recorrido
+            partes['hijos'].append(np.stack([
+                np.where(hoja, nodos, arbol.children_left + desplazamiento),
+                np.where(hoja, nodos, arbol.children_right + desplazamiento),
+            ], axis=1))
+            partes['caracteristica'].append(np.where(hoja, 0, arbol.feature))
+            partes['umbral'].append(arbol.threshold)
+            faltante = getattr(arbol, 'missing_go_to_left', None)
+            partes['faltante_izquierda'].append(np.zeros(arbol.node_count, dtype=bool) if faltante is None else faltante.astype(bool))
+            partes['valor'].append(arbol.value[:, 0, 0])
+        arreglos = {
+            'caracteristica': np.concatenate(partes['caracteristica']).astype(np.int32),
+            'umbral': np.concatenate(partes['umbral']).astype(np.float64),
+            'hijos': np.concatenate(partes['hijos']).astype(np.int32),
+            'faltante_izquierda': np.concatenate(partes['faltante_izquierda']),
+            'valor': np.concatenate(partes['valor']).astype(np.float64),
+            'raices': desplazamientos[:-1].astype(np.int32),
+            'columnas': np.array(getattr(modelo, 'feature_names_in_', COLUMNAS_MODELO), dtype=str),
+        }
+        return cls(arreglos)
+
+    def guardar(self, ruta):
+        # np.savez (sin comprimir) para que cargar() pueda mapear cada arreglo directamente
+        def escribir(temporal):
+            with open(temporal, 'wb') as f:
+                np.savez(f, caracteristica=self.caracteristica, umbral=self.umbral,
+                         hijos=self.hijos.reshape(-1, 2), faltante_izquierda=self.faltante_izquierda,
+                         valor=self.valor, raices=self.raices, columnas=np.array(self.columnas, dtype=str))
+        _escribir_atomico(ruta, escribir)
+
+    @classmethod
+    def cargar(cls, ruta):
+        # np.load ignora mmap_mode para .npz: se ubica cada .npy dentro del zip y se mapea con np.memmap
+        arreglos = {}
+        with zipfile.ZipFile(ruta) as zip_npz, open(ruta, 'rb') as f:
+            for info in zip_npz.infolist():
+                if info.compress_type != zipfile.ZIP_STORED:
+                    raise ValueError(f"'{info.filename}' está comprimido y no se puede mapear.")
+                f.seek(info.header_offset + 26)
+                largo_nombre, largo_extra = struct.unpack('<HH', f.read(4))
+                f.seek(info.header_offset + 30 + largo_nombre + largo_extra)
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    forma, orden_fortran, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    forma, orden_fortran, dtype = np.lib.format.read_array_header_2_0(f)
+                arreglos[info.filename[:-len('.npy')]] = np.memmap(
+                    ruta, dtype=dtype, mode='r', shape=forma, offset=f.tell(), order='F' if orden_fortran else 'C')
+        return cls(arreglos)
+
+    def _matriz(self, X):
+        if isinstance(X, pd.DataFrame):
+            X = X[self.columnas].to_numpy(dtype=np.float64)
+        # scikit-learn compara las características en float32 contra umbrales float64
+        return np.ascontiguousarray(np.asarray(X, dtype=np.float32), dtype=np.float64)
+
+    def predict(self, X):
+        X = self._matriz(X)
+        n_filas, n_arboles = X.shape[0], len(self.raices)
+        X_plano = X.ravel()
+        faltantes = self._hay_faltantes and bool(np.isnan(X_plano).any())
+        hojas = np.empty(n_filas * n_arboles, dtype=np.int64)
+        # Un par (árbol, fila) por posición. En cada paso todos los pares activos bajan un nivel y los
+        # que llegan a una hoja salen del conjunto activo.
+        nodo = np.repeat(self.raices.astype(np.int64), n_filas)
+        posicion = np.arange(nodo.size)
+        inicio_fila = np.tile(np.arange(n_filas) * X.shape[1], n_arboles)
+        while nodo.size:
+            x = X_plano[inicio_fila + self.caracteristica[nodo]]
+            ir_derecha = ~(x <= self.umbral[nodo]) # NaN va a la derecha salvo que el nodo diga lo contrario
+            if faltantes:
+                ir_derecha &= ~(np.isnan(x) & self.faltante_izquierda[nodo])
+            siguiente = self.hijos[2 * nodo + ir_derecha]
+            es_hoja = self.hijos[2 * siguiente] == siguiente
+            hojas[posicion[es_hoja]] = siguiente[es_hoja]
+            sigue = ~es_hoja
+            nodo, posicion, inicio_fila = siguiente[sigue], posicion[sigue], inicio_fila[sigue]
+        valores = self.valor[hojas].reshape(n_arboles, n_filas)
+        # Se suman los árboles en orden, igual que RandomForestRegressor.predict, para obtener el mismo resultado
+        prediccion = np.zeros(n_filas, dtype=np.float64)
+        for arbol in range(n_arboles):
+            prediccion += valores[arbol]
+        return prediccion / n_arboles
+
+def _ruta_modelo_compilado(clave):
+    return os.path.join(SNAPSHOT_DIR, f"modelo-{clave}.npz")
+
+# Origen local opcional del modelo (ruta a un .pkl guardado con joblib). Si está definido no se
+# descarga nada.
+MODELO_LOCAL = os.environ.get('MODELO_LOCAL')
+
+def leer_modelo_local():
+    logger.info("Leyendo modelo desde el archivo local: %s", MODELO_LOCAL)
+    with open(MODELO_LOCAL, 'rb') as f:
+        return f.read()
+
+def cargar_modelo_compilado():
+    ruta_manifiesto = os.path.join(SNAPSHOT_DIR, 'modelo.json')
+    try:
+        with open(ruta_manifiesto, encoding='utf-8') as f:
+            manifiesto = json.load(f)
+    except (OSError, ValueError):
+        manifiesto = None
+
+    if MODELO_LOCAL:
+        contenido, etag = leer_modelo_local(), None
+    else:
+        cabeceras = {'If-None-Match': manifiesto['etag']} if manifiesto and manifiesto.get('etag') else {}
+        try:
+            logger.info("Intentando descargar modelo desde: %s", HF_MODEL_URL)
+            response_model = requests.get(HF_MODEL_URL, headers=cabeceras)
+            response_model.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            if manifiesto and os.path.exists(_ruta_modelo_compilado(manifiesto['clave'])):
+                logger.warning("Advertencia: No se pudo descargar el modelo (%s). Usando el modelo compilado guardado.", e)
+                return BosqueCompilado.cargar(_ruta_modelo_compilado(manifiesto['clave']))
+            raise
+
+        if response_model.status_code == 304 and manifiesto and os.path.exists(_ruta_modelo_compilado(manifiesto['clave'])):
+            logger.info("El modelo no cambió (304). Usando el modelo compilado guardado.")
+            return BosqueCompilado.cargar(_ruta_modelo_compilado(manifiesto['clave']))
+        if response_model.status_code == 304:
+            response_model = requests.get(HF_MODEL_URL)
+            response_model.raise_for_status()
+        contenido, etag = response_model.content, response_model.headers.get('ETag')
+
+    clave = hashlib.sha256(contenido).hexdigest()[:16]
+    ruta = _ruta_modelo_compilado(clave)
+    if not os.path.exists(ruta):
+        modelo = joblib.load(io.BytesIO(contenido))
+        try:
+            compilado = BosqueCompilado.desde_sklearn(modelo)
+        except ValueError as e:
+            logger.warning("Advertencia: %s Se usa el modelo de scikit-learn.", e)
+            return modelo
+        try:
+            os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+            compilado.guardar(ruta)
+        except OSError as e:
+            logger.warning("Advertencia: No se pudo guardar el modelo compilado: %s", e)
+            return compilado
+        logger.info("Modelo compilado y guardado en %s", ruta)
+
+    manifiesto = {'clave': clave, 'etag': etag}
+    def escribir(temporal):
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump(manifiesto, f)
+    try:
+        _escribir_atomico(ruta_manifiesto, escribir)
+    except OSError as e:
+        logger.warning("Advertencia: No se pudo escribir el manifiesto del modelo: %s", e)
+    return BosqueCompilado.cargar(ruta)
+
 
 # --- Carga del Modelo de Machine Learning (joblib) ---
-print("--- Iniciando descarga y carga del modelo (multi_app.py) ---")
-modelo_forest = None # Inicializar a None en caso de error
+def cargar_modelo():
+    logger.info("--- Iniciando descarga y carga del modelo (multi_app.py) ---")
+    try:
+        with medir_fase('carga_modelo'):
+            if MOTOR_FOREST == 'compilado':
+                modelo = cargar_modelo_compilado()
+                logger.info("¡Modelo cargado con éxito! Motor: %s", type(modelo).__name__)
+            elif MODELO_LOCAL:
+                modelo = joblib.load(io.BytesIO(leer_modelo_local()))
+                logger.info("¡Modelo cargado con éxito usando joblib!")
+            else:
+                logger.info("Intentando descargar modelo desde: %s", HF_MODEL_URL)
+                response_model = requests.get(HF_MODEL_URL)
+                response_model.raise_for_status() # Lanza una excepción para errores HTTP
+
+                model_bytes = io.BytesIO(response_model.content)
+                modelo = joblib.load(model_bytes) # Carga el modelo con joblib
+                logger.info("¡Modelo cargado con éxito usando joblib!")
+        return modelo
+    except requests.exceptions.RequestException as e:
+        logger.error("ERROR al descargar el modelo desde Hugging Face: %s", e)
+        registrar_error_carga('modelo', e)
+    except Exception as e:
+        logger.error("ERROR inesperado al cargar el modelo con joblib: %s", e)
+        logger.error("Asegúrate de que el archivo .pkl fue guardado correctamente con joblib y es compatible.")
+        registrar_error_carga('modelo', e)
+    return None
+
+modelo_forest = None # None hasta que termine la carga (o si falla)
+
+
+# --- Tabla de Predicciones del Simulador ---
+# El espacio de entrada del modelo es pequeño: ESPECIALIDAD_cod (especialidades_dic) x EDAD 0-120
+# x el día y la semana del año de hoy. Se predice la tabla completa del día en una sola llamada
+# vectorizada a modelo_forest.predict y el simulador responde con una búsqueda; la tabla se
+# reconstruye al cambiar de día. Edades fuera de rango o no enteras usan la predicción directa.
+EDAD_MAXIMA_TABLA = 120
+# Pronóstico del simulador: la espera estimada para cada especialidad en cada uno de los próximos
+# DIAS_PRONOSTICO días (desde hoy) para una edad, también en una sola llamada a predict sobre la
+# grilla especialidad x día. Se guardan los pronósticos de las últimas PRONOSTICOS_EN_CACHE edades.
+DIAS_PRONOSTICO = int(os.environ.get('DIAS_PRONOSTICO', '30'))
+PRONOSTICOS_EN_CACHE = 64
+
+def caracteristicas_modelo(especialidad_cod, edad, dia, semana_del_año):
+    return pd.DataFrame({
+        'ESPECIALIDAD_cod': especialidad_cod,
+        'EDAD': edad,
+        'día': dia,
+        'semana_del_año': semana_del_año,
+    }, columns=COLUMNAS_MODELO)
+
+class TablaPredicciones:
+    def __init__(self, modelo):
+        self.modelo = modelo
+        self._tabla = None # (fecha, {especialidad_cod: fila}, matriz especialidad x edad)
+        self._pronosticos = OrderedDict() # (fecha, edad) -> (fechas, {especialidad_cod: fila}, matriz especialidad x día)
+        self._lock = threading.Lock()
+
+    def _construir(self, fecha):
+        codigos = sorted(especialidades_dic)
+        cod, edad = np.meshgrid(codigos, np.arange(EDAD_MAXIMA_TABLA + 1), indexing='ij')
+        X = caracteristicas_modelo(cod.ravel(), edad.ravel(), fecha.day, fecha.isocalendar()[1])
+        inicio = time.perf_counter()
+        matriz = self.modelo.predict(X).reshape(cod.shape)
+        logger.info("Tabla de predicciones para %s calculada (%s filas) en %.3f s", fecha, X.shape[0], time.perf_counter() - inicio)
+        return fecha, {codigo: fila for fila, codigo in enumerate(codigos)}, matriz
+
+    def tabla_del_dia(self):
+        hoy = datetime.now().date()
+        tabla = self._tabla
+        if tabla is None or tabla[0] != hoy:
+            # Se calcula sin tomar el lock: pronostico() lo toma desde los hilos del pool, así que
+            # esperar al pool con el lock tomado bloquearía a ambos
+            nueva = ejecutor_calculo.ejecutar(self._construir, hoy)
+            with self._lock:
+                tabla = self._tabla
+                if tabla is None or tabla[0] != hoy: # Otro hilo pudo publicarla mientras tanto
+                    tabla = self._tabla = nueva
+        return tabla
+
+    def _construir_pronostico(self, desde, edad):
+        codigos = sorted(especialidades_dic)
+        fechas = pd.date_range(desde, periods=DIAS_PRONOSTICO, freq='D')
+        cod, dia = np.meshgrid(codigos, np.arange(len(fechas)), indexing='ij')
+        dia = dia.ravel()
+        X = caracteristicas_modelo(cod.ravel(), edad, fechas.day.to_numpy()[dia],
+                                   fechas.isocalendar().week.to_numpy(dtype=int)[dia])
+        inicio = time.perf_counter()
+        matriz = np.maximum(self.modelo.predict(X), 0.0).reshape(cod.shape)
+        logger.info("Pronóstico de %s días para edad %s calculado (%s filas) en %.3f s", len(fechas), edad, X.shape[0], time.perf_counter() - inicio)
+        return fechas, {codigo: fila for fila, codigo in enumerate(codigos)}, matriz
+
+    def pronostico(self, edad):
+        clave = (datetime.now().date(), edad)
+        with self._lock:
+            pronostico = self._pronosticos.get(clave)
+            if pronostico is not None:
+                self._pronosticos.move_to_end(clave)
+                return pronostico
+        pronostico = ejecutor_calculo.ejecutar(self._construir_pronostico, clave[0], edad)
+        with self._lock:
+            self._pronosticos[clave] = pronostico
+            while len(self._pronosticos) > PRONOSTICOS_EN_CACHE:
+                self._pronosticos.popitem(last=False)
+        return pronostico
+
+    def predecir(self, especialidad_cod, edad):
+        fecha, filas, matriz = self.tabla_del_dia()
+        fila = filas.get(especialidad_cod)
+        if fila is not None and float(edad).is_integer() and 0 <= edad <= EDAD_MAXIMA_TABLA:
+            return float(matriz[fila, int(edad)])
+        X = caracteristicas_modelo([especialidad_cod], [edad], fecha.day, fecha.isocalendar()[1])
+        return float(ejecutor_calculo.ejecutar(self.modelo.predict, X)[0])
+
+tabla_predicciones = None
+
+
+# --- Carga en Segundo Plano ---
+# Los datos y el modelo se descargan en paralelo. Con CARGA_EN_SEGUNDO_PLANO=1 (por defecto) la
+# carga corre en un hilo y el servidor atiende mientras tanto (las páginas muestran un aviso de
+# carga); con 0 se carga al importar el módulo, que es lo que se quiere con el preload de Gunicorn
+# para que los workers hereden los datos ya cargados.
+CARGA_EN_SEGUNDO_PLANO = os.environ.get('CARGA_EN_SEGUNDO_PLANO', '1') != '0'
+
+def cargar_todo():
+    global estado_datos, modelo_forest, tabla_predicciones
+    logger.info("--- Iniciando carga y preprocesamiento de datos y modelo (multi_app.py) ---")
+    with _lock_carga:
+        estado_carga['fase'] = 'cargando'
+    try:
+        with medir_fase('total'):
+            with ThreadPoolExecutor(max_workers=2, thread_name_prefix='carga') as ejecutor:
+                futuro_datos = ejecutor.submit(cargar_estado_datos)
+                futuro_modelo = ejecutor.submit(cargar_modelo)
+                nuevo_estado = futuro_datos.result()
+                modelo = futuro_modelo.result()
+
+            tabla = None
+            if modelo is not None:
+                tabla = TablaPredicciones(modelo)
+                try:
+                    with medir_fase('tabla_predicciones'):
+                        tabla.tabla_del_dia() # Precalcular antes del fork de los workers
+                except Exception as e:
+                    logger.warning("Advertencia: No se pudo precalcular la tabla de predicciones: %s", e)
+
+            estado_datos = nuevo_estado
+            tabla_predicciones = tabla # Antes que el modelo: predecir usa la tabla si hay modelo
+            modelo_forest = modelo
+        with _lock_carga:
+            estado_carga['fase'] = 'lista'
+    except Exception as e:
+        logger.exception("ERROR FATAL durante la carga: %s", e)
+        registrar_error_carga('carga', e)
+        with _lock_carga:
+            estado_carga['fase'] = 'error'
+    finally:
+        _carga_lista.set()
+        logger.info("--- Carga finalizada (%s): %s ---", estado_carga['fase'], estado_carga['tiempos'])
+
+def iniciar_carga(en_segundo_plano=CARGA_EN_SEGUNDO_PLANO):
+    if en_segundo_plano:
+        threading.Thread(target=cargar_todo, name='carga-datos', daemon=True).start()
+    else:
+        cargar_todo()
+
+
+# --- Refresco de los Datos sin Reiniciar ---
+# La fuente es un CSV al que se agregan citas nuevas. El refresco vuelve a pedir la fuente (con
+# las cabeceras condicionales del manifiesto), lee por bloques conservando solo las filas desde la
+# marca de agua (el DIA_SOLICITACITA más reciente ya cargado) y suma sus agregados a los vigentes.
+# Del día de la marca solo son nuevas las filas que exceden las que ya había. Si las filas
+# anteriores a la marca no coinciden en cantidad (la fuente se reescribió), se reconstruye todo.
+# Si la fuente creció agregando bytes al final (los primeros bytes coinciden con el CSV cargado),
+# solo se lee esa cola y el costo es proporcional a las filas nuevas.
+# El nuevo EstadoDatos reemplaza al anterior con una sola asignación: los callbacks en curso
+# siguen con la referencia que ya tomaron.
+REFRESCO_SEGUNDOS = int(os.environ.get('REFRESCO_SEGUNDOS', '0')) # 0 = sin refresco periódico
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN') # Habilita POST /admin/refrescar
+
+estado_refresco = {'ultimo': None, 'resultado': None, 'filas_nuevas': 0, 'error': None}
+_lock_refresco = threading.Lock()
+
+def _estado_completo(archivo, clave, anteriores):
+    df, _ = leer_csv(archivo)
+    citas_por_mes = calcular_citas_por_mes(df)
+    particiones = guardar_snapshot(clave, df, citas_por_mes, anteriores)
+    return EstadoDatos(TablaCompacta.desde_df(df), citas_por_mes, clave, particiones=particiones)
+
+# Filas escritas después de los primeros bytes_previos bytes, si esos bytes son exactamente el CSV
+# de la versión cargada; None si no se puede asegurar.
+def _leer_cola(archivo, bytes_previos, version):
+    if not bytes_previos or os.fstat(archivo.fileno()).st_size <= bytes_previos:
+        return None
+    archivo.seek(0)
+    restantes = bytes_previos
+    sha = hashlib.sha256()
+    while restantes:
+        bloque = archivo.read(min(TAMANO_BLOQUE_DESCARGA, restantes))
+        sha.update(bloque)
+        restantes -= len(bloque)
+    if clave_datos(sha.hexdigest()) != version or not bloque.endswith(b'\n'):
+        return None
+    archivo.seek(0)
+    nombres = pd.read_csv(archivo, nrows=0).columns.tolist()
+    archivo.seek(bytes_previos)
+    nuevas, _ = leer_csv(archivo, nombres=nombres)
+    return nuevas
+
+# Filas nuevas según la marca de agua de DIA_SOLICITACITA (lee todo el CSV, pero solo conserva
+# las filas desde la marca); None si la fuente no es la anterior más filas agregadas. La marca cae
+# en el último mes, que siempre es residente: las filas de los meses fríos son todas anteriores.
+def _filas_desde_marca(estado, archivo):
+    dia = estado.tabla.dia
+    marca = pd.Timestamp(np.datetime64(int(dia.max()), 'D'))
+    archivo.seek(0)
+    leidas, _ = leer_csv(archivo, filtro=lambda bloque: bloque['DIA_SOLICITACITA'] >= marca)
+    anteriores = int((dia < dia.max()).sum()) + estado.filas - estado.tabla.filas
+    en_marca = int((dia == dia.max()).sum())
+    dia_fuente = leidas['DIA_SOLICITACITA'].dt.normalize()
+    en_marca_fuente = dia_fuente == marca
+    if leidas.attrs['filas_descartadas'] != anteriores or en_marca_fuente.sum() < en_marca:
+        return None
+    return leidas[(dia_fuente > marca) | (en_marca_fuente & (en_marca_fuente.cumsum() > en_marca))]
+
+# Solo se reescriben las particiones de los meses que reciben filas nuevas (todos si no había
+# particiones): sus filas residentes vuelven a DataFrame, los meses fríos (la cola del CSV puede
+# traer fechas viejas) se leen completos y se les suman las filas nuevas. La tabla nueva es la de
+# los demás meses residentes unida a la de esos meses.
+def _estado_incremental(estado, archivo, clave, bytes_previos):
+    nuevas = _leer_cola(archivo, bytes_previos, estado.version)
+    if nuevas is None:
+        nuevas = _filas_desde_marca(estado, archivo)
+    if nuevas is None:
+        return None # No es un agregado al final del CSV
+    nuevas = nuevas.reset_index(drop=True)
+    tabla, anteriores = estado.tabla, estado.particiones
+    if anteriores is None:
+        tocadas = np.ones(tabla.filas, dtype=bool)
+        frias = []
+    else:
+        meses_nuevos = set(nuevas['MES'].astype(str))
+        tocadas = tabla.mascara('MES', meses_nuevos) if 'MES' in tabla.codigos else np.zeros(tabla.filas, dtype=bool)
+        try:
+            frias = [anteriores.leer(mes) for mes in anteriores.frias() if mes in meses_nuevos]
+        except FileNotFoundError:
+            return None # Otro worker ya borró particiones de la versión cargada: carga completa
+    partes = [parte for parte in [tabla.tomar(tocadas).a_dataframe(), *frias, nuevas] if not parte.empty]
+    df_tocado = unir_preprocesados(partes) if partes else nuevas # Sin partes no se reescribe ningún mes
+    if nuevas.empty:
+        citas_por_mes, agregados, rollups = estado.citas_por_mes, estado.agregados, estado.rollups
+    else:
+        citas_por_mes = combinar_citas_por_mes(estado.citas_por_mes, nuevas)
+    particiones = guardar_snapshot(clave, df_tocado, citas_por_mes, anteriores)
+    if particiones is None and anteriores is not None:
+        return None # Sin las particiones nuevas los meses fríos no se pueden leer: carga completa
+    tabla_nueva = TablaCompacta.unir([tabla.tomar(~tocadas), TablaCompacta.desde_df(df_tocado)]) if partes else tabla
+    if not nuevas.empty:
+        tabla_nuevas = TablaCompacta.desde_df(nuevas)
+        agregados = combinar_agregados(estado.agregados, tabla_nuevas, tabla_nueva)
+        rollups = estado.rollups.combinar(RollupsTiempo.desde_datos(tabla_nuevas))
+    return EstadoDatos(tabla_nueva, citas_por_mes, clave, agregados, rollups, particiones)
+
+# Devuelve 'sin_cambios', 'incremental' o 'completo'
+def refrescar_datos():
+    global estado_datos
+    with _lock_refresco, medir_fase('refresco'):
+        estado = estado_datos
+        manifiesto = leer_manifiesto()
+        # Las cabeceras condicionales solo sirven si el manifiesto corresponde a los datos en memoria
+        # (otro worker puede haberlo actualizado antes)
+        vigente = manifiesto if manifiesto and manifiesto['clave'] == estado.version else None
+        cabeceras = cabeceras_condicionales(vigente)
+        bytes_previos = vigente.get('bytes_fuente') if vigente else None
+        try:
+            archivo, digest, cabeceras_fuente = abrir_fuente(cabeceras, fase='refresco_descarga')
+            if archivo is None:
+                resultado, nuevo = 'sin_cambios', estado
+                escribir_manifiesto(estado.version, cabeceras_fuente, bytes_previos)
+            else:
+                with archivo:
+                    clave = clave_datos(digest)
+                    bytes_fuente = os.fstat(archivo.fileno()).st_size
+                    if clave == estado.version:
+                        resultado, nuevo = 'sin_cambios', estado
+                        if vigente:
+                            escribir_manifiesto(clave, cabeceras_fuente, bytes_fuente)
+                    else:
+                        nuevo = None
+                        if estado.version is not None and estado.tabla.filas > 0:
+                            nuevo = _estado_incremental(estado, archivo, clave, bytes_previos)
+                        resultado = 'incremental'
+                        if nuevo is None:
+                            archivo.seek(0)
+                            nuevo = _estado_completo(archivo, clave, estado.particiones)
+                            resultado = 'completo'
+                    if nuevo is not estado and nuevo.particiones is not None:
+                        escribir_manifiesto(clave, cabeceras_fuente, bytes_fuente)
+        except Exception as e:
+            logger.exception("ERROR al refrescar los datos: %s", e)
+            estado_refresco.update(ultimo=time.time(), resultado='error', error=str(e))
+            raise
+        filas_nuevas = nuevo.filas - estado.filas
+        estado_datos = nuevo
+        estado_refresco.update(ultimo=time.time(), resultado=resultado, filas_nuevas=filas_nuevas, error=None)
+    logger.info("Refresco de datos: %s (%+d filas, versión %s)", resultado, filas_nuevas, nuevo.version)
+    return resultado
+
+def _bucle_refresco():
+    while True:
+        time.sleep(REFRESCO_SEGUNDOS)
+        if not carga_lista():
+            continue
+        try:
+            refrescar_datos()
+        except Exception:
+            pass # Ya registrado; se reintenta en el siguiente ciclo
+
+# El hilo se arranca en la primera petición de cada proceso: con el preload de Gunicorn el maestro
+# no atiende peticiones y los hilos no sobreviven al fork, así que cada worker arranca el suyo.
+_pid_refresco = None
+
+def asegurar_refresco_periodico():
+    global _pid_refresco
+    if REFRESCO_SEGUNDOS <= 0 or _pid_refresco == os.getpid():
+        return
+    with _lock_carga:
+        if _pid_refresco == os.getpid():
+            return
+        _pid_refresco = os.getpid()
+    threading.Thread(target=_bucle_refresco, name='refresco-datos', daemon=True).start()
+
+
+# --- Caché LRU de Figuras Compartida por las Apps ---
+# Los callbacks de detalle son funciones puras de (callback, valor seleccionado) sobre datos
+# estáticos, así que se guarda el JSON de la figura resultante. La caché está limitada por bytes
+# (se descartan primero las entradas menos usadas) y se vacía sola cuando cambia la versión de
+# los datos. También guarda las figuras iniciales de los layouts (selección None) y las respuestas
+# de /api/cruzado.
+CACHE_FIGURAS_MAX_MB = float(os.environ.get('CACHE_FIGURAS_MAX_MB', '32'))
+
+class CacheFiguras:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict() # (callback, selección) -> JSON de la figura
+        self._bytes = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self.aciertos = {}
+        self.fallos = {}
+        self.descartes = 0
+
+    def invalidar(self, version=None):
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+            self._version = version
+
+    def obtener(self, clave, version):
+        with self._lock:
+            if version != self._version: # Los datos se recargaron: lo guardado ya no vale
+                self._entradas.clear()
+                self._bytes = 0
+                self._version = version
+            figura_json = self._entradas.get(clave)
+            contador = self.aciertos if figura_json is not None else self.fallos
+            contador[clave[0]] = contador.get(clave[0], 0) + 1
+            if figura_json is not None:
+                self._entradas.move_to_end(clave)
+            return figura_json
+
+    def guardar(self, clave, version, figura_json):
+        tamaño = len(figura_json)
+        if tamaño > self.max_bytes:
+            return
+        with self._lock:
+            if version != self._version:
+                return # Se calculó con datos que ya fueron reemplazados
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None:
+                self._bytes -= len(anterior)
+            self._entradas[clave] = figura_json
+            self._bytes += tamaño
+            while self._bytes > self.max_bytes:
+                _, descartada = self._entradas.popitem(last=False)
+                self._bytes -= len(descartada)
+                self.descartes += 1
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                'entradas': len(self._entradas),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'version_datos': self._version,
+                'aciertos': sum(self.aciertos.values()),
+                'fallos': sum(self.fallos.values()),
+                'descartes': self.descartes,
+                'por_callback': {
+                    nombre: {'aciertos': self.aciertos.get(nombre, 0), 'fallos': self.fallos.get(nombre, 0)}
+                    for nombre in sorted(set(self.aciertos) | set(self.fallos))
+                },
+            }
 
-try:
-    print(f"Intentando descargar modelo desde: {HF_MODEL_URL}")
-    response_model = requests.get(HF_MODEL_URL)
-    response_model.raise_for_status() # Lanza una excepción para errores HTTP
+cache_figuras = CacheFiguras(int(CACHE_FIGURAS_MAX_MB * 1024 * 1024))
 
-    model_bytes = io.BytesIO(response_model.content)
-    modelo_forest = joblib.load(model_bytes) # Carga el modelo con joblib
-    print("¡Modelo cargado con éxito usando joblib!")
+# Valor seleccionado en un clic, usado como clave de la caché
+def seleccion_x(clickData):
+    return None if clickData is None else str(clickData['points'][0]['x'])
 
-except requests.exceptions.RequestException as e:
-    print(f"ERROR al descargar el modelo desde Hugging Face: {e}")
-except Exception as e:
-    print(f"ERROR inesperado al cargar el modelo con joblib: {e}")
-    print("Asegúrate de que el archivo .pkl fue guardado correctamente con joblib y es compatible.")
+def seleccion_label(clickData):
+    return None if clickData is None else str(clickData['points'][0]['label'])
 
-print("-" * 40)
+def sin_seleccion():
+    return None
+
+# Decorador para funciones que devuelven figuras: la clave es (nombre de la función, selección)
+def cachear_figura(seleccion):
+    def decorador(callback):
+        @functools.wraps(callback)
+        def envoltura(*args):
+            clave = (callback.__name__, seleccion(*args))
+            version = estado_datos.version
+            figura_json = cache_figuras.obtener(clave, version)
+            if figura_json is None:
+                figura_json = ejecutor_calculo.ejecutar(lambda: to_json_plotly(callback(*args))) # Figura o tupla de figuras
+                cache_figuras.guardar(clave, version, figura_json)
+            return json.loads(figura_json)
+        return envoltura
+    return decorador
 
 
 # --- Configuración del Servidor Flask Compartido ---
+# Los archivos de static/ (junto a multi_app.py, como el logo.png) los sirve la ruta /static/ que
+# Flask registra por defecto
 server = Flask(__name__)
 
-# Ruta para servir archivos estáticos (como el logo.png)
-@server.route('/static/<path:filename>')
-def static_files(filename):
-    # Asume que 'static' está en la misma raíz que 'multi_app.py'
-    return send_from_directory(os.path.join(server.root_path, 'static'), filename)
+@server.before_request
+def iniciar_medicion():
+    g.inicio_peticion = time.perf_counter()
+
+@server.before_request
+def arrancar_refresco():
+    asegurar_refresco_periodico()
+
+@server.after_request
+def registrar_medicion(response):
+    inicio = g.pop('inicio_peticion', None)
+    if inicio is not None:
+        ruta = request.url_rule.rule if request.url_rule is not None else 'sin_ruta'
+        cantidad_bytes = None if response.is_streamed else response.calculate_content_length()
+        metricas.observar_ruta(ruta, request.method, response.status_code, time.perf_counter() - inicio, cantidad_bytes)
+        callback = g.pop('callback_actual', None)
+        if callback is not None and cantidad_bytes is not None:
+            metricas.observar_bytes_callback(callback, cantidad_bytes)
+    return response
+
+# --- Compresión y Caché HTTP ---
+# Las respuestas HTML, JSON, JS, CSS y de texto se comprimen con brotli o gzip según el
+# Accept-Encoding del navegador (flask-compress; se registra después de registrar_medicion para que
+# las métricas cuenten los bytes comprimidos). El _dash-layout de la app Dash (el contenedor de
+# páginas) depende solo de la versión de los datos y del código: lleva un ETag débil con ambas y
+# Cache-Control: no-cache, así que el navegador revalida y, si nada cambió, recibe un 304. El
+# contenido de cada página llega por el callback de enrutamiento (un POST, que no se cachea; sus
+# figuras salen de cache_figuras). Los archivos de /static/ llevan ETag y Last-Modified y se usan sin
+# revalidar durante STATIC_MAX_AGE segundos. Las demás respuestas GET JSON y la página principal llevan un ETag
+# del contenido; el HTML de las páginas Dash no, porque incluye un token distinto en cada petición.
+STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', '86400'))
+with open(os.path.abspath(__file__), 'rb') as _fuente:
+    VERSION_CODIGO = hashlib.sha256(_fuente.read()).hexdigest()[:12]
+
+server.config.update(
+    SEND_FILE_MAX_AGE_DEFAULT=STATIC_MAX_AGE,
+    COMPRESS_ALGORITHM=['br', 'gzip'],
+    COMPRESS_MIMETYPES=['text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript',
+                        'application/json'],
+    COMPRESS_MIN_SIZE=500,
+)
+Compress(server)
+
+def etag_layout():
+    if request.method != 'GET' or not request.path.endswith('/_dash-layout') or not carga_lista():
+        return None
+    version = estado_datos.version
+    if version is None:
+        return None
+    return f"{version}-{VERSION_CODIGO}-{int(DRILLDOWN_EN_NAVEGADOR)}"
+
+@server.before_request
+def layout_sin_cambios():
+    etag = etag_layout()
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        respuesta = Response(status=304)
+        respuesta.set_etag(etag, weak=True)
+        respuesta.cache_control.no_cache = True
+        return respuesta
+
+@server.after_request
+def cabeceras_de_cache(response):
+    if request.method != 'GET' or response.status_code != 200 or response.is_streamed:
+        return response
+    etag = etag_layout()
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+        response.cache_control.no_cache = True
+    elif (response.mimetype == 'application/json' or request.endpoint == 'index') and 'ETag' not in response.headers:
+        response.add_etag()
+        response.cache_control.no_cache = True
+        response.make_conditional(request)
+    return response
+
+# Contadores de la caché de figuras (aciertos/fallos por callback)
+@server.route('/cache/figuras')
+def estadisticas_cache_figuras():
+    return jsonify(cache_figuras.estadisticas())
+
+# --- API de Predicción por Lotes ---
+# POST /api/predicciones con una lista JSON de {"especialidad", "edad", "fecha"} (o {"registros": [...]}).
+# 'especialidad' acepta el código de especialidades_dic o el nombre; 'fecha' es opcional (hoy por
+# defecto, formato ISO 'YYYY-MM-DD'). Se arma la matriz de características de todo el lote de forma vectorizada, se llama una
+# sola vez a modelo_forest.predict y se devuelve un NDJSON (una línea por registro, en orden).
+MAX_REGISTROS_LOTE = int(os.environ.get('MAX_REGISTROS_LOTE', '20000'))
+MAX_BYTES_LOTE = int(os.environ.get('MAX_BYTES_LOTE', str(4 * 1024 * 1024)))
+# Werkzeug corta al leerlo cualquier cuerpo más grande, también el que llega sin Content-Length
+# (Transfer-Encoding: chunked); los cuerpos de los callbacks de Dash son mucho más chicos
+server.config['MAX_CONTENT_LENGTH'] = MAX_BYTES_LOTE
+FILAS_POR_BLOQUE_RESPUESTA = 1000
+CODIGOS_POR_NOMBRE = {nombre.strip().upper(): codigo for codigo, nombre in especialidades_dic.items()}
+
+def preparar_lote(registros):
+    lote = pd.DataFrame.from_records(registros, columns=['especialidad', 'edad', 'fecha'])
+    codigo = pd.to_numeric(lote['especialidad'], errors='coerce')
+    codigo = codigo.where(codigo.isin(list(especialidades_dic)))
+    por_nombre = lote['especialidad'].astype(str).str.strip().str.upper().map(CODIGOS_POR_NOMBRE)
+    codigo = codigo.fillna(por_nombre)
+    edad = pd.to_numeric(lote['edad'], errors='coerce')
+    edad = edad.where(edad >= 0)
+    fecha = pd.to_datetime(lote['fecha'].fillna(datetime.now().strftime('%Y-%m-%d')), format='ISO8601', errors='coerce')
+
+    errores = pd.Series(None, index=lote.index, dtype=object)
+    errores[fecha.isna()] = 'fecha inválida'
+    errores[edad.isna()] = 'edad inválida'
+    errores[codigo.isna()] = 'especialidad desconocida'
+    validos = errores.isna().to_numpy()
+
+    X = caracteristicas_modelo(
+        codigo[validos].astype(int).to_numpy(),
+        edad[validos].to_numpy(),
+        fecha[validos].dt.day.to_numpy(),
+        fecha[validos].dt.isocalendar().week.astype(int).to_numpy(),
+    )
+    return X, validos, codigo, errores
+
+@server.route('/api/predicciones', methods=['POST'])
+def api_predicciones():
+    if modelo_forest is None:
+        return jsonify({'error': 'El modelo de predicción no está disponible.'}), 503
+    try:
+        # Con MAX_CONTENT_LENGTH Werkzeug falla antes de leer si Content-Length lo supera; sin
+        # Content-Length (chunked) lee hasta el máximo y la lectura siguiente avisa si sobraba
+        request.get_data(cache=True)
+        request.stream.read(1)
+    except RequestEntityTooLarge:
+        return jsonify({'error': f'El cuerpo supera el máximo de {MAX_BYTES_LOTE} bytes.'}), 413
+
+    cuerpo = request.get_json(silent=True)
+    registros = cuerpo.get('registros') if isinstance(cuerpo, dict) else cuerpo
+    if not isinstance(registros, list) or not all(isinstance(r, dict) for r in registros):
+        return jsonify({'error': 'Se espera una lista JSON de registros {especialidad, edad, fecha}.'}), 400
+    if len(registros) > MAX_REGISTROS_LOTE:
+        return jsonify({'error': f'Máximo {MAX_REGISTROS_LOTE} registros por solicitud.'}), 413
+
+    X, validos, codigo, errores = preparar_lote(registros)
+    predicciones = np.full(len(registros), np.nan)
+    if len(X):
+        predicciones[validos] = np.maximum(ejecutor_calculo.ejecutar(modelo_forest.predict, X), 0.0)
+
+    def generar():
+        for inicio in range(0, len(registros), FILAS_POR_BLOQUE_RESPUESTA):
+            lineas = []
+            for i in range(inicio, min(inicio + FILAS_POR_BLOQUE_RESPUESTA, len(registros))):
+                if validos[i]:
+                    cod = int(codigo.iat[i])
+                    resultado = {'indice': i, 'especialidad_cod': cod, 'especialidad': especialidades_dic[cod],
+                                 'dias_estimados': round(float(predicciones[i]), 4)}
+                else:
+                    resultado = {'indice': i, 'error': errores.iat[i]}
+                lineas.append(json.dumps(resultado, ensure_ascii=False))
+            yield '\n'.join(lineas) + '\n'
+
+    return Response(stream_with_context(generar()), mimetype='application/x-ndjson')
+
+# --- API de Filtros Cruzados ---
+# POST /api/cruzado con {"filtros": {"MES": ["2024-01"], "SEGURO": ["SI"], ...}, "desglose": "ESPECIALIDAD"}.
+# Dentro de una columna los valores se combinan con OR y entre columnas con AND (ver IndiceBitmaps);
+# con filtro de MES solo se leen del disco los meses fríos elegidos (ver IndiceParticionado).
+# Devuelve la cantidad de citas, las estadísticas de días de espera y, si se pide, el conteo por
+# categoría de la columna de desglose. El cálculo corre en el pool de cálculo (503 si está saturado)
+# y la respuesta queda en la caché de figuras, con clave (filtros normalizados, desglose).
+@server.route('/api/cruzado', methods=['POST'])
+def api_cruzado():
+    cuerpo = request.get_json(silent=True)
+    if not isinstance(cuerpo, dict) or not isinstance(cuerpo.get('filtros', {}), dict):
+        return jsonify({'error': 'Se espera un objeto JSON {"filtros": {columna: [valores]}, "desglose": columna}.'}), 400
+    filtros = cuerpo.get('filtros', {})
+    desglose = cuerpo.get('desglose')
+    estado = estado_datos
+    indice = estado.indice
+    desconocidas = [columna for columna in [*filtros, *([desglose] if desglose else [])] if columna not in indice.columnas]
+    if desconocidas:
+        return jsonify({'error': f'Columnas no indexadas: {desconocidas}. Disponibles: {indice.columnas}.'}), 400
+    if not all(isinstance(valores, list) for valores in filtros.values()):
+        return jsonify({'error': 'Los valores de cada filtro deben ser una lista.'}), 400
+
+    # El orden de columnas y valores no cambia el resultado, y una columna sin valores no filtra
+    filtros = {columna: sorted({str(valor) for valor in valores}) for columna, valores in sorted(filtros.items()) if valores}
+    clave = ('api_cruzado', json.dumps(filtros, ensure_ascii=False), desglose or None)
+    respuesta_json = cache_figuras.obtener(clave, estado.version)
+    if respuesta_json is None:
+        def calcular():
+            resumen = indice.resumen(filtros, desgloses=[desglose] if desglose else [])
+            respuesta = {'filas': int(resumen['filas']), 'espera': resumen['espera']}
+            if desglose:
+                respuesta['desglose'] = {categoria: int(cuenta) for categoria, cuenta in resumen['desglose'][desglose].items()}
+            return json.dumps(respuesta, ensure_ascii=False)
+        respuesta_json = ejecutor_calculo.ejecutar(calcular)
+        cache_figuras.guardar(clave, estado.version, respuesta_json)
+    return Response(respuesta_json, mimetype='application/json')
+
+# Cálculo rechazado porque el pool está saturado: el cliente puede reintentar
+@server.errorhandler(Sobrecarga)
+def sobrecarga(error):
+    return jsonify({'error': 'El servidor está ocupado; reintente en unos segundos.', 'detalle': str(error)}), 503, {'Retry-After': '1'}
+
+# Salud y disponibilidad: /healthz responde siempre que el proceso esté vivo; /readyz responde 503
+# hasta que terminó la carga de datos y modelo. Ambas incluyen la fase y los tiempos de carga.
+def informe_carga():
+    with _lock_carga:
+        informe = {
+            'fase': estado_carga['fase'],
+            'en_curso': list(estado_carga['en_curso']),
+            'tiempos': dict(estado_carga['tiempos']),
+            'errores': dict(estado_carga['errores']),
+            'memoria': dict(estado_carga['memoria']),
+        }
+    datos = estado_datos
+    informe['refresco'] = dict(estado_refresco)
+    informe.update({'version_datos': datos.version, 'filas': datos.filas, 'modelo_cargado': modelo_forest is not None})
+    return informe
+
+@server.route('/healthz')
+def healthz():
+    return jsonify(informe_carga())
+
+@server.route('/readyz')
+def readyz():
+    return jsonify(informe_carga()), 200 if carga_lista() else 503
+
+# Refresco manual de los datos (ver refrescar_datos). Requiere ADMIN_TOKEN en la cabecera
+# Authorization: Bearer <token>. Con varios workers solo se refresca el que atiende la petición;
+# los demás se actualizan en su próximo refresco periódico o al reiniciar.
+@server.route('/admin/refrescar', methods=['POST'])
+def admin_refrescar():
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Refresco manual deshabilitado (ADMIN_TOKEN no definido).'}), 404
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return jsonify({'error': 'No autorizado.'}), 403
+    if not carga_lista():
+        return jsonify({'error': 'La carga inicial todavía no terminó.'}), 503
+    try:
+        resultado = refrescar_datos()
+    except Exception as e:
+        return jsonify({'error': f'No se pudo refrescar: {e}'}), 502
+    return jsonify({'resultado': resultado, **informe_carga()['refresco'], 'version_datos': estado_datos.version, 'filas': estado_datos.filas})
+
+# Métricas en formato de texto de Prometheus: callbacks, rutas, fases de la carga y caché de figuras
+@server.route('/metrics')
+def metrics():
+    lineas = metricas.exportar()
+    informe = informe_carga()
+    lineas += ['# HELP carga_fase_segundos Duración de cada fase de la carga de datos y modelo.',
+               '# TYPE carga_fase_segundos gauge']
+    lineas += [f'carga_fase_segundos{{{_etiquetas(fase=fase)}}} {segundos}' for fase, segundos in sorted(informe['tiempos'].items())]
+    lineas += ['# HELP carga_lista 1 cuando los datos y el modelo terminaron de cargarse.',
+               '# TYPE carga_lista gauge',
+               f'carga_lista {int(carga_lista())}',
+               '# HELP carga_errores Fases de la carga que terminaron con error.',
+               '# TYPE carga_errores gauge',
+               f"carga_errores {len(informe['errores'])}",
+               '# HELP datos_filas Filas del DataFrame cargado.',
+               '# TYPE datos_filas gauge',
+               f"datos_filas {informe['filas']}",
+               '# HELP datos_memoria_mb Memoria del DataFrame: pico estimado de la lectura, tamaño final y tamaño de los meses residentes.',
+               '# TYPE datos_memoria_mb gauge']
+    lineas += [f'datos_memoria_mb{{{_etiquetas(medida=medida)}}} {valor}' for medida, valor in sorted(informe['memoria'].items())]
+    cache = cache_figuras.estadisticas()
+    indice = estado_datos.indice
+    lineas += ['# HELP cache_figuras_aciertos_total Figuras servidas desde la caché.',
+               '# TYPE cache_figuras_aciertos_total counter',
+               f"cache_figuras_aciertos_total {cache['aciertos']}",
+               '# HELP cache_figuras_fallos_total Figuras que hubo que calcular.',
+               '# TYPE cache_figuras_fallos_total counter',
+               f"cache_figuras_fallos_total {cache['fallos']}",
+               '# HELP cache_figuras_bytes Bytes ocupados por la caché de figuras.',
+               '# TYPE cache_figuras_bytes gauge',
+               f"cache_figuras_bytes {cache['bytes']}",
+               '# HELP particiones_meses Meses de datos residentes en memoria y fríos (en disco).',
+               '# TYPE particiones_meses gauge',
+               f"particiones_meses{{{_etiquetas(estado='residente')}}} {len(indice.particiones.residentes()) if indice.particiones else 0}",
+               f"particiones_meses{{{_etiquetas(estado='frio')}}} {len(indice.frias)}",
+               '# HELP particiones_en_cache Meses fríos con su índice en la caché de este proceso.',
+               '# TYPE particiones_en_cache gauge',
+               f'particiones_en_cache {indice.en_cache()}',
+               '# HELP particiones_lecturas_total Particiones de meses fríos leídas del disco por este proceso.',
+               '# TYPE particiones_lecturas_total counter',
+               f'particiones_lecturas_total {indice.lecturas}',
+               '# HELP ejecutor_hilos Hilos del pool de cálculos pesados de este proceso.',
+               '# TYPE ejecutor_hilos gauge',
+               f'ejecutor_hilos {ejecutor_calculo.hilos}',
+               '# HELP ejecutor_en_curso Cálculos pesados corriendo o esperando un hilo.',
+               '# TYPE ejecutor_en_curso gauge',
+               f'ejecutor_en_curso {ejecutor_calculo.en_curso}',
+               '# HELP ejecutor_rechazos_total Peticiones rechazadas con 503 porque la cola del pool estaba llena.',
+               '# TYPE ejecutor_rechazos_total counter',
+               f'ejecutor_rechazos_total {ejecutor_calculo.rechazos}']
+    return Response('\n'.join(lineas) + '\n', mimetype='text/plain; version=0.0.4')
 
 # Ruta raíz con enlaces a todas las aplicaciones Dash
 @server.route('/')
@@ -191,6 +2621,7 @@ def index():
     <head>
         <title>Bienvenido</title>
         <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        {% if not lista %}<meta http-equiv="refresh" content="3">{% endif %}
         <style>
             body {
                 font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
@@ -245,6 +2676,7 @@ def index():
         <div class="container">
             <img src="/static/logo.png" alt="Logo de la Institución" class="logo">
             <h2>Bienvenido</h2>
+            {% if not lista %}<p><b>Cargando datos y modelo...</b> La página se actualizará automáticamente.</p>{% endif %}
             <p>Explora las siguientes visualizaciones:</p>
             <div class="links">
                 <a href="/edad/">Distribución por Edad</a>
@@ -253,59 +2685,190 @@ def index():
                 <a href="/asegurados/">Estado del Seguro</a>
                 <a href="/tiempo/">Línea de Tiempo</a>
                 <a href="/simulador/">Simulador de Citas</a>
+                <a href="/cruzado/">Filtros Cruzados</a>
             </div>
         </div>
     </body>
     </html>
-    """)
+    """, lista=carga_lista())
+
+# --- Pantalla de Carga Compartida por las Apps ---
+# Los layouts son funciones: mientras la carga no termina devuelven este aviso, que consulta
+# /readyz cada 2 segundos desde el navegador y recarga la página cuando los datos están listos.
+def pantalla_de_carga(titulo):
+    return html.Div([
+        html.H1(titulo, style={'color': '#2c3e50'}),
+        html.P("Cargando datos y modelo, la página se actualizará automáticamente...", style={'fontSize': '18px', 'color': '#555'}),
+        dcc.Interval(id='intervalo-carga', interval=2000),
+        html.Div(id='recarga-pagina', style={'display': 'none'}),
+    ], style={'textAlign': 'center', 'fontFamily': 'Arial, sans-serif', 'backgroundColor': '#f4f6f8', 'padding': '20px', 'minHeight': '100vh'})
+
+def registrar_recarga_al_estar_listo(app):
+    app.clientside_callback(
+        """
+        function(n_intervals) {
+            fetch('/readyz').then(function(r) { if (r.ok) { window.location.reload(); } });
+            return window.dash_clientside.no_update;
+        }
+        """,
+        Output('recarga-pagina', 'children'),
+        Input('intervalo-carga', 'n_intervals')
+    )
+
+# --- Drill-down en el Navegador (opcional) ---
+# Con DRILLDOWN_EN_NAVEGADOR=1 las figuras de detalle de cada selección posible se calculan en el
+# servidor una vez por versión de los datos (con los mismos callbacks y la misma caché), viajan en
+# un dcc.Store junto con el layout y un callback clientside elige la que corresponde al clic: los
+# clics ya no generan peticiones al servidor. La plantilla de Plotly, que es lo más pesado de cada
+# figura, se envía una sola vez. Los datos del Store son los de la versión vigente al cargar la
+# página. Por defecto (0) cada clic se resuelve con el callback del servidor.
+DRILLDOWN_EN_NAVEGADOR = os.environ.get('DRILLDOWN_EN_NAVEGADOR', '0') == '1'
+
+def _figura_sin_plantilla(figura, plantilla):
+    if figura.get('layout', {}).get('template') != plantilla:
+        return figura
+    return {**figura, 'layout': {clave: valor for clave, valor in figura['layout'].items() if clave != 'template'}}
+
+def datos_drilldown(callback, campo, agregado, recorte=None):
+    clave = ('drilldown', callback.__name__)
+    version = estado_datos.version
+    datos_json = cache_figuras.obtener(clave, version)
+    if datos_json is None:
+        calcular = callback.__wrapped__ # Sin instrumentar: no son clics reales
+        try:
+            ninguna = calcular(None)
+        except Exception as e:
+            logger.warning("Advertencia: La figura inicial de %s no se pudo calcular: %s", callback.__name__, e)
+            ninguna = None
+        figuras = {valor: calcular({'points': [{campo: valor}]}) for valor in estado_datos.agregados[agregado]}
+        ejemplo = next(iter(figuras.values()), ninguna)
+        if isinstance(ejemplo, list):
+            ejemplo = ejemplo[0]
+        plantilla = (ejemplo or {}).get('layout', {}).get('template')
+        def sin_plantilla(figura):
+            if isinstance(figura, list):
+                return [_figura_sin_plantilla(f, plantilla) for f in figura]
+            return figura if figura is None else _figura_sin_plantilla(figura, plantilla)
+        datos_json = json.dumps({
+            'campo': campo,
+            'recorte': recorte,
+            'plantilla': plantilla,
+            'ninguna': sin_plantilla(ninguna),
+            'figuras': {valor: sin_plantilla(figura) for valor, figura in figuras.items()},
+        })
+        cache_figuras.guardar(clave, version, datos_json)
+    return json.loads(datos_json)
+
+DRILLDOWN_CLIENTSIDE = """
+function(clickData, datos) {
+    if (!datos) {
+        return window.dash_clientside.no_update;
+    }
+    var figura = datos.ninguna;
+    if (clickData && clickData.points && clickData.points.length) {
+        var valor = String(clickData.points[0][datos.campo]);
+        if (datos.recorte) {
+            valor = valor.slice(0, datos.recorte);
+        }
+        figura = datos.figuras[valor] || datos.ninguna;
+    }
+    if (!figura) {
+        throw window.dash_clientside.PreventUpdate;
+    }
+    var conPlantilla = function(f) {
+        if (f.layout && f.layout.template) {
+            return f;
+        }
+        return Object.assign({}, f, {layout: Object.assign({}, f.layout, {template: datos.plantilla})});
+    };
+    return Array.isArray(figura) ? figura.map(conPlantilla) : conPlantilla(figura);
+}
+"""
+
+# Registra el callback de detalle de una página: en el servidor (por defecto) o en el navegador.
+# campo es la clave del punto clicado ('x' o 'label'), agregado el diccionario de
+# estado_datos.agregados cuyas claves son las selecciones posibles y recorte la cantidad de
+# caracteres de la selección que se usan (los meses llegan como fecha completa).
+def registrar_drilldown(pagina, callback, salida, entrada, campo, agregado, recorte=None):
+    if not DRILLDOWN_EN_NAVEGADOR:
+        app.callback(salida, entrada)(callback)
+        return
+    id_store = f"drilldown-{callback.__name__}"
+    registro = dash.page_registry[pagina]
+    layout = registro['layout']
+    def layout_con_store(**parametros):
+        contenido = layout(**parametros)
+        if not carga_lista():
+            return contenido
+        return html.Div([contenido, dcc.Store(id=id_store, data=datos_drilldown(callback, campo, agregado, recorte))])
+    registro['layout'] = layout_con_store
+    app.clientside_callback(DRILLDOWN_CLIENTSIDE, salida, entrada, State(id_store, 'data'))
+
+# --- App Dash Única con Páginas ---
+# Las siete vistas son páginas de una sola app Dash (dash.register_page, sin carpeta pages/) con las
+# URLs de siempre: un solo registro de callbacks, un solo juego de scripts de componentes y un solo
+# _dash-layout y _dash-dependencies para todas. Al abrir o navegar a una página su layout llega por
+# el callback de enrutamiento de Dash. La página principal '/' sigue siendo la ruta de Flask: se
+# registró antes que las rutas de Dash y tiene prioridad.
+app = dash.Dash(__name__, server=server, use_pages=True, pages_folder="", url_base_pathname='/',
+                suppress_callback_exceptions=True)
+registrar_recarga_al_estar_listo(app)
+
+# La ruta comodín de Dash responde cualquier URL; las que no son páginas siguen dando 404
+@server.before_request
+def pagina_inexistente():
+    if request.url_rule is not None and request.url_rule.endpoint == '/<path:path>':
+        if not any(request.path.strip('/') == pagina['path'].strip('/') for pagina in dash.page_registry.values()):
+            abort(404)
+
+# Dash pasa los parámetros de la URL al layout de la página; ninguna página los usa
+def registrar_pagina(nombre, titulo, layout):
+    dash.register_page(nombre, path=f'/{nombre}/', name=titulo, title=titulo, layout=lambda **_: layout())
 
 # --- App 1: Por Rango de Edad ---
-app_edad = dash.Dash(__name__, server=server, url_base_pathname='/edad/')
-app_edad.layout = html.Div([
-    html.H1("Distribución por Rango de Edad", style={'color': '#2c3e50'}),
-    dcc.Graph(id='histogram-edad', figure=px.histogram(
-        df, # Usar el df global
+@cachear_figura(sin_seleccion)
+def figura_histograma_edad():
+    return px.bar(
+        estado_datos.agregados['conteos_categorias']['Rango de Edad'], # Conteos pre-agregados
         x='Rango de Edad',
-        category_orders={'Rango de Edad': ["Niño", "Adolescente", "Joven", "Adulto", "Adulto mayor"]},
+        y='CANTIDAD',
+        category_orders={'Rango de Edad': etiquetas_rangos(RANGOS_EDAD)},
         title='Distribución de edades de los pacientes del hospital María Auxiliadora',
-        labels={'Rango de Edad': 'Rango de Edad'},
+        labels={'Rango de Edad': 'Rango de Edad', 'CANTIDAD': 'count'},
         template='plotly_white'
-    )),
-    dcc.Graph(id='pie-chart-edad', figure=px.pie(
-        names=[], values=[], title="Seleccione una barra en el histograma"
-    )),
-    html.Div(dcc.Link('Volver a la Página Principal', href='/', style={'display': 'inline-block', 'marginTop': '20px', 'padding': '10px 20px', 'backgroundColor': '#f39c12', 'color': 'white', 'textDecoration': 'none', 'borderRadius': '5px'}))
-], style={'textAlign': 'center', 'fontFamily': 'Arial, sans-serif', 'backgroundColor': '#f4f6f8', 'padding': '20px', 'minHeight': '100vh'})
-
-@app_edad.callback(
-    Output('pie-chart-edad', 'figure'),
-    Input('histogram-edad', 'clickData')
-)
+    )
+
+def layout_edad():
+    if not carga_lista():
+        return pantalla_de_carga("Distribución por Rango de Edad")
+    return html.Div([
+        html.H1("Distribución por Rango de Edad", style={'color': '#2c3e50'}),
+        dcc.Graph(id='histogram-edad', figure=figura_histograma_edad()),
+        dcc.Graph(id='pie-chart-edad', figure=px.pie(
+            names=[], values=[], title="Seleccione una barra en el histograma"
+        )),
+        html.Div(dcc.Link('Volver a la Página Principal', href='/', refresh=True, style={'display': 'inline-block', 'marginTop': '20px', 'padding': '10px 20px', 'backgroundColor': '#f39c12', 'color': 'white', 'textDecoration': 'none', 'borderRadius': '5px'}))
+    ], style={'textAlign': 'center', 'fontFamily': 'Arial, sans-serif', 'backgroundColor': '#f4f6f8', 'padding': '20px', 'minHeight': '100vh'})
+
+registrar_pagina('edad', 'Distribución por Edad', layout_edad)
+
+@instrumentar_callback
+@cachear_figura(seleccion_x)
 def update_pie_chart_edad(clickData):
-    print(f"Callback update_pie_chart_edad activado con clickData: {clickData}")
+    logger.debug("Callback update_pie_chart_edad activado con clickData: %s", clickData)
     if clickData is None:
         return px.pie(names=[], values=[], title="Seleccione una barra en el histograma", height=500)
 
     selected_range = clickData['points'][0]['x']
-    print(f"Rango de edad seleccionado: {selected_range}")
-    
-    # Asegúrate de trabajar con una copia explícita
-    filtered_df = df[df['Rango de Edad'] == selected_range].copy()
-    print(f"Dimensiones de filtered_df para edad: {filtered_df.shape}")
-    
-    if filtered_df.empty:
-        print("filtered_df (edad) está vacío, retornando figura vacía.")
-        return px.pie(names=[], values=[], title=f"No hay datos para el rango de edad '{selected_range}'", height=500)
+    logger.debug("Rango de edad seleccionado: %s", selected_range)
 
-    # Lógica de agrupación de especialidades probada en tu código que funciona
-    top_especialidades = filtered_df['ESPECIALIDAD'].value_counts().nlargest(5)
-    filtered_df['ESPECIALIDAD_AGRUPADA'] = filtered_df['ESPECIALIDAD'].apply(
-        lambda x: x if x in top_especialidades.index else 'Otras'
-    )
+    conteos = estado_datos.agregados['especialidades_por_edad'].get(str(selected_range))
+    if conteos is None or conteos.empty:
+        logger.debug("No hay conteos precalculados (edad) para la selección, retornando figura vacía.")
+        return px.pie(names=[], values=[], title=f"No hay datos para el rango de edad '{selected_range}'", height=500)
 
-    grouped = filtered_df['ESPECIALIDAD_AGRUPADA'].value_counts().reset_index()
-    grouped.columns = ['ESPECIALIDAD', 'CUENTA']
-    print(f"pie_data final para edad:\n{grouped.head()}")
+    grouped = agrupar_top_especialidades(conteos)
+    logger.debug("pie_data final para edad:\n%s", grouped.head())
 
     return px.pie(
         grouped, # Usamos el DataFrame 'grouped'
@@ -315,53 +2878,54 @@ def update_pie_chart_edad(clickData):
         height=600
     )
 
+registrar_drilldown('edad', update_pie_chart_edad,
+                    Output('pie-chart-edad', 'figure'), Input('histogram-edad', 'clickData'),
+                    'x', 'especialidades_por_edad')
+
 # --- App 2: Por Rango de Días de Espera ---
-app_espera = dash.Dash(__name__, server=server, url_base_pathname='/espera/')
-app_espera.layout = html.Div([
-    html.H1("Distribución por Tiempo de Espera", style={'color': '#2c3e50'}),
-    dcc.Graph(id='histogram-espera', figure=px.histogram(
-        df,
+@cachear_figura(sin_seleccion)
+def figura_histograma_espera():
+    return px.bar(
+        estado_datos.agregados['conteos_categorias']['RANGO_DIAS'],
         x='RANGO_DIAS',
-        category_orders={'RANGO_DIAS': ["0-9", "10-19", "20-29", "30-39", "40-49", "50-59", "60-69", "70-79", "80-89", "90+"]},
+        y='CANTIDAD',
+        category_orders={'RANGO_DIAS': etiquetas_rangos(RANGOS_DIAS)},
         title='Distribución de la Cantidad de Pacientes según su Tiempo de Espera',
-        labels={'RANGO_DIAS': 'Rango de Días'},
+        labels={'RANGO_DIAS': 'Rango de Días', 'CANTIDAD': 'count'},
         template='plotly_white'
-    )),
-    dcc.Graph(id='pie-chart-espera', figure=px.pie(
-        names=[], values=[], title="Seleccione una barra en el histograma"
-    )),
-    html.Div(dcc.Link('Volver a la Página Principal', href='/', style={'display': 'inline-block', 'marginTop': '20px', 'padding': '10px 20px', 'backgroundColor': '#f39c12', 'color': 'white', 'textDecoration': 'none', 'borderRadius': '5px'}))
-], style={'textAlign': 'center', 'fontFamily': 'Arial, sans-serif', 'backgroundColor': '#f4f6f8', 'padding': '20px', 'minHeight': '100vh'})
-
-@app_espera.callback(
-    Output('pie-chart-espera', 'figure'),
-    Input('histogram-espera', 'clickData')
-)
+    )
+
+def layout_espera():
+    if not carga_lista():
+        return pantalla_de_carga("Distribución por Tiempo de Espera")
+    return html.Div([
+        html.H1("Distribución por Tiempo de Espera", style={'color': '#2c3e50'}),
+        dcc.Graph(id='histogram-espera', figure=figura_histograma_espera()),
+        dcc.Graph(id='pie-chart-espera', figure=px.pie(
+            names=[], values=[], title="Seleccione una barra en el histograma"
+        )),
+        html.Div(dcc.Link('Volver a la Página Principal', href='/', refresh=True, style={'display': 'inline-block', 'marginTop': '20px', 'padding': '10px 20px', 'backgroundColor': '#f39c12', 'color': 'white', 'textDecoration': 'none', 'borderRadius': '5px'}))
+    ], style={'textAlign': 'center', 'fontFamily': 'Arial, sans-serif', 'backgroundColor': '#f4f6f8', 'padding': '20px', 'minHeight': '100vh'})
+
+registrar_pagina('espera', 'Tiempos de Espera', layout_espera)
+
+@instrumentar_callback
+@cachear_figura(seleccion_x)
 def update_pie_chart_espera(clickData):
-    print(f"Callback update_pie_chart_espera activado con clickData: {clickData}")
+    logger.debug("Callback update_pie_chart_espera activado con clickData: %s", clickData)
     if clickData is None:
         return px.pie(names=[], values=[], title="Seleccione una barra en el histograma", height=500)
 
     selected_range = clickData['points'][0]['x']
-    print(f"Rango de días seleccionado: {selected_range}")
-    
-    # Asegúrate de trabajar con una copia explícita
-    filtered_df = df[df['RANGO_DIAS'] == selected_range].copy()
-    print(f"Dimensiones de filtered_df para espera: {filtered_df.shape}")
-
-    if filtered_df.empty:
-        print("filtered_df (espera) está vacío, retornando figura vacía.")
-        return px.pie(names=[], values=[], title=f"No hay datos para el rango de espera '{selected_range}'", height=500)
+    logger.debug("Rango de días seleccionado: %s", selected_range)
 
-    # Lógica de agrupación de especialidades probada en tu código que funciona
-    top_especialidades = filtered_df['ESPECIALIDAD'].value_counts().nlargest(5)
-    filtered_df['ESPECIALIDAD_AGRUPADA'] = filtered_df['ESPECIALIDAD'].apply(
-        lambda x: x if x in top_especialidades.index else 'Otras'
-    )
+    conteos = estado_datos.agregados['especialidades_por_espera'].get(str(selected_range))
+    if conteos is None or conteos.empty:
+        logger.debug("No hay conteos precalculados (espera) para la selección, retornando figura vacía.")
+        return px.pie(names=[], values=[], title=f"No hay datos para el rango de espera '{selected_range}'", height=500)
 
-    grouped = filtered_df['ESPECIALIDAD_AGRUPADA'].value_counts().reset_index()
-    grouped.columns = ['ESPECIALIDAD', 'CUENTA']
-    print(f"pie_data final para espera:\n{grouped.head()}")
+    grouped = agrupar_top_especialidades(conteos)
+    logger.debug("pie_data final para espera:\n%s", grouped.head())
 
     return px.pie(
         grouped, # Usamos el DataFrame 'grouped'
@@ -371,139 +2935,244 @@ def update_pie_chart_espera(clickData):
         height=600
     )
 
+registrar_drilldown('espera', update_pie_chart_espera,
+                    Output('pie-chart-espera', 'figure'), Input('histogram-espera', 'clickData'),
+                    'x', 'especialidades_por_espera')
+
 # --- App 3: Por Modalidad de Cita ---
-app_modalidad = dash.Dash(__name__, server=server, url_base_pathname='/modalidad/')
-app_modalidad.layout = html.Div([
-    html.H1("Distribución por Modalidad de Cita", style={'color': '#2c3e50'}),
-    dcc.Graph(id='pie-modalidad', figure=px.pie(
-        df,
+@cachear_figura(sin_seleccion)
+def figura_pie_modalidad():
+    return px.pie(
+        estado_datos.agregados['conteos_categorias']['PRESENCIAL_REMOTO'],
         names='PRESENCIAL_REMOTO',
+        values='CANTIDAD',
         title='Distribución de Citas: Remotas vs Presenciales',
         template='plotly_white'
-    )),
-    dcc.Graph(id='bar-especialidad-modalidad', figure=px.bar(
-        pd.DataFrame(columns=['ESPECIALIDAD', 'DIFERENCIA_DIAS']),
-        x='ESPECIALIDAD',
-        y='DIFERENCIA_DIAS',
-        title="Seleccione una modalidad en el gráfico de pastel"
-    )),
-    html.Div(dcc.Link('Volver a la Página Principal', href='/', style={'display': 'inline-block', 'marginTop': '20px', 'padding': '10px 20px', 'backgroundColor': '#f39c12', 'color': 'white', 'textDecoration': 'none', 'borderRadius': '5px'}))
-], style={'textAlign': 'center', 'fontFamily': 'Arial, sans-serif', 'backgroundColor': '#f4f6f8', 'padding': '20px', 'minHeight': '100vh'})
-
-@app_modalidad.callback(
-    Output('bar-especialidad-modalidad', 'figure'),
-    Input('pie-modalidad', 'clickData')
-)
+    )
+
+def layout_modalidad():
+    if not carga_lista():
+        return pantalla_de_carga("Distribución por Modalidad de Cita")
+    return html.Div([
+        html.H1("Distribución por Modalidad de Cita", style={'color': '#2c3e50'}),
+        dcc.Graph(id='pie-modalidad', figure=figura_pie_modalidad()),
+        dcc.Graph(id='bar-especialidad-modalidad', figure=px.bar(
+            pd.DataFrame(columns=['ESPECIALIDAD', 'DIFERENCIA_DIAS']),
+            x='ESPECIALIDAD',
+            y='DIFERENCIA_DIAS',
+            title="Seleccione una modalidad en el gráfico de pastel"
+        )),
+        html.Div(dcc.Link('Volver a la Página Principal', href='/', refresh=True, style={'display': 'inline-block', 'marginTop': '20px', 'padding': '10px 20px', 'backgroundColor': '#f39c12', 'color': 'white', 'textDecoration': 'none', 'borderRadius': '5px'}))
+    ], style={'textAlign': 'center', 'fontFamily': 'Arial, sans-serif', 'backgroundColor': '#f4f6f8', 'padding': '20px', 'minHeight': '100vh'})
+
+registrar_pagina('modalidad', 'Modalidad de Atención', layout_modalidad)
+
+@instrumentar_callback
+@cachear_figura(seleccion_label)
 def update_bar_modalidad(clickData):
-    print(f"Callback update_bar_modalidad activado con clickData: {clickData}")
+    logger.debug("Callback update_bar_modalidad activado con clickData: %s", clickData)
     if clickData is None:
         return px.bar(x=[], y=[], title="Seleccione una modalidad en el gráfico de pastel")
 
     modalidad = clickData['points'][0]['label']
-    print(f"Modalidad seleccionada: {modalidad}")
-    filtered_df = df[df['PRESENCIAL_REMOTO'] == modalidad].copy() # Usar .copy()
-    print(f"Dimensiones de filtered_df para modalidad: {filtered_df.shape}")
-
-    if filtered_df.empty:
-        print("filtered_df (modalidad) está vacío, retornando figura vacía.")
+    logger.debug("Modalidad seleccionada: %s", modalidad)
+    agregados = estado_datos.agregados
+    espera = agregados['espera_por_modalidad'].get(str(modalidad))
+    if espera is None or espera.empty:
+        logger.debug("No hay agregados de espera (modalidad) para la selección, retornando figura vacía.")
         return px.bar(x=[], y=[], title=f"No hay datos para la modalidad '{modalidad}'")
 
-    mean_wait = filtered_df.groupby('ESPECIALIDAD')['DIFERENCIA_DIAS'].mean().reset_index()
-    mean_wait = mean_wait.sort_values(by='DIFERENCIA_DIAS', ascending=False)
-    print(f"mean_wait para modalidad:\n{mean_wait.head()}")
+    estadisticas = espera_con_percentiles(espera, agregados['histograma_espera'], 'ESPECIALIDAD',
+                                          {'PRESENCIAL_REMOTO': [modalidad]})
+    logger.debug("Estadísticas de espera para modalidad:\n%s", estadisticas.head())
 
     return px.bar(
-        mean_wait,
+        estadisticas,
         x='ESPECIALIDAD',
         y='DIFERENCIA_DIAS',
-        title=f"Media de Días de Espera por Especialidad ({modalidad})",
-        labels={'DIFERENCIA_DIAS': 'Días de Espera'},
+        color='ESTADISTICA',
+        barmode='group',
+        title=f"Días de Espera por Especialidad: media, mediana, p90 y p99 ({modalidad})",
+        labels={'DIFERENCIA_DIAS': 'Días de Espera', 'ESTADISTICA': 'Estadística'},
         template='plotly_white'
    )
 
+registrar_drilldown('modalidad', update_bar_modalidad,
+                    Output('bar-especialidad-modalidad', 'figure'), Input('pie-modalidad', 'clickData'),
+                    'label', 'espera_por_modalidad')
 
 # --- App 4: Por Estado de Seguro (CORREGIDO el url_base_pathname) ---
-app_asegurados = dash.Dash(__name__, server=server, url_base_pathname='/asegurados/')
-app_asegurados.layout = html.Div([
-    html.H1("Distribución por Estado del Seguro", style={'color': '#2c3e50'}),
-    dcc.Graph(id='pie-seguro', figure=px.pie(
-        df.dropna(subset=['SEGURO']) if 'SEGURO' in df.columns else pd.DataFrame(columns=['SEGURO']),
+@cachear_figura(sin_seleccion)
+def figura_pie_seguro():
+    return px.pie(
+        estado_datos.agregados['conteos_categorias']['SEGURO'], # value_counts ya descarta los NaN
         names='SEGURO',
+        values='CANTIDAD',
         title='Distribución de Pacientes: Asegurados vs No Asegurados',
         template='plotly_white'
-    )),
-    dcc.Graph(id='bar-espera-seguro', figure=px.bar(
-        pd.DataFrame(columns=['SEXO', 'DIFERENCIA_DIAS']),
-        x='SEXO',
-        y='DIFERENCIA_DIAS',
-        title="Seleccione una opción en el gráfico de pastel"
-    )),
-    html.Div(dcc.Link('Volver a la Página Principal', href='/', style={'display': 'inline-block', 'marginTop': '20px', 'padding': '10px 20px', 'backgroundColor': '#f39c12', 'color': 'white', 'textDecoration': 'none', 'borderRadius': '5px'}))
-], style={'textAlign': 'center', 'fontFamily': 'Arial, sans-serif', 'backgroundColor': '#f4f6f8', 'padding': '20px', 'minHeight': '100vh'})
-
-@app_asegurados.callback(
-    Output('bar-espera-seguro', 'figure'),
-    Input('pie-seguro', 'clickData')
-)
+    )
+
+def layout_asegurados():
+    if not carga_lista():
+        return pantalla_de_carga("Distribución por Estado del Seguro")
+    return html.Div([
+        html.H1("Distribución por Estado del Seguro", style={'color': '#2c3e50'}),
+        dcc.Graph(id='pie-seguro', figure=figura_pie_seguro()),
+        dcc.Graph(id='bar-espera-seguro', figure=px.bar(
+            pd.DataFrame(columns=['SEXO', 'DIFERENCIA_DIAS']),
+            x='SEXO',
+            y='DIFERENCIA_DIAS',
+            title="Seleccione una opción en el gráfico de pastel"
+        )),
+        html.Div(dcc.Link('Volver a la Página Principal', href='/', refresh=True, style={'display': 'inline-block', 'marginTop': '20px', 'padding': '10px 20px', 'backgroundColor': '#f39c12', 'color': 'white', 'textDecoration': 'none', 'borderRadius': '5px'}))
+    ], style={'textAlign': 'center', 'fontFamily': 'Arial, sans-serif', 'backgroundColor': '#f4f6f8', 'padding': '20px', 'minHeight': '100vh'})
+
+registrar_pagina('asegurados', 'Estado del Seguro', layout_asegurados)
+
+@instrumentar_callback
+@cachear_figura(seleccion_label)
 def update_bar_seguro(clickData):
-    print(f"Callback update_bar_seguro activado con clickData: {clickData}")
+    logger.debug("Callback update_bar_seguro activado con clickData: %s", clickData)
     if clickData is None:
         return px.bar(x=[], y=[], title="Seleccione una opción en el gráfico de pastel")
 
     seguro = clickData['points'][0]['label']
-    print(f"Estado de seguro seleccionado: {seguro}")
-    filtered_df = df[df['SEGURO'] == seguro].copy() # Usar .copy()
-    print(f"Dimensiones de filtered_df para seguro: {filtered_df.shape}")
-
-    if filtered_df.empty:
-        print("filtered_df (seguro) está vacío, retornando figura vacía.")
+    logger.debug("Estado de seguro seleccionado: %s", seguro)
+    agregados = estado_datos.agregados
+    espera = agregados['espera_por_seguro'].get(str(seguro))
+    if espera is None or espera.empty:
+        logger.debug("No hay agregados de espera (seguro) para la selección, retornando figura vacía.")
         return px.bar(x=[], y=[], title=f"No hay datos para el estado de seguro '{seguro}'")
 
-    mean_wait = filtered_df.groupby('SEXO')['DIFERENCIA_DIAS'].mean().reset_index()
-    mean_wait = mean_wait.sort_values(by='DIFERENCIA_DIAS', ascending=False)
-    print(f"mean_wait para seguro:\n{mean_wait.head()}")
+    estadisticas = espera_con_percentiles(espera, agregados['histograma_espera'], 'SEXO', {'SEGURO': [seguro]})
+    logger.debug("Estadísticas de espera para seguro:\n%s", estadisticas.head())
 
     fig = px.bar(
-        mean_wait,
+        estadisticas,
         x='SEXO',
         y='DIFERENCIA_DIAS',
-        title=f"Media de Días de Espera por SEXO ({seguro})",
-        labels={'DIFERENCIA_DIAS': 'Días de Espera'},
+        color='ESTADISTICA',
+        barmode='group',
+        title=f"Días de Espera por SEXO: media, mediana, p90 y p99 ({seguro})",
+        labels={'DIFERENCIA_DIAS': 'Días de Espera', 'ESTADISTICA': 'Estadística'},
         template='plotly_white'
     )
     # Ajustar rango dinámicamente o dejar fijo
-    fig.update_yaxes(range=[0, mean_wait['DIFERENCIA_DIAS'].max() + 2] if not mean_wait.empty else [0, 1])
+    fig.update_yaxes(range=[0, estadisticas['DIFERENCIA_DIAS'].max() + 2] if not estadisticas.empty else [0, 1])
     return fig
 
+registrar_drilldown('asegurados', update_bar_seguro,
+                    Output('bar-espera-seguro', 'figure'), Input('pie-seguro', 'clickData'),
+                    'label', 'espera_por_seguro')
 
 # --- App 5: Línea de Tiempo ---
-app_tiempo = dash.Dash(__name__, server=server, url_base_pathname='/tiempo/')
-app_tiempo.layout = html.Div([
-    html.H1("Citas Agendadas por Mes", style={'color': '#2c3e50'}),
-    dcc.Graph(
-        id='grafico-lineal',
-        figure=px.line(citas_por_mes, x='MES', y='CANTIDAD_CITAS', markers=True,
-                        title='Cantidad de Citas por Mes')
-    ),
-    html.Div([
-        dcc.Graph(id='grafico-pie-especialidades'),
-        dcc.Graph(id='grafico-pie-atencion')
-    ], style={'display': 'flex', 'justifyContent': 'space-around', 'flexWrap': 'wrap'}),
-    html.Div(dcc.Link('Volver a la Página Principal', href='/', style={'display': 'inline-block', 'marginTop': '20px', 'padding': '10px 20px', 'backgroundColor': '#f39c12', 'color': 'white', 'textDecoration': 'none', 'borderRadius': '5px'}))
-], style={'textAlign': 'center', 'fontFamily': 'Arial, sans-serif', 'backgroundColor': '#f4f6f8', 'padding': '20px', 'minHeight': '100vh'})
-
-@app_tiempo.callback(
-    [Output('grafico-pie-especialidades', 'figure'),
-     Output('grafico-pie-atencion', 'figure')],
-    [Input('grafico-lineal', 'clickData')]
+@cachear_figura(sin_seleccion)
+def figura_linea_tiempo():
+    return px.line(estado_datos.citas_por_mes, x='MES', y='CANTIDAD_CITAS', markers=True,
+                   title='Cantidad de Citas por Mes')
+
+def layout_tiempo():
+    if not carga_lista():
+        return pantalla_de_carga("Citas Agendadas por Mes")
+    desde, hasta = estado_datos.rollups.limites()
+    return html.Div([
+        html.H1("Citas Agendadas por Mes", style={'color': '#2c3e50'}),
+        dcc.Graph(
+            id='grafico-lineal',
+            figure=figura_linea_tiempo()
+        ),
+        html.Div([
+            html.Label("Detalle de un rango de fechas:", style={'marginRight': '10px', 'fontWeight': 'bold'}),
+            dcc.DatePickerRange(id='rango-tiempo', min_date_allowed=desde, max_date_allowed=hasta,
+                                initial_visible_month=hasta, display_format='YYYY-MM-DD')
+        ], style={'margin': '10px'}),
+        html.Div([
+            dcc.Graph(id='grafico-pie-especialidades'),
+            dcc.Graph(id='grafico-pie-atencion')
+        ], style={'display': 'flex', 'justifyContent': 'space-around', 'flexWrap': 'wrap'}),
+        html.Div(dcc.Link('Volver a la Página Principal', href='/', refresh=True, style={'display': 'inline-block', 'marginTop': '20px', 'padding': '10px 20px', 'backgroundColor': '#f39c12', 'color': 'white', 'textDecoration': 'none', 'borderRadius': '5px'}))
+    ], style={'textAlign': 'center', 'fontFamily': 'Arial, sans-serif', 'backgroundColor': '#f4f6f8', 'padding': '20px', 'minHeight': '100vh'})
+
+registrar_pagina('tiempo', 'Línea de Tiempo', layout_tiempo)
+
+# Con zoom la línea cambia de resolución: días si se ven hasta ~3 meses, semanas hasta 2 años y
+# meses por encima. Solo se envían los periodos visibles. Al volver al zoom inicial se muestra la
+# figura por mes de siempre. Con DRILLDOWN_EN_NAVEGADOR=1 el clic en un día o una semana muestra el
+# detalle de su mes (el navegador solo tiene las figuras por mes); el rango de fechas va al servidor.
+def rango_zoom(relayoutData):
+    if not relayoutData:
+        return None
+    if relayoutData.get('xaxis.autorange'):
+        return 'completo'
+    rango = relayoutData.get('xaxis.range')
+    if rango is None and 'xaxis.range[0]' in relayoutData:
+        rango = [relayoutData['xaxis.range[0]'], relayoutData.get('xaxis.range[1]')]
+    if not rango or rango[1] is None:
+        return None
+    try:
+        return pd.Timestamp(rango[0]), pd.Timestamp(rango[1])
+    except (ValueError, TypeError):
+        return None
+
+def figura_tiempo(resolucion, desde, hasta):
+    serie = estado_datos.rollups.serie(resolucion, desde, hasta)
+    figura = px.line(serie, x='INICIO', y='CANTIDAD_CITAS', markers=True, custom_data=['INICIO', 'FIN', 'ETIQUETA'],
+                     title=f'Cantidad de Citas por {RESOLUCIONES_TIEMPO[resolucion]}',
+                     labels={'INICIO': RESOLUCIONES_TIEMPO[resolucion].upper()})
+    figura.update_xaxes(range=[desde.isoformat(), hasta.isoformat()])
+    return figura
+
+@app.callback(
+    Output('grafico-lineal', 'figure'),
+    Input('grafico-lineal', 'relayoutData'),
+    prevent_initial_call=True
 )
+@instrumentar_callback
+def cambiar_resolucion(relayoutData):
+    rango = rango_zoom(relayoutData)
+    if rango is None:
+        raise dash.exceptions.PreventUpdate
+    if rango == 'completo':
+        return figura_linea_tiempo()
+    desde, hasta = rango
+    return figura_tiempo(resolucion_para((hasta - desde).days), desde, hasta)
+
+# Figuras de detalle de un periodo a partir de los rollups (costo independiente del largo)
+def figuras_periodo(desde, hasta, etiqueta):
+    conteos = estado_datos.rollups.rango(desde, hasta)
+    conteos_especialidades = conteos.get('ESPECIALIDAD')
+    if conteos_especialidades is None or conteos_especialidades.empty:
+        return (px.pie(names=[], values=[], title=f"No hay datos de especialidades para {etiqueta}"),
+                px.pie(names=[], values=[], title=f"No hay datos de atención para {etiqueta}"))
+    fig_especialidades = px.pie(agrupar_top_especialidades(conteos_especialidades), names='ESPECIALIDAD', values="CUENTA",
+                                title=f'Distribución de Especialidades en {etiqueta}')
+    conteos_atendido = conteos.get('ATENDIDO')
+    if conteos_atendido is not None and not conteos_atendido.empty:
+        fig_atencion = px.pie(names=conteos_atendido.index, values=conteos_atendido.values,
+                              title=f'Estado de Atención en {etiqueta}')
+    else:
+        fig_atencion = px.pie(names=[], values=[], title=f"No hay datos de atención para {etiqueta}")
+    return fig_especialidades, fig_atencion
+
+# Los puntos de la línea con zoom llevan el periodo en customdata (inicio, fin, etiqueta)
+def seleccion_periodo(clickData):
+    if clickData is None:
+        return None
+    punto = clickData['points'][0]
+    return '|'.join(punto['customdata']) if punto.get('customdata') else str(punto['x'])
+
+@instrumentar_callback
+@cachear_figura(seleccion_periodo)
 def actualizar_graficos(clickData):
-    print(f"Callback actualizar_graficos activado con clickData: {clickData}")
+    logger.debug("Callback actualizar_graficos activado con clickData: %s", clickData)
     if clickData is None:
         return px.pie(names=[], values=[], title="Seleccione un mes"), px.pie(names=[], values=[], title="Seleccione un mes")
 
+    if clickData['points'][0].get('customdata'):
+        return figuras_periodo(*clickData['points'][0]['customdata'])
+
     mes_seleccionado_str = clickData['points'][0]['x']
-    print(f"Mes seleccionado (string desde clickData): {mes_seleccionado_str}")
+    logger.debug("Mes seleccionado (string desde clickData): %s", mes_seleccionado_str)
 
     # Asegurarse de que el formato de mes_seleccionado coincida con el de la columna 'MES' en df
     # Si 'MES' en df es 'YYYY-MM', el clickData['points'][0]['x'] también debería serlo.
@@ -512,78 +3181,102 @@ def actualizar_graficos(clickData):
         mes_seleccionado_period = pd.Period(mes_seleccionado_str, freq='M')
         mes_para_filtro = str(mes_seleccionado_period)
     except Exception as e:
-        print(f"Error al convertir mes_seleccionado_str a Period: {e}. Usando el valor original.")
+        logger.warning("Error al convertir mes_seleccionado_str a Period: %s. Usando el valor original.", e)
         mes_para_filtro = mes_seleccionado_str # Fallback
 
-    print(f"Mes usado para filtrar (formato YYYY-MM): {mes_para_filtro}")
-    
-    # Asegúrate de trabajar con una copia explícita
-    filtered_df_mes = df[df['MES'] == mes_para_filtro].copy()
-    print(f"Dimensiones de filtered_df_mes para el mes {mes_para_filtro}: {filtered_df_mes.shape}")
+    logger.debug("Mes usado para filtrar (formato YYYY-MM): %s", mes_para_filtro)
 
-    if filtered_df_mes.empty:
-        print(f"filtered_df_mes para {mes_para_filtro} está vacío, retornando figuras vacías.")
+    agregados = estado_datos.agregados # Una sola versión de los datos para ambos gráficos
+    conteos_especialidades = agregados['especialidades_por_mes'].get(mes_para_filtro)
+    if conteos_especialidades is None or conteos_especialidades.empty:
+        logger.debug("No hay conteos precalculados para %s, retornando figuras vacías.", mes_para_filtro)
         return (px.pie(names=[], values=[], title=f"No hay datos de especialidades para {mes_para_filtro}"),
                 px.pie(names=[], values=[], title=f"No hay datos de atención para {mes_para_filtro}"))
 
-    # Lógica de agrupación de especialidades probada en tu código que funciona
-    top_especialidades_mes = filtered_df_mes['ESPECIALIDAD'].value_counts().nlargest(5)
-    filtered_df_mes['ESPECIALIDAD_AGRUPADA'] = filtered_df_mes['ESPECIALIDAD'].apply(
-        lambda x: x if x in top_especialidades_mes.index else 'Otras'
-    )
-
-    grouped_especialidades = filtered_df_mes['ESPECIALIDAD_AGRUPADA'].value_counts().reset_index()
-    grouped_especialidades.columns = ['ESPECIALIDAD', 'CUENTA']
-    grouped_especialidades = grouped_especialidades.sort_values(by='CUENTA', ascending=False)
-    print(f"grouped_especialidades final para {mes_para_filtro}:\n{grouped_especialidades.head()}")
+    grouped_especialidades = agrupar_top_especialidades(conteos_especialidades)
+    logger.debug("grouped_especialidades final para %s:\n%s", mes_para_filtro, grouped_especialidades.head())
 
     fig_especialidades = px.pie(grouped_especialidades, names='ESPECIALIDAD', values="CUENTA", title=f'Distribución de Especialidades en {mes_para_filtro}')
-    
-    # Para el gráfico de atención, verificar si la columna existe y tiene datos
-    if 'ATENDIDO' in filtered_df_mes.columns and not filtered_df_mes['ATENDIDO'].empty:
-        print(f"Conteo de estado de atención para {mes_para_filtro}:\n{filtered_df_mes['ATENDIDO'].value_counts(dropna=False)}")
-        fig_atencion = px.pie(filtered_df_mes, names='ATENDIDO', title=f'Estado de Atención en {mes_para_filtro}')
+
+    # Para el gráfico de atención, verificar que haya conteos para el mes
+    conteos_atendido = agregados['atendido_por_mes'].get(mes_para_filtro)
+    if conteos_atendido is not None and not conteos_atendido.empty:
+        logger.debug("Conteo de estado de atención para %s:\n%s", mes_para_filtro, conteos_atendido)
+        fig_atencion = px.pie(names=conteos_atendido.index.astype(object), values=conteos_atendido.values,
+                              title=f'Estado de Atención en {mes_para_filtro}')
     else:
-        print(f"Advertencia: La columna 'ATENDIDO' está vacía o no existe en filtered_df_mes para {mes_para_filtro}. No se generará el gráfico de atención.")
+        logger.debug("Advertencia: No hay conteos de 'ATENDIDO' para %s. No se generará el gráfico de atención.", mes_para_filtro)
         fig_atencion = px.pie(names=[], values=[], title=f"No hay datos de atención para {mes_para_filtro}")
 
     return fig_especialidades, fig_atencion
 
+registrar_drilldown('tiempo', actualizar_graficos,
+                    [Output('grafico-pie-especialidades', 'figure'), Output('grafico-pie-atencion', 'figure')],
+                    Input('grafico-lineal', 'clickData'),
+                    'x', 'especialidades_por_mes', recorte=7)
+
+def seleccion_rango(desde, hasta):
+    return f"{desde}|{hasta}"
+
+@app.callback(
+    [Output('grafico-pie-especialidades', 'figure', allow_duplicate=True),
+     Output('grafico-pie-atencion', 'figure', allow_duplicate=True)],
+    [Input('rango-tiempo', 'start_date'), Input('rango-tiempo', 'end_date')],
+    prevent_initial_call=True
+)
+@instrumentar_callback
+@cachear_figura(seleccion_rango)
+def actualizar_graficos_rango(desde, hasta):
+    if not desde or not hasta:
+        raise dash.exceptions.PreventUpdate
+    desde, hasta = desde[:10], hasta[:10]
+    return figuras_periodo(desde, hasta, f"{desde} a {hasta}")
+
 # --- App 6: Simulador de Tiempo de Espera (NUEVA APP) ---
-simulador_app = dash.Dash(__name__, server=server, url_base_pathname='/simulador/')
-simulador_app.layout = html.Div([
-    html.H1("Simulador de Tiempo de Espera Estimado", style={'color': '#2c3e50', 'marginBottom': '30px'}),
-    html.Div([
-        html.Label("Edad:", style={'display': 'block', 'marginBottom': '5px', 'fontWeight': 'bold'}),
-        dcc.Input(id='sim-input-edad', type='number', value=30, min=0, max=120, className="input-field", style={'width': 'calc(100% - 20px)', 'padding': '10px', 'borderRadius': '5px', 'border': '1px solid #ddd', 'marginBottom': '15px'}),
-        
-        html.Label("Especialidad:", style={'display': 'block', 'marginBottom': '5px', 'fontWeight': 'bold'}),
-        dcc.Dropdown(
-            id='sim-input-especialidad',
-            options=[{'label': v, 'value': k} for k, v in especialidades_dic.items()],
-            value=17,
-            placeholder="Selecciona una especialidad",
-            className="dropdown-field",
-            style={'marginBottom': '20px'}
-        ),
+def layout_simulador():
+    if not carga_lista():
+        return pantalla_de_carga("Simulador de Tiempo de Espera Estimado")
+    return html.Div([
+        html.H1("Simulador de Tiempo de Espera Estimado", style={'color': '#2c3e50', 'marginBottom': '30px'}),
+        html.Div([
+            html.Label("Edad:", style={'display': 'block', 'marginBottom': '5px', 'fontWeight': 'bold'}),
+            dcc.Input(id='sim-input-edad', type='number', value=30, min=0, max=120, className="input-field", style={'width': 'calc(100% - 20px)', 'padding': '10px', 'borderRadius': '5px', 'border': '1px solid #ddd', 'marginBottom': '15px'}),
+            
+            html.Label("Especialidad:", style={'display': 'block', 'marginBottom': '5px', 'fontWeight': 'bold'}),
+            dcc.Dropdown(
+                id='sim-input-especialidad',
+                options=[{'label': v, 'value': k} for k, v in especialidades_dic.items()],
+                value=17,
+                placeholder="Selecciona una especialidad",
+                className="dropdown-field",
+                style={'marginBottom': '20px'}
+            ),
+            
+            html.Button('Predecir Tiempo de Espera', id='sim-predict-button', n_clicks=0, className="button-predict",
+                         style={'backgroundColor': '#28a745', 'color': 'white', 'padding': '12px 25px', 'border': 'none', 'borderRadius': '5px', 'cursor': 'pointer', 'fontSize': '16px', 'transition': 'background-color 0.3s ease', 'boxShadow': '0 2px 4px rgba(0,0,0,0.1)'}),
+            html.Div(id='sim-output-prediction', style={'marginTop': '30px', 'fontSize': '22px', 'fontWeight': 'bold', 'color': '#007bff'})
+        ], style={'padding': '30px', 'border': '1px solid #e0e0e0', 'borderRadius': '10px', 'maxWidth': '550px', 'margin': '40px auto', 'backgroundColor': '#ffffff', 'boxShadow': '0 5px 15px rgba(0,0,0,0.08)'}),
+
+        html.Div([
+            dcc.Graph(id='sim-pronostico'),
+            dcc.Graph(id='sim-pronostico-especialidades')
+        ], style={'maxWidth': '1100px', 'margin': '0 auto'}),
         
-        html.Button('Predecir Tiempo de Espera', id='sim-predict-button', n_clicks=0, className="button-predict",
-                     style={'backgroundColor': '#28a745', 'color': 'white', 'padding': '12px 25px', 'border': 'none', 'borderRadius': '5px', 'cursor': 'pointer', 'fontSize': '16px', 'transition': 'background-color 0.3s ease', 'boxShadow': '0 2px 4px rgba(0,0,0,0.1)'}),
-        html.Div(id='sim-output-prediction', style={'marginTop': '30px', 'fontSize': '22px', 'fontWeight': 'bold', 'color': '#007bff'})
-    ], style={'padding': '30px', 'border': '1px solid #e0e0e0', 'borderRadius': '10px', 'maxWidth': '550px', 'margin': '40px auto', 'backgroundColor': '#ffffff', 'boxShadow': '0 5px 15px rgba(0,0,0,0.08)'}),
-    
-    html.Br(),
-    html.Div(dcc.Link('Volver a la Página Principal', href='/', style={'display': 'inline-block', 'marginTop': '30px', 'padding': '12px 25px', 'backgroundColor': '#f39c12', 'color': 'white', 'textDecoration': 'none', 'borderRadius': '5px', 'fontSize': '16px', 'transition': 'background-color 0.3s ease'}))
-], style={'textAlign': 'center', 'fontFamily': 'Arial, sans-serif', 'backgroundColor': '#f4f6f8', 'padding': '40px 20px', 'minHeight': '100vh', 'boxSizing': 'border-box'})
+        html.Br(),
+        html.Div(dcc.Link('Volver a la Página Principal', href='/', refresh=True, style={'display': 'inline-block', 'marginTop': '30px', 'padding': '12px 25px', 'backgroundColor': '#f39c12', 'color': 'white', 'textDecoration': 'none', 'borderRadius': '5px', 'fontSize': '16px', 'transition': 'background-color 0.3s ease'}))
+    ], style={'textAlign': 'center', 'fontFamily': 'Arial, sans-serif', 'backgroundColor': '#f4f6f8', 'padding': '40px 20px', 'minHeight': '100vh', 'boxSizing': 'border-box'})
+
+registrar_pagina('simulador', 'Simulador de Citas', layout_simulador)
 
 
-@simulador_app.callback(
+@app.callback(
     Output('sim-output-prediction', 'children'),
     Input('sim-predict-button', 'n_clicks'),
     Input('sim-input-edad', 'value'),
     Input('sim-input-especialidad', 'value'),
     prevent_initial_call=True
 )
+@instrumentar_callback
 def predecir(n_clicks, edad, especialidad_cod_input):
     if n_clicks is None or n_clicks == 0:
         return ""
@@ -593,25 +3286,8 @@ def predecir(n_clicks, edad, especialidad_cod_input):
     if edad is None or especialidad_cod_input is None:
         return "⚠️ Por favor, ingrese la edad y seleccione una especialidad para la predicción."
 
-    today = datetime.now()
-    dia = today.day
-    semana_del_año = today.isocalendar()[1]
-
-    input_data = pd.DataFrame([[
-        especialidad_cod_input,
-        edad,
-        dia,
-        semana_del_año
-    ]],
-    columns=[
-        'ESPECIALIDAD_cod',
-        'EDAD',
-        'día',
-        'semana_del_año'
-    ])
-
     try:
-        predicted_days = modelo_forest.predict(input_data)[0]
+        predicted_days = tabla_predicciones.predecir(especialidad_cod_input, edad)
         nombre_especialidad = especialidades_dic.get(especialidad_cod_input, "Especialidad Desconocida")
 
         return f"Especialidad: {nombre_especialidad} — Tiempo estimado de espera: ➡️ **{max(0.0, predicted_days):.2f} días**."
@@ -619,10 +3295,141 @@ def predecir(n_clicks, edad, especialidad_cod_input):
         return f"❌ Error al realizar la predicción: {e}. Asegúrate de que los datos de entrada coincidan con lo que el modelo espera."
 
 
+# Pronóstico de los próximos DIAS_PRONOSTICO días: la espera estimada de la especialidad elegida
+# según el día en que se pida la cita (marcando el de menor espera) y un mapa de calor con todas
+# las especialidades para la misma edad. Sale de TablaPredicciones.pronostico (una llamada a
+# predict por edad y día); la clave de la caché incluye la fecha para no mostrar el de ayer.
+def seleccion_pronostico(n_clicks, edad, especialidad_cod_input):
+    return json.dumps([bool(n_clicks), str(datetime.now().date()), edad, especialidad_cod_input])
+
+@app.callback(
+    Output('sim-pronostico', 'figure'),
+    Output('sim-pronostico-especialidades', 'figure'),
+    Input('sim-predict-button', 'n_clicks'),
+    State('sim-input-edad', 'value'), # Solo el botón recalcula el pronóstico, no cada tecla
+    State('sim-input-especialidad', 'value'),
+    prevent_initial_call=True
+)
+@instrumentar_callback
+@cachear_figura(seleccion_pronostico)
+def pronosticar(n_clicks, edad, especialidad_cod_input):
+    tabla = tabla_predicciones
+    if not n_clicks or tabla is None or edad is None or especialidad_cod_input not in especialidades_dic:
+        raise dash.exceptions.PreventUpdate # predecir ya muestra el aviso correspondiente
+
+    fechas, filas, matriz = tabla.pronostico(edad)
+    dias = fechas.strftime('%Y-%m-%d')
+    serie = pd.DataFrame({'FECHA': dias, 'DIAS_ESPERA': matriz[filas[especialidad_cod_input]]})
+    mejor = serie.loc[serie['DIAS_ESPERA'].idxmin()]
+    fig_especialidad = px.line(
+        serie, x='FECHA', y='DIAS_ESPERA', markers=True,
+        title=(f"Espera estimada para {especialidades_dic[especialidad_cod_input]} según el día de la solicitud "
+               f"(menor: {mejor['FECHA']}, {mejor['DIAS_ESPERA']:.1f} días)"),
+        labels={'FECHA': 'Día de la solicitud', 'DIAS_ESPERA': 'Días de espera estimados'}, template='plotly_white'
+    )
+    fig_especialidad.add_scatter(x=[mejor['FECHA']], y=[mejor['DIAS_ESPERA']], mode='markers', name='Menor espera',
+                                 marker={'size': 14, 'color': '#28a745', 'symbol': 'star'}, showlegend=False)
+
+    nombres = np.array([especialidades_dic[codigo] for codigo in filas], dtype=object)
+    orden = np.argsort(nombres, kind='stable')
+    fig_todas = px.imshow(
+        matriz[orden], x=list(dias), y=list(nombres[orden]), aspect='auto', color_continuous_scale='RdYlGn_r',
+        labels={'x': 'Día de la solicitud', 'y': 'Especialidad', 'color': 'Días de espera'},
+        title=f'Espera estimada por especialidad y día de la solicitud ({edad} años)',
+        height=max(400, 18 * len(nombres) + 150)
+    )
+    return fig_especialidad, fig_todas
+
+
+# --- App 7: Filtros Cruzados ---
+# Combina filtros de varias dimensiones a la vez usando el índice de bitmaps de estado_datos.
+FILTROS_CRUZADOS = [
+    ('MES', 'Mes'),
+    ('Rango de Edad', 'Rango de edad'),
+    ('RANGO_DIAS', 'Días de espera'),
+    ('PRESENCIAL_REMOTO', 'Modalidad'),
+    ('SEGURO', 'Seguro'),
+    ('SEXO', 'Sexo'),
+    ('ATENDIDO', 'Atendido'),
+]
+
+def id_filtro_cruzado(columna):
+    return 'cruzado-' + columna.lower().replace(' ', '-').replace('_', '-')
+
+def layout_cruzado():
+    if not carga_lista():
+        return pantalla_de_carga("Filtros Cruzados")
+    indice = estado_datos.indice
+    return html.Div([
+        html.H1("Filtros Cruzados", style={'color': '#2c3e50'}),
+        html.Div([
+            html.Div([
+                html.Label(etiqueta, style={'display': 'block', 'marginBottom': '5px', 'fontWeight': 'bold'}),
+                dcc.Dropdown(id=id_filtro_cruzado(columna), options=indice.categorias(columna), multi=True,
+                             placeholder="Todos")
+            ], style={'width': '260px', 'margin': '10px', 'textAlign': 'left'})
+            for columna, etiqueta in FILTROS_CRUZADOS
+        ], style={'display': 'flex', 'justifyContent': 'center', 'flexWrap': 'wrap'}),
+        html.Div(id='cruzado-resumen', style={'marginTop': '20px', 'fontSize': '20px', 'fontWeight': 'bold', 'color': '#007bff'}),
+        dcc.Graph(id='cruzado-especialidades'),
+        dcc.Graph(id='cruzado-espera'),
+        dcc.Graph(id='cruzado-meses'),
+        html.Div(dcc.Link('Volver a la Página Principal', href='/', refresh=True, style={'display': 'inline-block', 'marginTop': '20px', 'padding': '10px 20px', 'backgroundColor': '#f39c12', 'color': 'white', 'textDecoration': 'none', 'borderRadius': '5px'}))
+    ], style={'textAlign': 'center', 'fontFamily': 'Arial, sans-serif', 'backgroundColor': '#f4f6f8', 'padding': '20px', 'minHeight': '100vh'})
+
+registrar_pagina('cruzado', 'Filtros Cruzados', layout_cruzado)
+
+def seleccion_filtros(*valores):
+    return json.dumps([sorted(v) if v else [] for v in valores], ensure_ascii=False)
+
+@app.callback(
+    [Output('cruzado-resumen', 'children'),
+     Output('cruzado-especialidades', 'figure'),
+     Output('cruzado-espera', 'figure'),
+     Output('cruzado-meses', 'figure')],
+    [Input(id_filtro_cruzado(columna), 'value') for columna, _ in FILTROS_CRUZADOS]
+)
+@instrumentar_callback
+@cachear_figura(seleccion_filtros)
+def actualizar_cruzado(*valores):
+    filtros = {columna: valor for (columna, _), valor in zip(FILTROS_CRUZADOS, valores) if valor}
+    consulta = estado_datos.indice.resumen(filtros, desgloses=['ESPECIALIDAD', 'MES'], esperas=['ESPECIALIDAD'])
+    espera = consulta['espera']
+    cantidad = consulta['filas']
+    if espera['filas']:
+        resumen = (f"{cantidad:,} citas — espera media {espera['media']:.1f} días "
+                   f"(mediana {espera['mediana']:.0f}, p90 {espera['p90']:.0f})")
+    else:
+        resumen = f"{cantidad:,} citas — sin datos de espera"
+
+    especialidades = consulta['desglose']['ESPECIALIDAD'].sort_values(ascending=False, kind='stable').iloc[:15]
+    fig_especialidades = px.bar(
+        especialidades.rename_axis('ESPECIALIDAD').reset_index(name='CUENTA'),
+        x='ESPECIALIDAD', y='CUENTA', title='Top 15 Especialidades con los filtros seleccionados',
+        template='plotly_white'
+    )
+
+    espera_especialidad = consulta['espera_por']['ESPECIALIDAD'].sort_values('mean', ascending=False).iloc[:15]
+    fig_espera = px.bar(
+        espera_especialidad['mean'].rename('DIFERENCIA_DIAS').reset_index(),
+        x='ESPECIALIDAD', y='DIFERENCIA_DIAS', title='Días de espera promedio por especialidad (top 15)',
+        labels={'DIFERENCIA_DIAS': 'Días de espera promedio'}, template='plotly_white'
+    )
+
+    meses = consulta['desglose']['MES']
+    fig_meses = px.line(meses.rename_axis('MES').reset_index(name='CANTIDAD_CITAS'), x='MES', y='CANTIDAD_CITAS',
+                        markers=True, title='Citas por mes con los filtros seleccionados')
+    return resumen, fig_especialidades, fig_espera, fig_meses
+
+
 # --- Punto de Entrada para Gunicorn y Desarrollo Local ---
+# Todas las rutas y apps ya están registradas: la carga puede empezar (en segundo plano por defecto,
+# síncrona con CARGA_EN_SEGUNDO_PLANO=0, que es lo que hace gunicorn.conf.py cuando hay preload).
+iniciar_carga()
+
 application = server
 
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 8050))
-    print(f"Iniciando servidor Flask-Dash en http://0.0.0.0:{port}")
+    logger.info("Iniciando servidor Flask-Dash en http://0.0.0.0:%s", port)
     server.run(host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,52 @@
+# Configuración compartida de las pruebas. multi_app carga los datos y el modelo al importarse, así
+# que antes de que lo importe cualquier prueba se generan un CSV y un modelo sintéticos (con
+# bench/datos_sinteticos.py) en una carpeta temporal y el entorno apunta a ellos, con la carga en
+# primer plano y sin refresco periódico.
+#
+# Uso:
+#   python -m pytest -q
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, 'bench'))
+
+import datos_sinteticos  # noqa: E402
+
+FILAS_PRUEBA = 20000
+CARPETA_PRUEBA = tempfile.mkdtemp(prefix='pruebas_multi_app_')
+CSV_PRUEBA = os.path.join(CARPETA_PRUEBA, 'citas.csv')
+MODELO_PRUEBA = os.path.join(CARPETA_PRUEBA, 'modelo.pkl')
+
+datos_sinteticos.generar_csv(CSV_PRUEBA, FILAS_PRUEBA, semilla=0)
+datos_sinteticos.entrenar_modelo(MODELO_PRUEBA, filas=5000, semilla=0)
+os.environ.update({
+    'DATOS_CSV_LOCAL': CSV_PRUEBA,
+    'MODELO_LOCAL': MODELO_PRUEBA,
+    'SNAPSHOT_DIR': os.path.join(CARPETA_PRUEBA, 'snapshot'),
+    'CARGA_EN_SEGUNDO_PLANO': '0',
+    'REFRESCO_SEGUNDOS': '0',
+    'LOG_LEVEL': 'WARNING',
+})
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(CARPETA_PRUEBA, ignore_errors=True)
+
+
+@pytest.fixture(scope='session')
+def multi_app():
+    import multi_app
+    multi_app.esperar_carga()
+    assert multi_app.carga_lista() and not multi_app.estado_carga['errores'], multi_app.estado_carga['errores']
+    return multi_app
+
+
+@pytest.fixture
+def cliente(multi_app):
+    return multi_app.server.test_client()
@@ -0,0 +1,17 @@
+# Los archivos de /static/ salen de la ruta incorporada de Flask con Cache-Control max-age
+# STATIC_MAX_AGE y un ETag que permite revalidarlos con un 304.
+
+
+def test_estaticos_con_cache(multi_app, cliente):
+    respuesta = cliente.get('/static/logo.png')
+    assert respuesta.status_code == 200
+    assert respuesta.cache_control.max_age == multi_app.STATIC_MAX_AGE
+    assert respuesta.get_etag()[0] and respuesta.last_modified is not None
+
+    revalidada = cliente.get('/static/logo.png', headers={'If-None-Match': f'"{respuesta.get_etag()[0]}"'})
+    assert revalidada.status_code == 304
+
+
+def test_ruta_estatica_es_la_de_flask(multi_app):
+    reglas = [regla for regla in multi_app.server.url_map.iter_rules() if regla.rule.startswith('/static/')]
+    assert [regla.endpoint for regla in reglas] == ['static']
@@ -0,0 +1,83 @@
+# Con el pool de cálculo saturado (todos los hilos ocupados y la cola llena) una petición nueva no
+# espera: responde 503 con Retry-After, y vuelve a responder cuando se libera un hilo. Una consulta
+# de /api/cruzado ya calculada sale de la caché sin pasar por el pool.
+import threading
+import time
+
+import pytest
+
+
+def lanzar(multi_app, ejecutor, liberar):
+    # Un cálculo que no termina hasta que se libera el evento, pedido desde otra petición; se
+    # espera a que haya tomado su cupo (corriendo o en la cola)
+    en_curso = ejecutor.en_curso
+
+    def peticion():
+        with multi_app.server.test_request_context('/'):
+            ejecutor.ejecutar(liberar.wait, 10)
+
+    hilo = threading.Thread(target=peticion)
+    hilo.start()
+    limite = time.monotonic() + 10
+    while ejecutor.en_curso == en_curso:
+        assert time.monotonic() < limite
+        time.sleep(0.01)
+    return hilo
+
+
+@pytest.mark.parametrize('cola_max', [0, 2])
+def test_pool_saturado_responde_503(multi_app, cliente, monkeypatch, cola_max):
+    ejecutor = multi_app.EjecutorAcotado(1, cola_max)
+    monkeypatch.setattr(multi_app, 'ejecutor_calculo', ejecutor)
+    lote = [{'especialidad': multi_app.especialidades_dic[0], 'edad': 40, 'fecha': '2024-05-10'}]
+
+    liberar = threading.Event()
+    hilos = [lanzar(multi_app, ejecutor, liberar) for _ in range(1 + cola_max)]
+    try:
+        respuesta = cliente.post('/api/predicciones', json=lote)
+        assert respuesta.status_code == 503
+        assert respuesta.headers['Retry-After'] == '1'
+        assert ejecutor.rechazos == 1
+    finally:
+        liberar.set()
+        for hilo in hilos:
+            hilo.join(10)
+
+    assert ejecutor.en_curso == 0
+    respuesta = cliente.post('/api/predicciones', json=lote)
+    assert respuesta.status_code == 200
+    assert 'dias_estimados' in respuesta.get_data(as_text=True)
+
+
+def test_api_cruzado_saturado_responde_503_salvo_desde_la_cache(multi_app, cliente, monkeypatch):
+    ejecutor = multi_app.EjecutorAcotado(1, 0)
+    monkeypatch.setattr(multi_app, 'ejecutor_calculo', ejecutor)
+    multi_app.cache_figuras.invalidar(multi_app.estado_datos.version)
+    meses = multi_app.estado_datos.indice.categorias('MES')
+    consulta = {'filtros': {'SEGURO': ['SI', 'NO'], 'MES': meses[:2]}, 'desglose': 'SEXO'}
+    respuesta = cliente.post('/api/cruzado', json=consulta)
+    assert respuesta.status_code == 200
+    calculada = respuesta.get_json()
+    aciertos = multi_app.cache_figuras.aciertos.get('api_cruzado', 0)
+
+    liberar = threading.Event()
+    hilo = lanzar(multi_app, ejecutor, liberar)
+    try:
+        # Mismos filtros en otro orden y con una columna vacía: misma clave
+        misma = {'filtros': {'MES': meses[1::-1], 'SEGURO': ['NO', 'SI'], 'SEXO': []}, 'desglose': 'SEXO'}
+        respuesta = cliente.post('/api/cruzado', json=misma)
+        assert respuesta.status_code == 200
+        assert respuesta.get_json() == calculada
+        assert multi_app.cache_figuras.aciertos['api_cruzado'] == aciertos + 1
+
+        otra = {'filtros': {'MES': meses[:1]}}
+        respuesta = cliente.post('/api/cruzado', json=otra)
+        assert respuesta.status_code == 503
+        assert respuesta.headers['Retry-After'] == '1'
+    finally:
+        liberar.set()
+        hilo.join(10)
+
+    respuesta = cliente.post('/api/cruzado', json=otra)
+    assert respuesta.status_code == 200
+    assert respuesta.get_json()['filas'] == multi_app.estado_datos.indice.resumen(otra['filtros'])['filas']
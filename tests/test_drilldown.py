@@ -0,0 +1,35 @@
+# Peticiones al servidor por clic en los drill-down (bench/sesion_clics.py): con los callbacks en el
+# servidor cada clic es un POST a _dash-update-component; con DRILLDOWN_EN_NAVEGADOR=1 ninguno, y la
+# figura resuelta en el navegador (si hay node) es la misma que devuelve el callback del servidor.
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from conftest import RAIZ
+
+
+def sesion(tmp_path, modo):
+    entorno = {**os.environ, 'DRILLDOWN_EN_NAVEGADOR': '1' if modo == 'navegador' else '0',
+               'SNAPSHOT_DIR': str(tmp_path / f'snapshot-{modo}')}
+    salida = subprocess.run([sys.executable, os.path.join(RAIZ, 'bench', 'sesion_clics.py'), '--modo', modo],
+                            env=entorno, capture_output=True, text=True, check=True).stdout
+    return json.loads(salida.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize('modo', ['servidor', 'navegador'])
+def test_peticiones_por_clic(tmp_path, record_property, modo):
+    r = sesion(tmp_path, modo)
+    record_property('clics', r['clics'])
+    record_property('peticiones', r['peticiones'])
+    assert r['clics'] > 0
+    if modo == 'servidor':
+        assert r['peticiones'] == r['clics']
+    else:
+        assert r['peticiones'] == 0
+        if shutil.which('node'):
+            assert r['comparadas'] == r['clics']
+    assert r['diferencias'] == 0
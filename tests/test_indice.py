@@ -0,0 +1,72 @@
+# El resumen de filtros cruzados suma histogramas de días de espera por índice en lugar de juntar
+# las esperas de las filas filtradas: filas, media, mediana, p90, desgloses y esperas por categoría
+# son los mismos que calcular sobre las filas del DataFrame. Con particiones, los meses fríos
+# responden desde el resumen guardado junto a cada partición y solo se leen para cruzar columnas.
+import os
+import random
+
+import numpy as np
+import pytest
+
+
+def leer(multi_app):
+    with open(os.environ['DATOS_CSV_LOCAL'], 'rb') as archivo:
+        df, _ = multi_app.leer_csv(archivo)
+    return df
+
+
+def esperado(df, filtros, desglose, espera_por):
+    for columna, valores in filtros.items():
+        df = df[df[columna].astype(str).isin(valores)]
+    espera = df['DIFERENCIA_DIAS'].dropna().to_numpy(dtype=np.float64)
+    return {
+        'filas': len(df),
+        'espera': {'filas': espera.size, 'media': espera.mean(), 'mediana': np.median(espera), 'p90': np.percentile(espera, 90)},
+        'desglose': df[desglose].astype(str).value_counts().to_dict(),
+        'espera_por': df.groupby(df[espera_por].astype(str))['DIFERENCIA_DIAS'].mean().dropna().to_dict(),
+    }
+
+
+def test_resumen_igual_a_calcular_sobre_las_filas(multi_app):
+    df = leer(multi_app)
+    indice = multi_app.IndiceParticionado(multi_app.TablaCompacta.desde_df(df))
+    azar = random.Random(0)
+    columnas = [columna for columna, _ in multi_app.FILTROS_CRUZADOS]
+    for _ in range(20):
+        filtros = {columna: azar.sample(indice.categorias(columna), 2) for columna in azar.sample(columnas, azar.randint(0, 3))}
+        desglose, espera_por = azar.sample(columnas, 2)
+        resumen = indice.resumen(filtros, [desglose], [espera_por])
+        b = esperado(df, filtros, desglose, espera_por)
+        assert resumen['filas'] == b['filas']
+        assert resumen['espera'] == pytest.approx(b['espera'])
+        assert resumen['desglose'][desglose].to_dict() == b['desglose']
+        assert resumen['espera_por'][espera_por]['mean'].to_dict() == pytest.approx(b['espera_por'])
+
+
+def test_meses_frios_responden_desde_su_resumen(multi_app, monkeypatch, tmp_path):
+    monkeypatch.setattr(multi_app, 'SNAPSHOT_DIR', str(tmp_path / 'snapshot'))
+    monkeypatch.setattr(multi_app, 'MESES_RESIDENTES', 3)
+    monkeypatch.setattr(multi_app, 'PARTICIONES_EN_CACHE', 2)
+    df = leer(multi_app)
+    indice = multi_app.cargar_estado_datos().indice
+    frias = indice.frias
+    assert len(frias) > multi_app.PARTICIONES_EN_CACHE
+    assert len(list((tmp_path / 'snapshot' / 'particiones').glob('*.resumen.npz'))) == len(indice.particiones.meses)
+
+    # Sin filtros, con MES o con filtro y desglose sobre una misma columna: no se lee ninguna partición
+    consultas = [({}, 'ESPECIALIDAD', 'SEXO'), ({'MES': frias[:2]}, 'MES', 'MES'), ({'SEGURO': ['SI']}, 'SEGURO', 'MES'),
+                 ({'ESPECIALIDAD': indice.categorias('ESPECIALIDAD')[:3]}, 'ESPECIALIDAD', 'ESPECIALIDAD')]
+    for filtros, desglose, espera_por in consultas:
+        resumen = indice.resumen(filtros, [desglose], [espera_por])
+        b = esperado(df, filtros, desglose, espera_por)
+        assert resumen['filas'] == b['filas']
+        assert resumen['espera'] == pytest.approx(b['espera'])
+        assert resumen['desglose'][desglose].to_dict() == b['desglose']
+        assert resumen['espera_por'][espera_por]['mean'].to_dict() == pytest.approx(b['espera_por'])
+    assert indice.lecturas == 0
+
+    # Cruzar dos columnas dentro de cada mes necesita sus filas
+    filtros = {'SEGURO': ['SI']}
+    resumen = indice.resumen(filtros, ['ESPECIALIDAD'])
+    assert resumen['desglose']['ESPECIALIDAD'].to_dict() == esperado(df, filtros, 'ESPECIALIDAD', 'SEXO')['desglose']
+    assert indice.lecturas == len(frias)
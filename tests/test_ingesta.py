@@ -0,0 +1,52 @@
+# La lectura por bloques con tipos declarados da el mismo DataFrame que leer el CSV completo de una
+# vez y preprocesarlo, y la memoria pico/final de la lectura queda registrada como métrica.
+import io
+
+import pandas as pd
+import pytest
+
+
+def lectura_completa(multi_app, contenido, tipos=None):
+    # Mismos tipos declarados que la lectura por bloques (las categorías salen del CSV crudo)
+    tipos = tipos or multi_app.TIPOS_CSV
+    df = pd.read_csv(io.BytesIO(contenido), usecols=lambda col: col in tipos, dtype=tipos)
+    return multi_app.preprocesar_datos(df).reset_index(drop=True)
+
+
+def comparar(multi_app, df, esperado):
+    assert list(df.columns) == list(esperado.columns)
+    for col in df.columns:
+        if isinstance(esperado[col].dtype, pd.CategoricalDtype):
+            # Las categorías de cada bloque se unen en orden alfabético
+            assert list(df[col].cat.categories) == list(esperado[col].cat.categories), col
+            pd.testing.assert_series_equal(df[col].astype(object), esperado[col].astype(object), check_names=False)
+        else:
+            pd.testing.assert_series_equal(df[col], esperado[col], check_dtype=False, check_names=False)
+
+
+@pytest.mark.parametrize('bloque', [1000, 7000, 1000000])
+def test_lectura_por_bloques_igual_a_lectura_completa(multi_app, monkeypatch, record_property, bloque):
+    monkeypatch.setattr(multi_app, 'TAMANO_BLOQUE_CSV', bloque)
+    with open(multi_app.DATOS_CSV_LOCAL, 'rb') as archivo:
+        contenido = archivo.read()
+    df, pico = multi_app.leer_csv(io.BytesIO(contenido))
+    comparar(multi_app, df, lectura_completa(multi_app, contenido))
+    record_property('pico_lectura_mb', round(pico, 2))
+    record_property('final_mb', round(multi_app._memoria_mb(df), 2))
+    assert pico >= multi_app._memoria_mb(df) > 0
+
+
+def test_valores_no_numericos_con_conversion_tolerante(multi_app):
+    contenido = (b"DIA_SOLICITACITA,EDAD,DIFERENCIA_DIAS,ESPECIALIDAD,PRESENCIAL_REMOTO,SEGURO,ATENDIDO,SEXO\n"
+                 b"2024-01-05,34,12,CARDIOLOGIA,PRESENCIAL,SI,SI,FEMENINO\n"
+                 b"2024-01-06,desconocida,3,UROLOGIA,REMOTO,NO,SI,MASCULINO\n"
+                 b"fecha mala,50,7,UROLOGIA,REMOTO,NO,NO,MASCULINO\n")
+    df, _ = multi_app.leer_csv(io.BytesIO(contenido))
+    tolerantes = {**multi_app.TIPOS_CSV, **{col: 'object' for col in multi_app.COLUMNAS_NUMERICAS}}
+    comparar(multi_app, df, lectura_completa(multi_app, contenido, tolerantes))
+    assert len(df) == 2 and df['EDAD'].isna().sum() == 1
+
+
+def test_memoria_de_la_carga_registrada(multi_app):
+    memoria = multi_app.estado_carga['memoria']
+    assert memoria['pico_lectura_mb'] >= memoria['final_mb'] >= memoria['residente_mb'] > 0
@@ -0,0 +1,31 @@
+# Las figuras iniciales de los layouts salen de conteos por categoría: el JSON que recibe el
+# navegador no crece con la cantidad de citas.
+import os
+
+import pytest
+from plotly.io.json import to_json_plotly
+
+import datos_sinteticos
+
+LAYOUTS = ['layout_edad', 'layout_espera', 'layout_modalidad', 'layout_asegurados']
+
+
+def estado_sintetico(multi_app, carpeta, filas):
+    csv = os.path.join(carpeta, f'citas_{filas}.csv')
+    datos_sinteticos.generar_csv(csv, filas, semilla=1)
+    with open(csv, 'rb') as archivo:
+        df, _ = multi_app.leer_csv(archivo)
+    return multi_app.EstadoDatos(multi_app.TablaCompacta.desde_df(df), multi_app.calcular_citas_por_mes(df), f'prueba-{filas}')
+
+
+def tamano_layout(multi_app, monkeypatch, estado, nombre):
+    monkeypatch.setattr(multi_app, 'estado_datos', estado)
+    return len(to_json_plotly(getattr(multi_app, nombre)()))
+
+
+@pytest.mark.parametrize('nombre', LAYOUTS)
+def test_tamano_del_layout_no_crece_con_las_filas(multi_app, monkeypatch, tmp_path, nombre):
+    chico = tamano_layout(multi_app, monkeypatch, estado_sintetico(multi_app, tmp_path, 2000), nombre)
+    grande = tamano_layout(multi_app, monkeypatch, estado_sintetico(multi_app, tmp_path, 100000), nombre)
+    # 50 veces más citas: solo cambian los dígitos de los conteos
+    assert abs(grande - chico) <= 100, (chico, grande)
@@ -0,0 +1,55 @@
+# clasificar_en_rangos (searchsorted sobre RANGOS_EDAD / RANGOS_DIAS) da las mismas etiquetas que
+# las funciones fila por fila que reemplazó, incluidos NaN, los bordes exactos, negativos e infinitos.
+import numpy as np
+import pandas as pd
+
+
+# Funciones originales de preprocesar_datos (aplicadas con Series.apply)
+def clasificar_edad(edad):
+    if pd.isna(edad): return None
+    if edad < 13: return "Niño"
+    elif edad < 19: return "Adolescente"
+    elif edad < 30: return "Joven"
+    elif edad < 61: return "Adulto"
+    else: return "Adulto mayor"
+
+
+def clasificar_dias_visualizacion(dias):
+    if pd.isna(dias): return None
+    if dias < 10: return "0-9"
+    elif dias < 20: return "10-19"
+    elif dias < 30: return "20-29"
+    elif dias < 40: return "30-39"
+    elif dias < 50: return "40-49"
+    elif dias < 60: return "50-59"
+    elif dias < 70: return "60-69"
+    elif dias < 80: return "70-79"
+    elif dias < 90: return "80-89"
+    else: return "90+"
+
+
+def valores_de_prueba(limites):
+    bordes = [valor for limite in limites for valor in (limite - 1, limite - 0.5, limite, limite + 0.5)]
+    azar = np.random.default_rng(0).uniform(-50, 200, 500)
+    return pd.Series([np.nan, None, -np.inf, np.inf, -1, -0.5, 0, 0.0, 1e9, -1e9, *bordes, *azar], dtype=float)
+
+
+def comparar(multi_app, rangos, anterior):
+    valores = valores_de_prueba([limite for limite, _ in rangos[1:]])
+    nuevo = multi_app.clasificar_en_rangos(valores, rangos)
+    esperado = [anterior(valor) for valor in valores]
+    assert list(pd.Series(nuevo).astype(object).where(pd.notna(nuevo), None)) == esperado
+    assert nuevo.ordered and list(nuevo.categories) == multi_app.etiquetas_rangos(rangos)
+
+
+def test_rango_de_edad_igual_a_la_funcion_anterior(multi_app):
+    comparar(multi_app, multi_app.RANGOS_EDAD, clasificar_edad)
+
+
+def test_rango_de_dias_igual_a_la_funcion_anterior(multi_app):
+    comparar(multi_app, multi_app.RANGOS_DIAS, clasificar_dias_visualizacion)
+
+
+def test_texto_no_numerico_queda_sin_rango(multi_app):
+    resultado = multi_app.clasificar_en_rangos(pd.Series(['12', 'abc', None, '61']), multi_app.RANGOS_EDAD)
+    assert list(pd.Series(resultado).astype(object).where(pd.notna(resultado), None)) == ['Niño', None, None, 'Adulto mayor']
@@ -0,0 +1,103 @@
+# Un refresco incremental (cola del CSV, filas de un mes frío o marca de agua) y uno completo (fuente
+# reescrita) dejan el mismo estado que reconstruir todo desde el CSV: filas, agregados de los
+# drill-down, citas por mes, rollups e índice de filtros cruzados.
+import json
+import os
+import random
+
+import pandas as pd
+import pytest
+
+
+def reconstruir(multi_app, csv):
+    with open(csv, 'rb') as archivo:
+        df, _ = multi_app.leer_csv(archivo)
+    return multi_app.EstadoDatos(multi_app.TablaCompacta.desde_df(df), multi_app.calcular_citas_por_mes(df), None)
+
+
+def comparar_agregados(actual, esperado):
+    assert sorted(actual) == sorted(esperado)
+    for clave, valor in esperado.items():
+        if isinstance(valor, pd.DataFrame):
+            pd.testing.assert_frame_equal(actual[clave], valor, check_dtype=False, check_index_type=False, check_names=False)
+        else:
+            pd.testing.assert_series_equal(actual[clave], valor, check_dtype=False, check_index_type=False, check_names=False)
+
+
+def comparar(multi_app, estado, csv):
+    esperado = reconstruir(multi_app, csv)
+    assert estado.filas == esperado.filas
+
+    for nombre, valor in esperado.agregados.items():
+        if nombre == 'histograma_espera':
+            for columna in multi_app.COLUMNAS_CUANTILES:
+                pd.testing.assert_frame_equal(estado.agregados[nombre].percentiles({}, columna), valor.percentiles({}, columna))
+        elif nombre == 'conteos_categorias':
+            for columna, tabla in valor.items():
+                pd.testing.assert_frame_equal(estado.agregados[nombre][columna].reset_index(drop=True), tabla, check_dtype=False)
+        else:
+            comparar_agregados(estado.agregados[nombre], valor)
+
+    for tabla in (estado.citas_por_mes, esperado.citas_por_mes):
+        tabla['MES'] = tabla['MES'].astype(str)
+    pd.testing.assert_frame_equal(estado.citas_por_mes.reset_index(drop=True), esperado.citas_por_mes.reset_index(drop=True),
+                                  check_dtype=False)
+
+    for resolucion in multi_app.RESOLUCIONES_TIEMPO:
+        pd.testing.assert_frame_equal(estado.rollups.serie(resolucion), esperado.rollups.serie(resolucion))
+    desde, hasta = esperado.rollups.limites()
+    assert estado.rollups.rango(desde, hasta)['total'] == esperado.rollups.rango(desde, hasta)['total']
+
+    azar = random.Random(0)
+    columnas = [columna for columna, _ in multi_app.FILTROS_CRUZADOS]
+    for _ in range(20):
+        filtros = {columna: azar.sample(esperado.indice.categorias(columna), 2) for columna in azar.sample(columnas, azar.randint(0, 2))}
+        a = estado.indice.resumen(filtros, ['ESPECIALIDAD', 'MES'], ['SEXO'])
+        b = esperado.indice.resumen(filtros, ['ESPECIALIDAD', 'MES'], ['SEXO'])
+        assert a['filas'] == b['filas']
+        assert a['espera'] == pytest.approx(b['espera'])
+        comparar_agregados(a['desglose'], b['desglose'])
+        comparar_agregados(a['espera_por'], b['espera_por'])
+
+
+@pytest.mark.parametrize('meses_residentes', [0, 6])
+def test_refresco_igual_a_reconstruir(multi_app, monkeypatch, tmp_path, meses_residentes):
+    with open(os.environ['DATOS_CSV_LOCAL'], encoding='utf-8') as f:
+        lineas = f.readlines()
+    csv = tmp_path / 'citas.csv'
+    monkeypatch.setattr(multi_app, 'DATOS_CSV_LOCAL', str(csv))
+    monkeypatch.setattr(multi_app, 'SNAPSHOT_DIR', str(tmp_path / 'snapshot'))
+    monkeypatch.setattr(multi_app, 'MESES_RESIDENTES', meses_residentes)
+
+    csv.write_text(''.join(lineas[:15001]), encoding='utf-8')
+    monkeypatch.setattr(multi_app, 'estado_datos', multi_app.cargar_estado_datos())
+    comparar(multi_app, multi_app.estado_datos, csv)
+    if meses_residentes:
+        assert multi_app.estado_datos.particiones.frias()
+
+    # Filas nuevas al final del CSV: se lee solo la cola
+    with open(csv, 'a', encoding='utf-8') as f:
+        f.writelines(lineas[15001:18001])
+    assert multi_app.refrescar_datos() == 'incremental'
+    comparar(multi_app, multi_app.estado_datos, csv)
+
+    # La cola trae fechas de los primeros meses (fríos con meses_residentes=6)
+    with open(csv, 'a', encoding='utf-8') as f:
+        f.writelines(lineas[5:200])
+    assert multi_app.refrescar_datos() == 'incremental'
+    comparar(multi_app, multi_app.estado_datos, csv)
+
+    # Sin bytes_fuente en el manifiesto: filas nuevas según la marca de agua de DIA_SOLICITACITA
+    ruta_manifiesto = tmp_path / 'snapshot' / 'manifiesto.json'
+    manifiesto = json.loads(ruta_manifiesto.read_text(encoding='utf-8'))
+    manifiesto['bytes_fuente'] = None
+    ruta_manifiesto.write_text(json.dumps(manifiesto), encoding='utf-8')
+    contenido = csv.read_text(encoding='utf-8').splitlines(keepends=True)
+    csv.write_text(''.join(contenido[:15001] + contenido[-195:] + contenido[15001:-195] + lineas[18001:]), encoding='utf-8')
+    assert multi_app.refrescar_datos() == 'incremental'
+    comparar(multi_app, multi_app.estado_datos, csv)
+
+    # Fuente reescrita (falta una fila vieja): carga completa
+    csv.write_text(''.join(lineas[:10000] + lineas[10001:]), encoding='utf-8')
+    assert multi_app.refrescar_datos() == 'completo'
+    comparar(multi_app, multi_app.estado_datos, csv)
@@ -0,0 +1,51 @@
+# Un worker que no refresca sigue usando las particiones de la versión que cargó mientras otro
+# guarda versiones nuevas: sus archivos se conservan durante varias versiones y, si ya se borraron,
+# los meses fríos se leen de la versión vigente del manifiesto y el refresco pasa a carga completa.
+import os
+
+import pytest
+
+
+def lineas_del_mes(lineas, mes):
+    columna = lineas[0].strip().split(',').index('DIA_SOLICITACITA')
+    return [linea for linea in lineas[1:] if linea.split(',')[columna].startswith(mes)]
+
+
+def test_worker_sin_refrescar(multi_app, monkeypatch, tmp_path):
+    with open(os.environ['DATOS_CSV_LOCAL'], encoding='utf-8') as f:
+        lineas = f.readlines()
+    csv = tmp_path / 'citas.csv'
+    snapshot = tmp_path / 'snapshot'
+    monkeypatch.setattr(multi_app, 'DATOS_CSV_LOCAL', str(csv))
+    monkeypatch.setattr(multi_app, 'SNAPSHOT_DIR', str(snapshot))
+    monkeypatch.setattr(multi_app, 'MESES_RESIDENTES', 6)
+
+    csv.write_text(''.join(lineas[:15001]), encoding='utf-8')
+    retrasado = multi_app.cargar_estado_datos()
+    monkeypatch.setattr(multi_app, 'estado_datos', retrasado)
+    mes = retrasado.particiones.frias()[0]
+    agregadas = lineas_del_mes(lineas, mes) # Filas repetidas del mismo mes (el CSV está ordenado por fecha)
+    archivo = snapshot / 'particiones' / retrasado.particiones.archivos[mes]['archivo']
+
+    # Otro worker agrega filas al mes frío en cada refresco; el archivo del retrasado sobrevive a
+    # las VERSIONES_CONSERVADAS versiones siguientes además de la que lo reemplaza
+    refrescos = 0
+    while archivo.exists():
+        with open(csv, 'a', encoding='utf-8') as f:
+            f.writelines(agregadas[refrescos * 5:(refrescos + 1) * 5])
+        assert multi_app.refrescar_datos() == 'incremental'
+        refrescos += 1
+        assert refrescos <= multi_app.VERSIONES_CONSERVADAS + 2
+    assert refrescos == multi_app.VERSIONES_CONSERVADAS + 2
+    vigente = multi_app.estado_datos
+
+    # Consultas del worker retrasado: el mes frío sale de la versión vigente
+    a = retrasado.indice.resumen({'MES': [mes]})
+    b = vigente.indice.resumen({'MES': [mes]})
+    assert a['filas'] == b['filas'] > retrasado.particiones.archivos[mes]['filas']
+    assert a['espera'] == pytest.approx(b['espera'])
+
+    # Su refresco no puede releer el mes frío que cargó: hace una carga completa
+    monkeypatch.setattr(multi_app, 'estado_datos', retrasado)
+    assert multi_app.refrescar_datos() == 'completo'
+    assert multi_app.estado_datos.filas == vigente.filas
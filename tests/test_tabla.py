@@ -0,0 +1,34 @@
+# El diccionario de ESPECIALIDAD de la TablaCompacta sigue los códigos de especialidades_dic: el
+# código de una especialidad conocida es el ESPECIALIDAD_cod del modelo, también después de unir
+# tablas con especialidades que no están en el diccionario.
+import numpy as np
+import pandas as pd
+
+
+def tabla(multi_app, especialidades):
+    df = pd.DataFrame({'ESPECIALIDAD': pd.Categorical(especialidades)})
+    return multi_app.TablaCompacta.desde_df(df)
+
+
+def test_codigos_de_especialidad_son_los_del_modelo(multi_app):
+    datos = multi_app.estado_datos.tabla
+    codigo_por_nombre = {nombre: codigo for codigo, nombre in multi_app.especialidades_dic.items()}
+    codigos = datos.codigos['ESPECIALIDAD'][datos.codigos['ESPECIALIDAD'] >= 0]
+    nombres = np.array(datos.diccionarios['ESPECIALIDAD'], dtype=object)[codigos]
+    for nombre, codigo in zip(nombres, codigos):
+        # Las que no están en especialidades_dic van después del último código del modelo
+        assert codigo == codigo_por_nombre[nombre] if nombre in codigo_por_nombre else codigo >= len(codigo_por_nombre)
+    assert datos.categorias('ESPECIALIDAD') == tuple(sorted(datos.diccionarios['ESPECIALIDAD']))
+
+
+def test_unir_con_especialidades_desconocidas(multi_app):
+    a = tabla(multi_app, ['UROLOGIA', 'ZOOLOGIA', None, 'ADOLESCENTE'])
+    b = tabla(multi_app, ['AAA NUEVA', 'CARDIOLOGIA'])
+    unida = multi_app.TablaCompacta.unir([a, b])
+    n = len(multi_app.especialidades_dic)
+    assert unida.diccionarios['ESPECIALIDAD'][n:] == ('AAA NUEVA', 'ZOOLOGIA')
+    assert list(unida.codigos['ESPECIALIDAD']) == [61, n + 1, -1, 0, n, 2]
+    # Los agregados listan las especialidades en orden alfabético
+    listados = unida.codigos_listados('ESPECIALIDAD')
+    nombres = [unida.categorias('ESPECIALIDAD')[c] if c >= 0 else None for c in listados]
+    assert nombres == ['UROLOGIA', 'ZOOLOGIA', None, 'ADOLESCENTE', 'AAA NUEVA', 'CARDIOLOGIA']